@@ -0,0 +1,141 @@
+import numpy as np
+import argparse
+import contextlib
+import os
+import time
+
+from Functions.Features import Features, FeaturePlotter, FeatureComparator
+from Functions.Loader import load_store
+from Functions.Profiling import Profiler, stage
+
+
+# Headless version of BatchStatistics.ipynb, e.g.
+#   python -m Functions.Batch ./Data/CompleteData/Test_run ./Data/CompleteData/Test_box --only-physiological --workers 4
+# Only numpy and scipy are imported to compute, pandas (tables) and matplotlib (--plots) when they are used
+
+formats = ('parquet', 'arrow', 'csv')
+
+def _save_table(results:np.ndarray, path:str, format:str):
+    # One structured array (e.g. permutation results) as a table
+    import pandas as pd
+    table = pd.DataFrame({name: results[name] for name in results.dtype.names})
+    for name in results.dtype.names:
+        if results.dtype[name].kind == 'U':
+            table[name] = table[name].astype('string')
+    if format == 'parquet':
+        table.to_parquet(path, index=False)
+    elif format == 'arrow':
+        table.to_feather(path)
+    else:
+        table.to_csv(path, index=False)
+
+def _log(message:str, start:float):
+    print(f'[{time.perf_counter() - start:8.2f} s] {message}', flush=True)
+
+def run_pipeline(acc_dir:str, box_dir:str, output:str = './Export/', only_physiological:bool = False, workers:int = None, output_formats:tuple[str, ...] = ('parquet',),
+                 legacy_csv:bool = False, n_permutations:int = 10000, seed:int = None, plots:bool = False, use_cache:bool = True, signal_dir:str = None) -> dict[str, str]:
+    """
+    Run the whole analysis of BatchStatistics.ipynb without a notebook: load
+    the accelerometer and box runs, compute the features and the RT
+    distributions of every level, compare the two (correlations, permutation
+    tests, paired differences) and export the results. With a signal store,
+    the vibration quality of every accelerometer run is added to its features.
+
+    Parameters:
+        acc_dir (str): Directory of the accelerometer .mat files.
+        box_dir (str): Directory of the response box .mat files.
+        output (str): Output folder, with the subfolders Accelerometer, Box and Comparison.
+        only_physiological (bool): Only keep the physiological RTs.
+        workers (int): Number of processes of the loading, normality and permutation stages (None uses every CPU).
+        output_formats (tuple[str, ...]): Table formats, 'parquet', 'arrow' and/or 'csv'.
+        legacy_csv (bool): Also save the CSV files of save_all_to_csv.
+        n_permutations (int): Permutations of each permutation test (0 skips them).
+        seed (int): Seed of the permutation tests.
+        plots (bool): Also render the figures of every level (in output/Images).
+        use_cache (bool): Read and write the cache of the parsed .mat files.
+        signal_dir (str): Signal store of the raw accelerometer signals (see SignalStore.convert_directory), None to skip the vibration quality.
+
+    Returns:
+        dict[str, str]: Name > folder of the outputs.
+    """
+    for format in output_formats:
+        if format not in formats:
+            raise ValueError(f"Unknown format '{format}', expected one of {list(formats)}")
+
+    start = time.perf_counter()
+    folders = {name: os.path.join(output, name) for name in ('Accelerometer', 'Box', 'Comparison')}
+    for folder in folders.values():
+        os.makedirs(folder, exist_ok=True)
+
+    with stage('Batch.load', 'load'):
+        acc = load_store(acc_dir, kind='acc', workers=workers, use_cache=use_cache)
+        box = load_store(box_dir, kind='box', workers=workers, use_cache=use_cache)
+    _log(f'Loaded {len(acc.runs)} accelerometer runs and {len(box.runs)} box runs', start)
+
+    feature_acc = Features(acc, only_physiological=only_physiological, accelerometer=True)
+    feature_box = Features(box, only_physiological=only_physiological)
+    for features, name in ((feature_acc, 'Accelerometer'), (feature_box, 'Box')):
+        features.normality_workers = workers
+        features.calculate_all_features()
+        features.calculate_sequential_effects()
+        if name == 'Accelerometer' and signal_dir is not None:
+            from Functions.SignalStore import SignalStore
+            quality = features.calculate_vibration_quality(SignalStore(signal_dir), workers)
+            _log(f"Flagged {np.count_nonzero(quality['bad_stimulus'])} of {np.count_nonzero(quality['n_trials'])} runs with a raw signal as bad stimuli", start)
+        for format in output_formats:
+            features.save_all(folders[name], format)
+        for level, table in features.fit_distributions().items():
+            for format in output_formats:
+                _save_table(table, os.path.join(folders[name], f'{level}_distributions.{format}'), format)
+        if legacy_csv:
+            features.save_all_to_csv(folders[name] + '/')
+        _log(f'Saved the {name.lower()} features', start)
+
+    comparator = FeatureComparator(feature_acc, feature_box)
+    results = {
+        'run_paired_differences': comparator.calculate_paired_differences('run'),
+        'subject_paired_differences': comparator.calculate_paired_differences('subject'),
+    }
+    if n_permutations > 0:
+        comparator.subject_permuations(n_permutations, seed=seed, workers=workers, verbose=False)
+        comparator.run_permutations(n_permutations, seed=seed, workers=workers, verbose=False)
+        results['subject_permutations'] = comparator.subject_permutation_results
+        results['run_permutations'] = comparator.run_permutation_results
+        _log(f'Ran the permutation tests of {len(comparator.common_subjects)} common subjects', start)
+    for name, table in results.items():
+        for format in output_formats:
+            _save_table(table, os.path.join(folders['Comparison'], f'{name}.{format}'), format)
+    _log('Saved the comparison', start)
+
+    if plots:
+        folders['Images'] = os.path.join(output, 'Images')
+        for features, name in ((feature_acc, 'Accelerometer'), (feature_box, 'Box')):
+            FeaturePlotter(features).render_all(os.path.join(folders['Images'], name), workers=workers)
+        _log('Rendered the figures', start)
+
+    return folders
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute and export the features of the accelerometer and box runs, and compare them.')
+    parser.add_argument('acc_dir', help='directory of the accelerometer .mat files')
+    parser.add_argument('box_dir', help='directory of the response box .mat files')
+    parser.add_argument('--output', default='./Export/', help='output folder')
+    parser.add_argument('--workers', type=int, help='processes (default: every CPU)')
+    parser.add_argument('--only-physiological', action='store_true', help='only keep the physiological RTs')
+    parser.add_argument('--formats', nargs='+', choices=formats, default=['parquet'], help='table formats')
+    parser.add_argument('--legacy-csv', action='store_true', help='also save the CSV files of save_all_to_csv')
+    parser.add_argument('--permutations', type=int, default=10000, help='permutations of the permutation tests (0 to skip them)')
+    parser.add_argument('--seed', type=int, help='seed of the permutation tests')
+    parser.add_argument('--plots', action='store_true', help='also render the figures')
+    parser.add_argument('--no-cache', action='store_true', help='parse every .mat file again')
+    parser.add_argument('--signals', help='signal store of the raw accelerometer signals, for the vibration quality')
+    parser.add_argument('--profile', help='JSON file of the time spent in each stage')
+    arguments = parser.parse_args()
+
+    profiler = Profiler() if arguments.profile is not None else None
+    with profiler if profiler is not None else contextlib.nullcontext():
+        run_pipeline(arguments.acc_dir, arguments.box_dir, arguments.output, arguments.only_physiological, arguments.workers, tuple(arguments.formats),
+                     arguments.legacy_csv, arguments.permutations, arguments.seed, arguments.plots, not arguments.no_cache, arguments.signals)
+    if profiler is not None:
+        profiler.save_json(arguments.profile)
+        profiler.print_summary()
@@ -0,0 +1,196 @@
+import numpy as np
+import argparse
+import contextlib
+import datetime
+import inspect
+import io
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+
+from Functions.Features import Features, FeatureComparator
+from Functions.Synthetic import make_cohort
+
+
+default_sizes = [10, 100, 1000, 10000] # Subjects
+
+def _needs_inputs(method:Callable) -> bool:
+    # Methods with required arguments (e.g. the signals of calculate_vibration_quality) cannot be called on a cohort alone
+    return any(parameter.default is parameter.empty and parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)
+               for parameter in list(inspect.signature(method).parameters.values())[1:])
+
+def _features_methods(prefix:str) -> list[str]:
+    # Public methods of Features with a prefix, so new calculate_* and save_* methods are timed too
+    return sorted(name for name in dir(Features) if name.startswith(prefix) and callable(getattr(Features, name)) and not _needs_inputs(getattr(Features, name)))
+
+def _comparator_methods() -> list[str]:
+    return sorted(name for name in dir(FeatureComparator) if (name.startswith('calculate_') or 'permu' in name) and not name.startswith(('_', 'print')))
+
+def _git_version() -> str:
+    # Commit of the code being measured, to compare the results of two versions
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _targets(acc:dict, box:dict, only_physiological:bool, n_permutations:int, folder:str) -> dict[str, Callable[[], Callable[[], object]]]:
+    """
+    Every method to measure. Each target prepares fresh objects (not measured)
+    and returns the call to measure, so that no level is already cached.
+    """
+    def features(computed:bool = False) -> Features:
+        features = Features(acc, only_physiological=only_physiological, accelerometer=True)
+        if computed:
+            features.calculate_all_features()
+        return features
+
+    def comparator() -> FeatureComparator:
+        feature_acc = features(computed=True)
+        feature_box = Features(box, only_physiological=only_physiological)
+        feature_box.calculate_all_features()
+        return FeatureComparator(feature_acc, feature_box)
+
+    targets = dict()
+    for name in _features_methods('calculate_'):
+        targets[f'Features.{name}'] = lambda name=name: getattr(features(), name)
+    for name in _features_methods('save_'):
+        targets[f'Features.{name}'] = lambda name=name: (lambda method=getattr(features(computed=True), name): method(folder + '/'))
+    for name in _comparator_methods():
+        if 'permu' in name:
+            targets[f'FeatureComparator.{name}'] = lambda name=name: (lambda method=getattr(comparator(), name): method(n_permutations, seed=0, verbose=False))
+        else:
+            targets[f'FeatureComparator.{name}'] = lambda name=name: getattr(comparator(), name)
+    return targets
+
+def _measure(prepare:Callable[[], Callable[[], object]], repeat:int, memory:bool) -> dict[str, float]:
+    # Best wall and CPU time of repeat calls, then the peak memory of one more call (tracemalloc slows the call down)
+    seconds = []
+    cpu_seconds = []
+    for _ in range(repeat):
+        call = prepare()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start, cpu_start = time.perf_counter(), time.process_time()
+            call()
+            seconds.append(time.perf_counter() - start)
+            cpu_seconds.append(time.process_time() - cpu_start)
+
+    peak = None
+    if memory:
+        call = prepare()
+        with contextlib.redirect_stdout(io.StringIO()):
+            tracemalloc.start()
+            try:
+                call()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    return {'seconds': min(seconds), 'cpu_seconds': min(cpu_seconds), 'peak_bytes': peak}
+
+def run_benchmarks(sizes:list[int] = default_sizes, n_runs:int = 2, n_trials:int = 200, acc_missing:float = 0.05, box_missing:float = 0.02,
+                   only_physiological:bool = True, n_permutations:int = 1000, repeat:int = 1, memory:bool = True, targets:list[str] = None,
+                   seed:int = 0, verbose:bool = True) -> dict:
+    """
+    Time every calculate_*, save_* and permutation method of Features and
+    FeatureComparator on synthetic cohorts of increasing size (make_cohort).
+
+    Parameters:
+        sizes (list[int]): Numbers of subjects.
+        n_runs (int): Runs per subject.
+        n_trials (int): Trials per run.
+        acc_missing (float): Fraction of trials without accelerometer onsets.
+        box_missing (float): Fraction of trials without a press.
+        only_physiological (bool): Only keep the RTs within the limits, as the notebook.
+        n_permutations (int): Permutations of the permutation tests.
+        repeat (int): Calls per method, the best time is kept.
+        memory (bool): Also measure the peak memory allocated by each method (one more call).
+        targets (list[str]): Only the methods containing one of these names (all by default).
+        seed (int): Seed of the synthetic cohorts.
+        verbose (bool): Print each result.
+
+    Returns:
+        dict: 'environment', 'parameters' and 'results' (one row per size and method, with
+            'seconds', 'cpu_seconds' and 'peak_bytes'), as saved by save_results.
+    """
+    parameters = {'sizes': list(sizes), 'n_runs': n_runs, 'n_trials': n_trials, 'acc_missing': acc_missing, 'box_missing': box_missing,
+                  'only_physiological': only_physiological, 'n_permutations': n_permutations, 'repeat': repeat, 'seed': seed}
+    environment = {'version': _git_version(), 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                   'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(), 'system': platform.system()}
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            start = time.perf_counter()
+            acc, box = make_cohort(size, n_runs, n_trials, acc_missing, box_missing, seed=seed)
+            if verbose:
+                print(f'{size} subjects: cohort generated in {time.perf_counter() - start:.3f} s')
+
+            for target, prepare in _targets(acc, box, only_physiological, n_permutations, folder).items():
+                if targets is not None and not any(name in target for name in targets):
+                    continue
+                row = {'subjects': size, 'runs': size * n_runs, 'trials': size * n_runs * n_trials, 'target': target}
+                row.update(_measure(prepare, repeat, memory))
+                results.append(row)
+                if verbose:
+                    peak = '' if row['peak_bytes'] is None else f", peak {row['peak_bytes'] / 2**20:.1f} MiB"
+                    print(f"\t{target}: {row['seconds']:.4f} s{peak}")
+
+    return {'environment': environment, 'parameters': parameters, 'results': results}
+
+def save_results(results:dict, path:str):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=4)
+
+def load_results(path:str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+def compare_results(baseline:dict, current:dict, tolerance:float = 0.2) -> list[dict]:
+    """
+    Compare two benchmark results (e.g. two versions) on the methods and sizes they share.
+
+    Parameters:
+        baseline (dict): Results of the reference version.
+        current (dict): Results of the new version.
+        tolerance (float): Relative change below which a method is unchanged.
+
+    Returns:
+        list[dict]: One row per size and method with both times, the ratio and
+            'status' ('regression', 'improvement' or 'unchanged').
+    """
+    reference = {(row['subjects'], row['target']): row for row in baseline['results']}
+    comparison = []
+    for row in current['results']:
+        key = (row['subjects'], row['target'])
+        if key not in reference:
+            continue
+        before, after = reference[key]['seconds'], row['seconds']
+        ratio = after / before if before > 0 else np.inf
+        status = 'regression' if ratio > 1 + tolerance else 'improvement' if ratio < 1 / (1 + tolerance) else 'unchanged'
+        comparison.append({'subjects': key[0], 'target': key[1], 'baseline_seconds': before, 'seconds': after, 'ratio': ratio, 'status': status})
+    return comparison
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Features and FeatureComparator on synthetic cohorts.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help='numbers of subjects')
+    parser.add_argument('--runs', type=int, default=2, help='runs per subject')
+    parser.add_argument('--trials', type=int, default=200, help='trials per run')
+    parser.add_argument('--permutations', type=int, default=1000, help='permutations of the permutation tests')
+    parser.add_argument('--repeat', type=int, default=1, help='calls per method (best time)')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure the peak memory')
+    parser.add_argument('--targets', nargs='+', help='only the methods containing these names')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file of the results')
+    parser.add_argument('--baseline', help='JSON file of earlier results to compare with')
+    arguments = parser.parse_args()
+
+    results = run_benchmarks(arguments.sizes, arguments.runs, arguments.trials, n_permutations=arguments.permutations,
+                             repeat=arguments.repeat, memory=not arguments.no_memory, targets=arguments.targets)
+    save_results(results, arguments.output)
+
+    if arguments.baseline is not None:
+        for row in compare_results(load_results(arguments.baseline), results):
+            if row['status'] != 'unchanged':
+                print(f"{row['status']}: {row['target']} ({row['subjects']} subjects) {row['baseline_seconds']:.4f} s > {row['seconds']:.4f} s (x{row['ratio']:.2f})")
@@ -0,0 +1,287 @@
+import numpy as np
+
+from Functions.Profiling import count, profiled
+
+
+class _Level():
+    # One level of groups of a bootstrap, each (group, condition) is a segment of sorted keys, the numerator first
+
+    def __init__(self, values:np.ndarray, numerator:np.ndarray, group:np.ndarray, n_groups:int, stratum:np.ndarray, n_strata:int, units:np.ndarray = None):
+        self.n_groups = n_groups
+        segment = 2 * group + ~numerator
+        n_segments = 2 * n_groups
+
+        # Segment of each block (numerator blocks of all the strata, then denominator blocks)
+        stratum_group = np.full(n_strata, -1, dtype=np.intp)
+        stratum_group[stratum] = group
+        if np.any(stratum_group[stratum] != group):
+            raise ValueError('A group must only contain whole strata')
+        block_segment = 2 * np.tile(stratum_group, 2) + np.repeat([0, 1], n_strata)
+
+        # Trials sorted by segment and value, for the estimates and the jackknife
+        order = np.lexsort((values, segment))
+        self.segment = segment[order]
+        self.values = values[order]
+        self.units = None if units is None else units[order]
+        self.count = np.bincount(segment, minlength=n_segments)
+        self.start = np.cumsum(self.count) - self.count
+        self.not_empty = self.count > 0
+
+        # Blocks sorted by segment, so that the block sums of a segment are consecutive
+        self.block_order = np.argsort(block_segment, kind='stable')
+        self.block_bounds = np.searchsorted(block_segment[self.block_order], np.flatnonzero(self.not_empty))
+
+        # Rows of draws: one per segment, in the order of its blocks, which are consecutive or gathered (the last block is empty)
+        blocks = np.split(self.block_order, np.cumsum(np.bincount(block_segment, minlength=n_segments))[:-1])
+        blocks = sorted((row for row in blocks if len(row)), key=lambda row: row[0])
+        self.row_segment = block_segment[[row[0] for row in blocks]]
+        self.layout = np.full((len(blocks), max([len(row) for row in blocks], default=1)), len(block_segment), dtype=np.intp)
+        for i, row in enumerate(blocks):
+            self.layout[i, :len(row)] = row
+        self.contiguous = np.array_equal(self.layout.ravel(), np.arange(self.layout.size))
+
+        # Columns: the distinct values of each segment
+        new = np.ones(len(values), dtype=bool)
+        new[1:] = (self.segment[1:] != self.segment[:-1]) | (self.values[1:] != self.values[:-1])
+        self.column_value = self.values[new]
+        self.column_start = np.searchsorted(self.segment[new], np.arange(n_segments))
+        self.trial_column = np.cumsum(new) - 1
+
+    def ratios(self, keys:np.ndarray, block_sums:np.ndarray, by_rank:np.ndarray) -> dict[str, np.ndarray]:
+        # 'mean' and 'median' ratio of every group for a batch of resamples (NaN if a condition is empty)
+        n_resamples = len(keys)
+        mean = np.full((n_resamples, len(self.count)), np.nan)
+        median = np.full((n_resamples, len(self.count)), np.nan)
+
+        if self.not_empty.any():
+            mean[:, self.not_empty] = np.add.reduceat(block_sums[:, self.block_order], self.block_bounds, axis=1) / self.count[self.not_empty]
+
+            if self.contiguous:
+                rows = keys[:, :self.layout.size].reshape(n_resamples, len(self.layout), -1)
+                if self.layout.shape[1] > 1:
+                    rows = np.sort(rows, axis=-1)
+            else:
+                rows = keys[:, self.layout].reshape(n_resamples, len(self.layout), -1)
+                rows.sort(axis=-1)
+            # The empty slots have the largest key, so the draws of a row are at its start
+            row = np.flatnonzero(self.count[self.row_segment])
+            count = self.count[self.row_segment[row]]
+            median[:, self.row_segment[row]] = (by_rank[rows[:, row, (count - 1) // 2]] + by_rank[rows[:, row, count // 2]]) / 2
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {'mean': mean[:, 0::2] / mean[:, 1::2], 'median': median[:, 0::2] / median[:, 1::2]}
+
+    def estimates(self) -> dict[str, np.ndarray]:
+        # Ratios of the means and of the medians of the trials
+        not_empty = self.not_empty
+        start, count = self.start[not_empty], self.count[not_empty]
+        mean = np.full(len(self.count), np.nan)
+        median = np.full(len(self.count), np.nan)
+        mean[not_empty] = np.bincount(self.segment, weights=self.values, minlength=len(self.count))[not_empty] / count
+        median[not_empty] = (self.values[start + (count - 1) // 2] + self.values[start + count // 2]) / 2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {'mean': mean[0::2] / mean[1::2], 'median': median[0::2] / median[1::2]}, mean, median
+
+    def jackknife(self) -> tuple[dict[str, np.ndarray], np.ndarray]:
+        # Ratios of each group without each one of its units (the groups of the level below), or trials without units
+        if self.units is not None:
+            return self._unit_jackknife()
+
+        _, mean, median = self.estimates()
+        segment = self.segment
+        n = self.count[segment]
+        rank = np.arange(len(self.values)) - self.start[segment]
+
+        total = np.bincount(segment, weights=self.values, minlength=len(self.count))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_without = (total[segment] - self.values) / (n - 1)
+
+        # The q-th of the other n - 1 trials is the q-th or the (q + 1)-th trial of the segment
+        several = n > 1
+        median_without = np.zeros(len(self.values))
+        for q in ((n - 2) // 2, (n - 1) // 2):
+            index = self.start[segment] + q + (q >= rank)
+            median_without += self.values[np.where(several, index, 0)] / 2
+        median_without[~several] = np.nan
+
+        # The other condition of the group is unchanged
+        other = segment ^ 1
+        numerator = segment % 2 == 0
+        jackknife = dict()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for statistic, whole, without in (('mean', mean, mean_without), ('median', median, median_without)):
+                jackknife[statistic] = np.where(numerator, without / whole[other], whole[other] / without)
+        return jackknife, segment // 2
+
+    def _unit_jackknife(self) -> tuple[dict[str, np.ndarray], np.ndarray]:
+        # Without a unit, both conditions of its group lose its trials: one row per unit and condition
+        n_units = int(self.units.max(initial=-1)) + 1
+        unit_group = np.zeros(n_units, dtype=np.intp)
+        unit_group[self.units] = self.segment // 2
+        row = 2 * self.units + self.segment % 2
+        row_segment = 2 * np.repeat(unit_group, 2) + np.tile([0, 1], n_units)
+        n = self.count[row_segment] - np.bincount(row, minlength=2 * n_units)
+        total = np.bincount(self.segment, weights=self.values, minlength=len(self.count))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_without = (total[row_segment] - np.bincount(row, weights=self.values, minlength=2 * n_units)) / n
+
+        # Counts of the columns of the segment of each row, without the trials of the unit
+        column_end = np.append(self.column_start[1:], len(self.column_value))
+        width = (column_end - self.column_start)[row_segment]
+        row_start = np.cumsum(width) - width
+        column = np.repeat(self.column_start[row_segment] - row_start, width) + np.arange(width.sum())
+        remaining = np.bincount(self.trial_column, minlength=len(self.column_value))[column]
+        np.subtract.at(remaining, row_start[row] + self.trial_column - self.column_start[self.segment], 1)
+        cumulative = np.cumsum(remaining)
+        before = np.append(0, cumulative)[row_start]
+
+        median_without = np.zeros(len(n))
+        for rank in ((n - 1) // 2, n // 2):
+            position = np.clip(np.searchsorted(cumulative, before + rank, side='right'), 0, max(len(column) - 1, 0))
+            median_without += self.column_value[column[position]] / 2 if len(column) else np.nan
+        median_without[n == 0] = np.nan
+
+        jackknife = dict()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for statistic, without in (('mean', mean_without), ('median', median_without)):
+                jackknife[statistic] = without[0::2] / without[1::2]
+        return jackknife, unit_group
+
+def _acceleration(jackknife:np.ndarray, group:np.ndarray, n_groups:int) -> np.ndarray:
+    # Acceleration of the BCa interval of each group, from its jackknife ratios (NaN ones are left out)
+    valid = ~np.isnan(jackknife)
+    group, jackknife = group[valid], jackknife[valid]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(group, weights=jackknife, minlength=n_groups) / np.bincount(group, minlength=n_groups)
+        deviation = mean[group] - jackknife
+        numerator = np.bincount(group, weights=deviation**3, minlength=n_groups)
+        denominator = 6 * np.bincount(group, weights=deviation**2, minlength=n_groups)**1.5
+        return np.where(denominator > 0, numerator / denominator, 0)
+
+def _quantiles(distribution:np.ndarray, q:np.ndarray) -> np.ndarray:
+    # Quantile q[i] of column i of the bootstrap distribution (NaN resamples are left out), interpolated like np.quantile
+    distribution = np.sort(distribution, axis=0)
+    n = np.count_nonzero(~np.isnan(distribution), axis=0)
+    position = q * (n - 1)
+    valid = (n > 0) & ~np.isnan(position)
+    position = np.where(valid, position, 0)
+    lower = np.floor(position).astype(np.intp)
+    upper = np.ceil(position).astype(np.intp)
+    columns = np.arange(distribution.shape[1])
+    fraction = position - lower
+    result = (1 - fraction) * distribution[lower, columns] + fraction * distribution[upper, columns]
+    return np.where(valid, result, np.nan)
+
+@profiled('bootstrap')
+def bootstrap_ratio(values:np.ndarray, numerator:np.ndarray, stratum:np.ndarray, groups:list[tuple[np.ndarray, int]], n_resamples:int = 10000, confidence:float = 0.95,
+                    method:str = 'bca', seed:int = None, max_memory:int = 2**26) -> list[dict[str, dict[str, np.ndarray]]]:
+    """
+    Bootstrap confidence intervals of the ratio of the means and of the ratio
+    of the medians of two conditions, for many groups at once.
+
+    The trials of every stratum and condition are redrawn with replacement,
+    and the same resamples are shared by all the levels of groups. The BCa
+    acceleration of a level comes from a jackknife on the groups of the
+    level before it when they are nested, and on the trials for the first level.
+
+    Parameters:
+        values (np.ndarray): Value of each trial.
+        numerator (np.ndarray): True for the trials of the numerator condition, False for the denominator.
+        stratum (np.ndarray): Stratum of each trial, the trials are only redrawn within their stratum.
+        groups (list[tuple[np.ndarray, int]]): Group index of each trial and number of
+            groups, for each level. A group must only contain whole strata.
+        n_resamples (int): Number of resamples.
+        confidence (float): Confidence level of the intervals.
+        method (str): 'percentile' or 'bca' (bias-corrected and accelerated).
+        seed (int): Seed of the random generator, for reproducible intervals.
+        max_memory (int): Approximate memory limit of the temporary arrays, in bytes.
+
+    Returns:
+        list[dict[str, dict[str, np.ndarray]]]: For each level, 'mean' and 'median' > 'ratio',
+            'low' and 'high' of each group (NaN if a condition of the group is empty).
+    """
+    if method not in ('percentile', 'bca'):
+        raise ValueError(f"Unknown method '{method}', expected 'percentile' or 'bca'")
+
+    values = np.asarray(values, dtype=float).ravel()
+    numerator = np.asarray(numerator, dtype=bool).ravel()
+    n = len(values)
+    count(trials=n, resamples=n_resamples, groups=sum(n_groups for _, n_groups in groups))
+
+    # One block of draws per condition and stratum, each block is a row of slots
+    stratum = np.unique(stratum, return_inverse=True)[1].ravel()
+    n_strata = int(stratum.max(initial=-1)) + 1
+    block = np.where(numerator, 0, n_strata) + stratum
+    block_count = np.bincount(block, minlength=2 * n_strata)
+    block_start = np.cumsum(block_count) - block_count
+    block_width = max(1, int(block_count.max(initial=0)))
+
+    # Key of each trial: the rank of its value, so that sorting the keys of any draws sorts their values
+    order = np.lexsort((values, block))
+    rank = np.empty(n, dtype=np.int32)
+    rank[np.argsort(values, kind='stable')] = np.arange(n)
+    rank_table = np.append(rank[order], n).astype(np.int32)
+    value_table = np.append(values[order], 0)
+    by_rank = np.append(np.sort(values), np.nan)
+
+    # A slot draws one of the trials of its block, the empty slots (and the last, empty, block) draw the empty trial n
+    real = np.arange(block_width) < np.append(block_count, 0)[:, None]
+    slot_start = np.where(real, np.append(block_start, n)[:, None], n)
+    slot_count = np.where(real, np.append(block_count, 0)[:, None], 0).astype(np.float32)
+
+    # The jackknife of a level leaves out the groups of the level before it when they are nested in its groups
+    levels = []
+    for i, (group, n_groups) in enumerate(groups):
+        group = np.asarray(group, dtype=np.intp).ravel()
+        units = None
+        if i > 0:
+            below = np.asarray(groups[i - 1][0], dtype=np.intp).ravel()
+            pairs = np.unique(below * max(n_groups, 1) + group) // max(n_groups, 1)
+            if len(pairs) == len(np.unique(pairs)):
+                units = np.unique(below, return_inverse=True)[1].ravel()
+        levels.append(_Level(values, numerator, group, n_groups, stratum, n_strata, units))
+
+    rng = np.random.default_rng(seed)
+    distributions = [{'mean': np.empty((n_resamples, level.n_groups)), 'median': np.empty((n_resamples, level.n_groups))} for level in levels]
+    # Random numbers, slot indices, keys and values, then the sorted rows of a level
+    resample_memory = 32 * slot_start.size + 4 * max(level.layout.size * block_width for level in levels)
+    block_size = int(max(1, min(n_resamples, max_memory // resample_memory)))
+    for first in range(0, n_resamples, block_size):
+        size = min(block_size, n_resamples - first)
+        drawn = rng.random((size,) + slot_start.shape, dtype=np.float32)
+        drawn *= slot_count
+        drawn = drawn.astype(np.intp)
+        drawn += slot_start
+        keys = rank_table[drawn]
+        block_sums = value_table[drawn].sum(axis=-1)
+        del drawn
+        keys.sort(axis=-1)
+        for level, distribution in zip(levels, distributions):
+            for statistic, ratio in level.ratios(keys, block_sums, by_rank).items():
+                distribution[statistic][first:first + size] = ratio
+
+    alpha = (1 - confidence) / 2
+    results = []
+    for level, distribution in zip(levels, distributions):
+        estimates, _, _ = level.estimates()
+        jackknife, group = level.jackknife()
+        result = dict()
+        for statistic in ('mean', 'median'):
+            estimate = estimates[statistic]
+            boot = distribution[statistic]
+            if method == 'percentile':
+                q_low, q_high = np.full(level.n_groups, alpha), np.full(level.n_groups, 1 - alpha)
+            else:
+                # Bias correction and acceleration of each group (as scipy.stats.bootstrap)
+                from scipy.special import ndtr, ndtri
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    z0 = ndtri(np.sum(boot < estimate, axis=0) / np.count_nonzero(~np.isnan(boot), axis=0))
+                    a = _acceleration(jackknife[statistic], group, level.n_groups)
+                    z_low, z_high = z0 + ndtri(alpha), z0 + ndtri(1 - alpha)
+                    q_low = ndtr(z0 + z_low / (1 - a * z_low))
+                    q_high = ndtr(z0 + z_high / (1 - a * z_high))
+
+            result[statistic] = {'ratio': estimate, 'low': _quantiles(boot, q_low), 'high': _quantiles(boot, q_high)}
+        results.append(result)
+
+    return results
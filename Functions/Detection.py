@@ -0,0 +1,309 @@
+import numpy as np
+from scipy.signal import butter, sosfiltfilt
+from scipy.io import loadmat
+
+
+# Default parameters of the detection (see parameters.m)
+sampling = 2000 # Hz
+trial_length = 2 # Length of each trial in seconds
+tkeo_window_size = 100 # Sliding window of the TKEO envelope in samples (50 ms)
+no_onset_period_ms = 1800 # Slightly less than the trial length, to avoid multiple onsets for the same movement or vibration
+vibration_time_ms = 180 # Vibration duration in ms
+
+movement_parameters = {'filter_order': 1, 'cutoff_low': 1, 'cutoff_high': 10, 'alpha': 1}
+vibration_parameters = {'filter_order': 6, 'cutoff_low': 120, 'cutoff_high': 130, 'alpha': 0.7}
+
+# Columns of the unique onsets
+fdi_column = 0
+adm_column = 1
+
+def load_signal(path:str) -> np.ndarray:
+    """
+    Load the raw accelerometer signal of a run ('<filename>_acc.mat').
+
+    Parameters:
+        path (str): Path of the .mat file.
+
+    Returns:
+        np.ndarray: Signal (samples x channels), the first half of the channels is FDI and the second half ADM.
+    """
+    accelerometer = loadmat(path, simplify_cells=True)
+    if 'channels' in accelerometer:
+        return np.stack([np.asarray(channel['data'], dtype=float) for channel in accelerometer['channels']], axis=1)
+    return np.asarray(accelerometer['data'], dtype=float)
+
+def get_time(data_length:int, sampling:int = sampling) -> np.ndarray:
+    # Time of each sample in seconds, as t in parameters.m
+    return np.linspace(0, data_length / sampling, data_length)
+
+def get_segmentation(data_length:int, sampling:int = sampling, trial_length:float = trial_length) -> np.ndarray:
+    # First sample of each trial (0-based), as segmentation_points_index in doSegmentedDetection.m
+    t_end = data_length / sampling
+    segmentation_points = np.arange(int(np.floor((t_end - trial_length) / trial_length)) + 1) * trial_length
+    segmentation = np.round(segmentation_points * sampling).astype(np.intp) - 1
+    segmentation[0] = 0
+    return segmentation
+
+def tkeo(signal:np.ndarray) -> np.ndarray:
+    # Teager-Kaiser energy operator of every channel, 0 at both ends
+    energy = np.zeros_like(signal)
+    energy[1:-1] = signal[1:-1]**2 - signal[:-2] * signal[2:]
+    return energy
+
+def moving_average(signal:np.ndarray, window_size:int) -> np.ndarray:
+    # Centred moving average of every channel, as conv(x, ones(w, 1) / w, 'same') in MATLAB, from one cumulative sum
+    n = len(signal)
+    cumulative = np.concatenate((np.zeros((1,) + signal.shape[1:]), np.cumsum(signal, axis=0)))
+    end = np.minimum(np.arange(n) + window_size // 2 + 1, n)
+    start = np.clip(np.arange(n) + window_size // 2 + 1 - window_size, 0, n)
+    return (cumulative[end] - cumulative[start]) / window_size
+
+def get_features(signal:np.ndarray, filter_order:int, cutoff_low:float, cutoff_high:float, alpha:float, sampling:int = sampling, window_size:int = tkeo_window_size) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Band-pass filter all the channels, then get their TKEO, envelope and
+    baseline threshold, as getSegmentedFeatures.m.
+
+    Parameters:
+        signal (np.ndarray): Signal (samples x channels).
+        filter_order (int): Order of the Butterworth filter.
+        cutoff_low (float): Low cutoff frequency (Hz).
+        cutoff_high (float): High cutoff frequency (Hz).
+        alpha (float): Multiplier of the standard deviation of the envelope for the threshold.
+        sampling (int): Sampling rate (Hz).
+        window_size (int): Window of the envelope in samples.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: TKEO, envelope and threshold of each channel.
+    """
+    # Second-order sections are stable even for the narrow vibration band
+    sos = butter(filter_order, [cutoff_low, cutoff_high], btype='bandpass', fs=sampling, output='sos')
+    filtered = sosfiltfilt(sos, signal, axis=0)
+
+    energy = tkeo(filtered)
+    envelope = moving_average(np.abs(energy), window_size)
+    threshold = envelope.mean(axis=0) + alpha * envelope.std(axis=0, ddof=1)
+    return energy, envelope, threshold
+
+def get_segmented_onsets(envelope:np.ndarray, threshold:np.ndarray, segmentation:np.ndarray, no_onset_period_ms:float = no_onset_period_ms, vibration_time_ms:float = None, sampling:int = sampling) -> np.ndarray:
+    """
+    Get the onset of each channel in each trial, as getSegmentedSignalOnset.m.
+
+    An onset is the last sample at the baseline before the envelope crosses
+    the threshold; the next no_onset_period_ms are then ignored. For
+    vibrations, crossings followed by a negative envelope within
+    vibration_time_ms are movements and are skipped. Instead of scanning
+    every sample, only the crossings are visited, and the backward search
+    and the vibration check are precomputed for the whole signal.
+
+    Parameters:
+        envelope (np.ndarray): Envelope (samples x channels).
+        threshold (np.ndarray): Threshold of each channel.
+        segmentation (np.ndarray): First sample of each trial.
+        no_onset_period_ms (float): Time after an onset without any other onset (ms).
+        vibration_time_ms (float): Vibration duration (ms), None for movements.
+        sampling (int): Sampling rate (Hz).
+
+    Returns:
+        np.ndarray: Onset of each trial and channel (0-based sample, -1 if not found).
+    """
+    n, n_channels = envelope.shape
+    no_onset_period = int(round(no_onset_period_ms * sampling / 1000))
+    vibration_window = None if vibration_time_ms is None else int(round(vibration_time_ms * sampling / 1000))
+
+    baseline = envelope.mean(axis=0) + 0.1 * envelope.std(axis=0, ddof=1)
+    # Trial j is scanned from bounds[j] to bounds[j + 1] included
+    bounds = np.append(segmentation, n - 1)
+    index = np.arange(n)
+    onsets = np.full((len(segmentation), n_channels), -1, dtype=np.intp)
+
+    for i in range(n_channels):
+        x = envelope[:, i]
+        crossings = np.flatnonzero(x > threshold[i])
+        # As in MATLAB, the backward search is only bounded by the start of the signal
+        last_at_baseline = np.maximum.accumulate(np.where(x <= baseline[i], index, 0))
+        if vibration_window is not None:
+            # First negative sample from each sample on (none past the end of the signal)
+            next_negative = np.minimum.accumulate(np.where(x < 0, index, np.iinfo(np.intp).max)[::-1])[::-1]
+
+        ignored_until = -1 # Crossings up to this sample were reset by an onset or a movement
+        kept = -1 # Onset sample marked again after the reset, seen when a trial starts on it
+        for j in range(len(segmentation)):
+            z, stop = bounds[j], bounds[j + 1]
+            while z <= stop:
+                if z != kept:
+                    position = np.searchsorted(crossings, max(z, ignored_until + 1))
+                    if position == len(crossings) or crossings[position] > stop:
+                        break
+                    z = crossings[position]
+
+                if vibration_window is not None and next_negative[z] <= z + vibration_window:
+                    ignored_until = max(ignored_until, z + vibration_window)
+                    kept = -1
+                    z += 1
+                    continue
+
+                k = last_at_baseline[z]
+                onsets[j, i] = k
+                kept = k
+                ignored_until = max(ignored_until, k + no_onset_period)
+                z += 1
+
+    return onsets
+
+def get_unique_onsets(onsets:np.ndarray) -> np.ndarray:
+    """
+    Merge the onsets of the channels of each finger, as getSegmentedUniqueOnsets.m:
+    the finger detected by more channels gets the mean onset of its channels
+    (both fingers when tied).
+
+    Parameters:
+        onsets (np.ndarray): Onset of each trial and channel (-1 if not found),
+            the first half of the channels is FDI and the second half ADM.
+
+    Returns:
+        np.ndarray: Onset of each trial and finger (trials x [FDI, ADM], -1 if not found).
+    """
+    half = onsets.shape[1] // 2
+    found = onsets != -1
+    detected = np.where(found, onsets, 0)
+    fdi_count = found[:, :half].sum(axis=1)
+    adm_count = found[:, half:].sum(axis=1)
+
+    unique_onsets = np.full((len(onsets), 2), -1.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        unique_onsets[:, fdi_column] = np.where((fdi_count >= adm_count) & (fdi_count > 0), detected[:, :half].sum(axis=1) / fdi_count, -1)
+        unique_onsets[:, adm_column] = np.where((adm_count >= fdi_count) & (adm_count > 0), detected[:, half:].sum(axis=1) / adm_count, -1)
+    return unique_onsets
+
+def get_test_type(unique_vb:np.ndarray, unique_mv:np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Get the test type of each trial from the fingers that vibrate and move, as getSegmentedTestType.m.
+        1 = FDI vb and ADM mv
+        2 = ADM vb and FDI mv
+        3 = FDI vb and FDI mv
+        4 = ADM vb and ADM mv
+        -1 = Not found
+
+    Parameters:
+        unique_vb (np.ndarray): Vibration onset of each trial and finger.
+        unique_mv (np.ndarray): Movement onset of each trial and finger.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Test type, vibration onset and movement onset of each trial (-1 if not found).
+    """
+    vb_found = unique_vb != -1
+    mv_found = unique_mv != -1
+
+    # Later types take precedence, as the successive ifs of the MATLAB function
+    conditions = [
+        vb_found[:, adm_column] & mv_found[:, adm_column],
+        vb_found[:, fdi_column] & mv_found[:, fdi_column],
+        vb_found[:, adm_column] & mv_found[:, fdi_column],
+        vb_found[:, fdi_column] & mv_found[:, adm_column],
+    ]
+    test_type = np.select(conditions, [4, 3, 2, 1], -1)
+    vb_finger = np.select(conditions, [adm_column, fdi_column, adm_column, fdi_column], 0)
+    mv_finger = np.select(conditions, [adm_column, fdi_column, fdi_column, adm_column], 0)
+
+    trials = np.arange(len(test_type))
+    found = test_type != -1
+    vb_index = np.where(found, unique_vb[trials, vb_finger], -1)
+    mv_index = np.where(found, unique_mv[trials, mv_finger], -1)
+    return test_type, vb_index, mv_index
+
+def compare_with_box(test_type:np.ndarray, vb_index:np.ndarray, mv_index:np.ndarray, triallist:np.ndarray, t:np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Keep the trials whose test type matches the box and get their RTs, as doSegmentedRTComparison.m.
+
+    Parameters:
+        test_type (np.ndarray): Detected test type of each trial.
+        vb_index (np.ndarray): Vibration onset of each trial (1-based, -1 if not found).
+        mv_index (np.ndarray): Movement onset of each trial (1-based, -1 if not found).
+        triallist (np.ndarray): Test type of each trial from the box.
+        t (np.ndarray): Time of each sample (s).
+
+    Returns:
+        dict[str, np.ndarray]: Variables of the run as in the .mat files.
+    """
+    triallist = np.ravel(triallist)
+    if len(triallist) != len(test_type):
+        raise ValueError(f'{len(test_type)} trials were segmented but the box has {len(triallist)}')
+
+    correct = test_type == triallist
+    test_type = np.where(correct, test_type, 0) # Remove incorrect guesses
+    vb_index = np.where(correct, vb_index, -1)
+    mv_index = np.where(correct, mv_index, -1)
+
+    # MATLAB rounds halves away from zero, and indexes t from 1
+    found = mv_index != -1
+    rt_index = np.floor(np.abs(mv_index[found] - vb_index[found]) + 0.5).astype(np.intp)
+    return {
+        'rt_acc': t[rt_index - 1] * 1000,
+        'acc_test_type': test_type[(test_type != 0) & (test_type != -1)],
+        'test_type': test_type,
+        'vb_index': vb_index,
+        'mv_index': mv_index,
+        't': t,
+        'correct_nbr': np.count_nonzero(correct),
+        'incorrect_nbr': np.count_nonzero(~correct),
+    }
+
+def detect_run(signal:np.ndarray, triallist:np.ndarray = None, sampling:int = sampling, trial_length:float = trial_length) -> dict[str, np.ndarray]:
+    """
+    Detect the vibration and movement onsets and the test type of every trial of a run,
+    on all the channels at once (doSegmentedDetection.m).
+
+    Parameters:
+        signal (np.ndarray): Signal (samples x channels), the first half of the channels is FDI and the second half ADM.
+        triallist (np.ndarray): Test type of each trial from the box. If given, the
+            incorrect guesses are removed and the RTs are computed, as in the .mat files.
+        sampling (int): Sampling rate (Hz).
+        trial_length (float): Length of each trial (s).
+
+    Returns:
+        dict[str, np.ndarray]: 'test_type', 'vb_index' and 'mv_index' (1-based sample, as in MATLAB, -1 if not found)
+            and 't', plus 'rt_acc', 'acc_test_type', 'correct_nbr' and 'incorrect_nbr' with triallist.
+    """
+    signal = np.asarray(signal, dtype=float)
+    segmentation = get_segmentation(len(signal), sampling, trial_length)
+
+    _, mv_envelope, mv_threshold = get_features(signal, sampling=sampling, **movement_parameters)
+    _, vb_envelope, vb_threshold = get_features(signal, sampling=sampling, **vibration_parameters)
+
+    # Remove the movement from the vibration envelope
+    vb_envelope = vb_envelope - mv_envelope * (vb_envelope.mean(axis=0) / mv_envelope.mean(axis=0))
+
+    mv_onsets = get_segmented_onsets(mv_envelope, mv_threshold, segmentation, no_onset_period_ms, None, sampling)
+    vb_onsets = get_segmented_onsets(vb_envelope, vb_threshold, segmentation, no_onset_period_ms, vibration_time_ms, sampling)
+
+    test_type, vb_index, mv_index = get_test_type(get_unique_onsets(vb_onsets), get_unique_onsets(mv_onsets))
+    # 1-based samples, as in the .mat files
+    vb_index = np.where(vb_index != -1, vb_index + 1, -1)
+    mv_index = np.where(mv_index != -1, mv_index + 1, -1)
+
+    t = get_time(len(signal), sampling)
+    if triallist is not None:
+        return compare_with_box(test_type, vb_index, mv_index, triallist, t)
+    return {'test_type': test_type, 'vb_index': vb_index, 'mv_index': mv_index, 't': t}
+
+def compare_detection(detected:dict, reference:dict) -> dict[str, float]:
+    """
+    Agreement between a detection and the results of the MATLAB pipeline (e.g. a .mat file).
+
+    Parameters:
+        detected (dict): Output of detect_run.
+        reference (dict): Variables with 'test_type', 'vb_index' and 'mv_index'.
+
+    Returns:
+        dict[str, float]: Fraction of trials with the same test type, and
+            mean and max onset difference (samples) of the trials found by both.
+    """
+    agreement = {'test_type': np.mean(np.ravel(detected['test_type']) == np.ravel(reference['test_type']))}
+    for variable in ['vb_index', 'mv_index']:
+        a = np.ravel(detected[variable]).astype(float)
+        b = np.ravel(reference[variable]).astype(float)
+        both = (a != -1) & (b != -1)
+        difference = np.abs(a[both] - b[both])
+        agreement[f'{variable}_mean_error'] = difference.mean() if both.any() else np.nan
+        agreement[f'{variable}_max_error'] = difference.max() if both.any() else np.nan
+    return agreement
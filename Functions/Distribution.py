@@ -0,0 +1,193 @@
+import numpy as np
+
+from Functions.Profiling import count, profiled
+
+
+min_fit_size = 10 # Smallest group fitted with an ex-Gaussian, smaller groups get NaN parameters
+quantiles = (0.1, 0.25, 0.5, 0.75, 0.9) # Quantiles of the shape of each group ('q10', 'q25', ...)
+
+def _segments(group:np.ndarray, values:np.ndarray, n_groups:int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Values sorted by group then value, with the count and start of each group (group index n_groups and NaN are ignored)
+    keep = (group < n_groups) & ~np.isnan(values)
+    group = group[keep]
+    values = np.asarray(values[keep], dtype=float)
+    order = np.lexsort((values, group))
+    n = np.bincount(group, minlength=n_groups)
+    return group[order], values[order], n
+
+def describe_groups(group:np.ndarray, values:np.ndarray, n_groups:int) -> dict[str, np.ndarray]:
+    """
+    Shape of the distribution of every group with segment reductions: size,
+    mean, standard deviation, coefficient of variation, skewness (biased, as
+    scipy.stats.skew) and quantiles (linear interpolation, as np.quantile).
+
+    Parameters:
+        group (np.ndarray): Group index of each value, in [0, n_groups].
+            Values with index n_groups are ignored.
+        values (np.ndarray): Values.
+        n_groups (int): Number of groups.
+
+    Returns:
+        dict[str, np.ndarray]: 'n', 'mean', 'std', 'cv', 'skewness' and one 'q<percent>'
+            per quantile, one value per group (NaN for empty groups).
+    """
+    group, values, n = _segments(group, values, n_groups)
+    start = np.cumsum(n) - n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(group, weights=values, minlength=n_groups) / n
+        deviation = values - mean[group]
+        m2 = np.bincount(group, weights=deviation**2, minlength=n_groups) / n
+        m3 = np.bincount(group, weights=deviation**3, minlength=n_groups) / n
+        std = np.sqrt(m2)
+        results = {'n': n, 'mean': mean, 'std': std, 'cv': std / mean, 'skewness': m3 / m2**1.5}
+
+    # Each group is a sorted segment, the quantiles are read at their positions
+    last = max(len(values) - 1, 0)
+    for q in quantiles:
+        position = q * np.maximum(n - 1, 0)
+        below = np.floor(position).astype(np.intp)
+        above = np.minimum(below + 1, np.maximum(n - 1, 0))
+        fraction = position - below
+        low = values[np.minimum(start + below, last)] if len(values) else np.zeros(n_groups)
+        high = values[np.minimum(start + above, last)] if len(values) else np.zeros(n_groups)
+        results[f'q{round(q * 100)}'] = np.where(n > 0, low + fraction * (high - low), np.nan)
+    return results
+
+def _exgaussian_terms(x:np.ndarray, mu:np.ndarray, sigma:np.ndarray, tau:np.ndarray, derivatives:bool = True) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Log-density of the ex-Gaussian at each value, with its gradient and
+    Hessian with respect to (mu, log sigma, log tau), from the parameters of
+    its group.
+    """
+    from scipy.special import log_ndtr
+
+    a = x - mu
+    z = a / sigma - sigma / tau
+    log_cdf = log_ndtr(z)
+    log_density = -np.log(tau) - a / tau + sigma**2 / (2 * tau**2) + log_cdf
+    if not derivatives:
+        return log_density, None, None
+
+    # Inverse Mills ratio pdf(z) / cdf(z) (stable in the left tail) and its derivative
+    mills = np.exp(-z**2 / 2 - 0.5 * np.log(2 * np.pi) - log_cdf)
+    mills_slope = -mills * (z + mills)
+    ratio = sigma / tau
+    dz = np.stack((-1 / sigma, -a / sigma - ratio, ratio), axis=1)
+    gradient = np.stack((1 / tau, ratio**2, -1 + a / tau - ratio**2), axis=1) + mills[:, None] * dz
+
+    # Second derivatives of the Gaussian-exponential part and of z
+    zero = np.zeros(len(x))
+    h = [[zero, zero, -1 / tau], [zero, 2 * ratio**2, -2 * ratio**2], [-1 / tau, -2 * ratio**2, -a / tau + 2 * ratio**2]]
+    dz2 = [[zero, 1 / sigma, zero], [1 / sigma, a / sigma - ratio, ratio], [zero, ratio, -ratio]]
+    hessian = np.stack([np.stack([h[i][j] + mills_slope * dz[:, i] * dz[:, j] + mills * dz2[i][j] for j in range(3)], axis=1) for i in range(3)], axis=1)
+    return log_density, gradient, hessian
+
+@profiled('distribution')
+def fit_exgaussian(group:np.ndarray, values:np.ndarray, n_groups:int, max_iterations:int = 200, tolerance:float = 1e-9) -> dict[str, np.ndarray]:
+    """
+    Maximum likelihood ex-Gaussian (mu, sigma, tau) of every group at once.
+
+    All the groups are optimized together: each iteration is one pass over
+    the values of the groups that have not converged, with the gradients and
+    Hessians summed per group (segment reductions) and a batched 3 x 3 solve
+    for the Newton steps (the outer product of the gradients where the
+    Hessian is not negative definite) followed by a step halving line
+    search. The groups start from their moment estimates and are fitted
+    standardized (the ex-Gaussian is a location-scale family).
+
+    Parameters:
+        group (np.ndarray): Group index of each value, in [0, n_groups].
+            Values with index n_groups are ignored.
+        values (np.ndarray): Values.
+        n_groups (int): Number of groups.
+        max_iterations (int): Maximum number of iterations.
+        tolerance (float): Relative change of the log-likelihood of a group below which it has converged.
+
+    Returns:
+        dict[str, np.ndarray]: 'mu', 'sigma', 'tau', 'log_likelihood' and 'converged' of each
+            group (NaN parameters below min_fit_size values).
+    """
+    group, values, n = _segments(group, values, n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(group, weights=values, minlength=n_groups) / n
+        std = np.sqrt(np.bincount(group, weights=(values - mean[group])**2, minlength=n_groups) / n)
+        x = (values - mean[group]) / std[group]
+        skewness = np.bincount(group, weights=x**3, minlength=n_groups) / n
+
+    fitted = (n >= min_fit_size) & (std > 0)
+    count(groups=n_groups, fitted=int(np.count_nonzero(fitted)), values=len(values))
+
+    # Moment estimates of the standardized groups, the skewness of an ex-Gaussian is in (0, 2)
+    tau = np.cbrt(np.clip(np.nan_to_num(skewness), 0.05, 1.9) / 2)
+    params = np.stack((-tau, np.log(np.sqrt(1 - tau**2)), np.log(tau)), axis=1)
+
+    def log_likelihood(params:np.ndarray, rows:np.ndarray, derivatives:bool = False):
+        # Sum of the log-densities (and derivatives) of some values over their groups
+        index = group[rows]
+        p = params[index]
+        log_density, gradient, hessian = _exgaussian_terms(x[rows], p[:, 0], np.exp(p[:, 1]), np.exp(p[:, 2]), derivatives)
+        with np.errstate(invalid='ignore'):
+            total = np.bincount(index, weights=log_density, minlength=n_groups)
+            total[np.isnan(total)] = -np.inf
+        return total, index, gradient, hessian
+
+    log_l = np.full(n_groups, -np.inf)
+    converged = np.zeros(n_groups, dtype=bool)
+    active = fitted.copy()
+    gradient_only = np.zeros(n_groups, dtype=bool) # Groups whose last Newton step failed
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        # Only the values of the groups still optimized are read
+        rows = np.flatnonzero(active[group])
+        current, index, gradient, hessian = log_likelihood(params, rows, derivatives=True)
+        log_l[active] = current[active]
+
+        score = np.stack([np.bincount(index, weights=gradient[:, i], minlength=n_groups) for i in range(3)], axis=1)
+        curvature = np.empty((n_groups, 3, 3))
+        information = np.empty((n_groups, 3, 3))
+        for i in range(3):
+            for j in range(i, 3):
+                curvature[:, i, j] = curvature[:, j, i] = np.bincount(index, weights=hessian[:, i, j], minlength=n_groups)
+                information[:, i, j] = information[:, j, i] = np.bincount(index, weights=gradient[:, i] * gradient[:, j], minlength=n_groups)
+        groups = np.flatnonzero(active)
+        with np.errstate(invalid='ignore'):
+            newton = np.zeros(n_groups, dtype=bool)
+            newton[groups] = np.all(np.linalg.eigvalsh(curvature[groups]) < 0, axis=1) & ~gradient_only[groups]
+        matrix = np.where(newton[groups, None, None], -curvature[groups], information[groups]) + 1e-9 * np.eye(3)
+        step = np.zeros((n_groups, 3))
+        step[groups] = np.linalg.solve(matrix, score[groups][:, :, None])[:, :, 0]
+        # Keep sigma and tau within a factor e per step, without changing the direction
+        step /= np.maximum(np.abs(step[:, 1:]).max(axis=1), 1)[:, None]
+
+        # Halve the steps of the groups whose likelihood does not increase
+        scale = np.ones(n_groups)
+        pending = active.copy()
+        new_log_l = log_l.copy()
+        for _ in range(30):
+            candidate = params + scale[:, None] * step
+            rows = rows[pending[group[rows]]]
+            trial, _, _, _ = log_likelihood(candidate, rows)
+            better = pending & (trial >= log_l)
+            params[better] = candidate[better]
+            new_log_l[better] = trial[better]
+            pending &= ~better
+            if not pending.any():
+                break
+            scale[pending] /= 2
+
+        # Converged when the likelihood stops changing, or when not even a gradient step improves it
+        with np.errstate(invalid='ignore'):
+            done = active & ((pending & ~newton) | (~pending & (np.abs(new_log_l - log_l) <= tolerance * (1 + np.abs(log_l)))))
+        gradient_only = pending & newton
+        converged |= done
+        active &= ~done
+        log_l = new_log_l
+
+    mu = np.where(fitted, mean + std * params[:, 0], np.nan)
+    sigma = np.where(fitted, std * np.exp(params[:, 1]), np.nan)
+    tau = np.where(fitted, std * np.exp(params[:, 2]), np.nan)
+    with np.errstate(divide='ignore'):
+        # Log-likelihood of the values in their own unit
+        log_l = np.where(fitted, log_l - n * np.log(std), np.nan)
+    return {'mu': mu, 'sigma': sigma, 'tau': tau, 'log_likelihood': log_l, 'converged': converged}
@@ -1,74 +1,513 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import csv
-from scipy.stats import shapiro, permutation_test
-import seaborn as sns
-import pandas as pd
-
+import os
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from Functions.Permutation import permutation_correlation
+from Functions.Bootstrap import bootstrap_ratio
+from Functions.Loader import _parse_filename
+from Functions.Distribution import describe_groups, fit_exgaussian, quantiles
+from Functions.Normality import shapiro_groups
+from Functions.Statistics import GroupStatistics, SortedGroups, group_statistics
+from Functions.Profiling import active, count, count_subjects, profiled, stage
+from Functions.Query import TrialIndex, TrialSelection
+from Functions.TrialStore import TrialStore, get_full_rt
+
+# matplotlib and pandas are only imported by the plots and the tables, so the numeric code (and its worker processes) starts fast
+if TYPE_CHECKING:
+    import pandas as pd
+    from Functions.SignalStore import SignalStore
+
+
+figure_size = [10, 8] # Size of the feature figures (inches)
+
+# One row per subject (and run) and test type of the permutation tests
+permutation_results_dtype = np.dtype([
+    ('subject', 'U32'), ('run', 'U16'), ('test_type', np.int64),
+    ('n', np.int64), ('acc_missing', np.int64), ('box_missing', np.int64),
+    ('r', np.float64), ('p', np.float64),
+])
+
+# One row per subject (and run) and test type of the paired box - accelerometer RT differences (ms)
+paired_differences_dtype = np.dtype([
+    ('subject', 'U32'), ('run', 'U16'), ('test_type', np.int64), ('n', np.int64),
+    ('mean', np.float64), ('median', np.float64), ('std', np.float64),
+])
+
+# One row per window, subject (and run) and test type (0: all the trials) of a sweep of the limits
+limits_sweep_dtype = np.dtype([
+    ('lower', np.float64), ('upper', np.float64),
+    ('subject', 'U32'), ('run', 'U16'), ('test_type', np.int64), ('count', np.int64),
+    ('mean', np.float64), ('median', np.float64), ('std', np.float64), ('min', np.float64), ('max', np.float64),
+    ('hetero_homo_ratio', np.float64),
+])
+
+# One row per subject (and run) and test type (0: all the trials) of the distribution fits (ms)
+distribution_fit_dtype = np.dtype([
+    ('subject', 'U32'), ('run', 'U16'), ('test_type', np.int64), ('n', np.int64),
+    ('mean', np.float64), ('std', np.float64), ('cv', np.float64), ('skewness', np.float64),
+] + [(f'q{round(q * 100)}', np.float64) for q in quantiles] + [
+    ('mu', np.float64), ('sigma', np.float64), ('tau', np.float64), ('log_likelihood', np.float64), ('converged', np.bool_),
+])
+
+# One row per subject (and run) and statistic of the bootstrap of the hetero/homo ratio
+ratio_intervals_dtype = np.dtype([
+    ('subject', 'U32'), ('run', 'U16'), ('statistic', 'U8'),
+    ('n_hetero', np.int64), ('n_homo', np.int64),
+    ('ratio', np.float64), ('low', np.float64), ('high', np.float64),
+])
+
+def _group_statistics(group:np.ndarray, values:np.ndarray, n_groups:int) -> dict[str, np.ndarray]:
+    # Statistical features of every group from a single sort of the values (index n_groups is ignored, NaN for empty groups)
+    count = np.bincount(group, minlength=n_groups + 1)[:n_groups]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(group, weights=values, minlength=n_groups + 1)[:n_groups] / count
+        deviation = values - np.append(mean, np.nan)[group]
+        std = np.sqrt(np.bincount(group, weights=deviation**2, minlength=n_groups + 1)[:n_groups] / count)
+
+    # Sort by group then value, so that each group is a sorted segment
+    sorted_values = values[np.lexsort((values, group))]
+    start = np.cumsum(count) - count
+    not_empty = count > 0
+
+    def at(index:np.ndarray) -> np.ndarray:
+        result = np.full(n_groups, np.nan)
+        result[not_empty] = sorted_values[index[not_empty]]
+        return result
+
+    return {
+        'count': count,
+        'mean': mean,
+        'median': (at(start + (count - 1) // 2) + at(start + count // 2)) / 2,
+        'std': std,
+        'min': at(start),
+        'max': at(start + count - 1),
+    }
+
+def _values_statistics(values:np.ndarray) -> dict[str, np.ndarray]:
+    # _group_statistics of a single group, the median only needs a partial sort
+    statistics = _group_statistics(np.zeros(0, dtype=np.intp), np.zeros(0), 1)
+    if len(values) == 0:
+        return statistics
+    group = np.zeros(len(values), dtype=np.intp)
+    statistics['count'] = np.array([len(values)])
+    statistics['mean'] = np.bincount(group, weights=values, minlength=1) / len(values)
+    statistics['std'] = np.sqrt(np.bincount(group, weights=(values - statistics['mean'][0])**2, minlength=1) / len(values))
+    middle = np.partition(values, [(len(values) - 1) // 2, len(values) // 2])
+    statistics['median'] = np.array([(middle[(len(values) - 1) // 2] + middle[len(values) // 2]) / 2])
+    statistics['min'] = np.array([values.min()])
+    statistics['max'] = np.array([values.max()])
+    return statistics
+
+def _group_views(group:np.ndarray, values:np.ndarray, n_groups:int) -> list[np.ndarray]:
+    # Values of each group in trial order, as views over a single buffer
+    order = np.argsort(group, kind='stable')
+    count = np.bincount(group, minlength=n_groups + 1)
+    return np.split(values[order], np.cumsum(count)[:n_groups])[:n_groups]
+
+def _valid_trials(rt_acc:np.ndarray, only_physiological:bool, lower_limit:float, upper_limit:float) -> np.ndarray:
+    # Mask of the RTs kept by the analysis
+    if only_physiological:
+        return (rt_acc > lower_limit) & (rt_acc < upper_limit)
+    return np.ones(len(rt_acc), dtype=bool)
+
+def _sequence_rows(effects:dict) -> list[list]:
+    # Rows of the sequential effects of one group: transition, previous type, current type, count and statistics
+    rows = []
+    for key, features in effects.items():
+        if key == 'switch_cost':
+            continue
+        if isinstance(key, tuple):
+            rows.append(['repeat' if key[0] == key[1] else 'switch', int(key[0]), int(key[1])])
+        else:
+            rows.append([key, None, None])
+        rows[-1] += [features[feature] for feature in ['count', 'mean', 'median', 'std', 'min', 'max']]
+    return rows
+
+def _table(rows:list, columns:list[str], types:dict) -> 'pd.DataFrame':
+    import pandas as pd
+    return pd.DataFrame.from_records(rows, columns=columns).astype(types)
+
+def _save_tables(tables:dict[str, 'pd.DataFrame'], folder:str, format:str):
+    # One file per table, named after it
+    if format not in ('parquet', 'arrow', 'csv'):
+        raise ValueError(f"Unknown format '{format}', expected 'parquet', 'arrow' or 'csv'")
+    if format != 'csv':
+        # Only needed for the binary formats
+        try:
+            import pyarrow
+        except ImportError as error:
+            raise ImportError(f"Saving as {format} requires pyarrow (pip install pyarrow)") from error
+
+    for name, table in tables.items():
+        path = os.path.join(folder, f'{name}.{format}')
+        if format == 'parquet':
+            table.to_parquet(path, index=False)
+        elif format == 'arrow':
+            table.to_feather(path)
+        else:
+            table.to_csv(path, index=False)
 
-plt.rcParams['figure.figsize'] = [10, 8]
+# Keys of TrialSelection.group_by of each level
+level_keys:dict[str, tuple[str, ...]] = {'run': ('run',), 'subject': ('subject',), 'overall': ()}
 
-def _check_normality(data: np.ndarray, alpha:float = 0.05) -> bool:
-    """
-    Check if the given data follows a normal distribution
-    using the Shapiro-Wilk test.
+def _level_names(names:list[tuple]) -> list[tuple[str, str]]:
+    # (subject, run) of the groups of a level, '' for the subject or run of the larger levels
+    return [(name + ('', ''))[:2] for name in names]
 
-    Parameters:
-        data (np.ndarray): Input data array.
+def _concatenate(arrays:list) -> np.ndarray:
+    # Concatenate once, keeping the dtype of the inputs
+    if len(arrays) == 0:
+        return np.array([])
+    return np.concatenate(arrays, axis=None)
 
-    Returns:
-        bool: True if data is normally distributed (p > 0.05), False otherwise.
+class TrialTable():
     """
-    _, p_value = shapiro(data)
-    return p_value > alpha
+    Columnar table of the trials with an RT of a dataset or a TrialStore,
+    indexed once (TrialIndex) and shared by all the feature levels.
+    """
+
+    @profiled('features')
+    def __init__(self, dataset:dict[str, dict] | TrialStore):
+        if isinstance(dataset, TrialStore):
+            self._from_store(dataset)
+            return
+
+        self.subjects:list[str] = list(dataset)
+        self.runs:list[tuple[str, str]] = [(subject, run) for subject in dataset for run in dataset[subject]]
+
+        rt_acc = [np.asarray(dataset[subject][run]['rt_acc'], dtype=float).ravel() for subject, run in self.runs]
+        acc_test_type = [np.asarray(dataset[subject][run]['acc_test_type']).ravel() for subject, run in self.runs]
+        run_test_types = [np.unique(np.asarray(dataset[subject][run]['test_type'])) for subject, run in self.runs]
+
+        # Test types found in the full trial lists, and which run has which type
+        self.test_types = np.unique(_concatenate(run_test_types))
+        self.test_types = self.test_types[self.test_types > 0]
+        self.run_has_type = np.array([np.isin(self.test_types, types) for types in run_test_types], dtype=bool).reshape(len(self.runs), len(self.test_types))
+        self._set_trials([len(rt) for rt in rt_acc], _concatenate(rt_acc), _concatenate(acc_test_type))
+
+    def _from_store(self, store:TrialStore):
+        # Fields of the store are used as they are (strided views), nothing is flattened or copied
+        self.subjects = list(store.subjects)
+        self.runs = list(store.runs)
+
+        full_type = store.full['test_type']
+        self.test_types = np.unique(full_type)
+        self.test_types = self.test_types[self.test_types > 0]
+        full_run = np.repeat(np.arange(len(self.runs)), np.diff(store.full_offsets))
+        found = np.isin(full_type, self.test_types)
+        self.run_has_type = np.zeros((len(self.runs), len(self.test_types)), dtype=bool)
+        self.run_has_type[full_run[found], np.searchsorted(self.test_types, full_type[found])] = True
+        self._set_trials(np.diff(store.run_offsets), store.trials['rt'], store.trials['test_type'])
+
+    def _set_trials(self, run_lengths:list[int], rt_acc:np.ndarray, test_type:np.ndarray):
+        self.rt_acc = rt_acc
+        self.test_type = test_type
+
+        # Offsets of the runs and subjects, positions of each test type and RT order (see TrialIndex)
+        self.index = TrialIndex(self.runs, np.concatenate(([0], np.cumsum(run_lengths))), test_type, self.test_types, rt_acc)
+        self._set_index()
+        count(subjects=len(self.subjects), runs=len(self.runs), trials=len(self.rt_acc))
+
+    def _set_index(self):
+        # The runs of each subject are contiguous: subject i owns runs [subject_run_offsets[i], subject_run_offsets[i + 1])
+        self.run_subject = self.index.run_subject
+        self.subject_run_offsets = self.index.subject_run_offsets
+
+        # One entry per trial, the position of the test type in test_types being len(test_types) if not a test type
+        self.run_index = self.index.run_index
+        self.type_index = self.index.type_index
+
+        self.valid_trials:TrialSelection = self.index.query() # Trials kept by the analysis
+        self._validity_key = None
+
+    @property
+    def subject_index(self) -> np.ndarray:
+        return self.run_subject[self.run_index]
+
+    @profiled('features')
+    def splice(self, start:int, stop:int, runs:list[tuple[str, str]], rt_acc:list[np.ndarray], test_type:list[np.ndarray], run_test_types:list[np.ndarray], store:TrialStore = None) -> bool:
+        """
+        Replace the runs [start, stop) with new runs, and update the index
+        instead of building it again (see TrialIndex.splice). The columns are
+        copied once with the new trials in place, or are the fields of store
+        when the table is one of its (already spliced) views.
+
+        Parameters:
+            start (int): First replaced run.
+            stop (int): End of the replaced runs (start to insert runs).
+            runs (list[tuple[str, str]]): New runs (none to remove runs).
+            rt_acc (list[np.ndarray]): RTs of each new run.
+            test_type (list[np.ndarray]): Test type of each RT of each new run.
+            run_test_types (list[np.ndarray]): Test types of the full trial list of each new run.
+            store (TrialStore): Store of the table.
+
+        Returns:
+            bool: False when the test types of the table would change, and it was not spliced.
+        """
+        has_type = np.array([np.isin(self.test_types, types) for types in run_test_types], dtype=bool).reshape(len(runs), len(self.test_types))
+        run_has_type = np.concatenate((self.run_has_type[:start], has_type, self.run_has_type[stop:]))
+        new_types = _concatenate(run_test_types)
+        if not np.isin(new_types[new_types > 0], self.test_types).all() or not run_has_type.any(axis=0).all():
+            return False
+
+        first, last = self.index.run_offsets[start], self.index.run_offsets[stop]
+        self.runs = self.runs[:start] + list(runs) + self.runs[stop:]
+        self.subjects = list(dict.fromkeys(subject for subject, _ in self.runs))
+        self.run_has_type = run_has_type
+        if store is not None:
+            self.rt_acc, self.test_type = store.trials['rt'], store.trials['test_type']
+        else:
+            self.rt_acc = _concatenate([self.rt_acc[:first]] + [np.asarray(rt, dtype=float).ravel() for rt in rt_acc] + [self.rt_acc[last:]])
+            self.test_type = _concatenate([self.test_type[:first]] + [np.ravel(types) for types in test_type] + [self.test_type[last:]])
+        self.index.splice(start, stop, runs, [np.size(rt) for rt in rt_acc], self.test_type, self.rt_acc)
+        self._set_index()
+        count(runs=len(runs), trials=sum(np.size(rt) for rt in rt_acc))
+        return True
+
+    def set_validity(self, only_physiological:bool, lower_limit:float, upper_limit:float):
+        # Only select the kept trials again when the limits change
+        key = (only_physiological, lower_limit, upper_limit)
+        if key == self._validity_key:
+            return
+        self._validity_key = key
+        self.valid_trials = self.index.query(lower=lower_limit, upper=upper_limit) if only_physiological else self.index.query()
+
+class _LazyLevel():
+    # Feature level computed on first read by its calculate_* method, and again when one of its settings changed
+
+    def __init__(self, calculator:str, dependencies:tuple[str, ...], incremental:bool = True):
+        self.calculator = calculator
+        self.dependencies = dependencies
+        self.incremental = incremental
+
+    def __set_name__(self, owner, name:str):
+        self.name = name
+
+    def __get__(self, features:'Features', owner = None):
+        if features is None:
+            return self
+        if features._level_keys.get(self.name) != features._dependency_key(self.dependencies):
+            getattr(features, self.calculator)()
+        elif self.incremental and (features._stale_subjects or features._stale_overall):
+            features._refresh_levels()
+        return features._levels[self.name]
+
+    def __set__(self, features:'Features', value):
+        features._levels[self.name] = value
+        features._level_keys[self.name] = features._dependency_key(self.dependencies)
 
 class Features():
 
     upper_limit = 700
     lower_limit = 200
 
-    def __init__(self, dataset:dict[str, list[dict]], only_physiological:bool = False):
-        self.single_run_features:dict[str, dict[int, dict[str, float]]] = dict() # subject > run > feature > value
-        self.single_run_features_by_type:dict[str, dict[int, dict[str, float]]] = dict() # subject > run > test_type > feature > value
-        self.subject_features:dict[str, dict[str, float]] = dict() # subject > feature > value
-        self.subject_features_by_type:dict[str, dict[int, dict[str, float]]] = dict() # subject > test_type > feature > value
-        self.overall_features:dict[str, float] = dict() # feature > value
-        self.overall_features_by_type:dict[int, dict[str, float]] = dict() # test_type > feature > value
-        
-        self.run_hetero_homo_ratio:dict[str, dict[str, float]] = dict() # subject > run > value
-        self.subject_hetero_homo_ratio:dict[str, float] = dict() # subject > value
-        self.overall_hetero_homo_ratio:float = 0
+    hetero_types = (1, 2)
+    homo_types = (3, 4)
 
-        self.dataset = dataset
-        self.only_physiological = only_physiological
+    normality_alpha = 0.05 # Significance level of the Shapiro-Wilk tests
+    normality_workers = 1 # Processes of the normality tests (None: every CPU)
 
-    def _get_full_rt(self, vb_index:list, mv_index:list, t:np.ndarray):
-        return [t[abs(round(mv-vb))] if not vb == -1 and not mv == -1 else -1 for vb, mv in zip(vb_index, mv_index)]
+    # Every level is computed when first read (settings it depends on: dataset, only_physiological, limits, RT source)
+    _settings = ('dataset', 'only_physiological', 'lower_limit', 'upper_limit')
+    single_run_features = _LazyLevel('calculate_single_run_features', _settings) # subject > run > feature > value
+    single_run_features_by_type = _LazyLevel('calculate_single_run_features_by_type', _settings + ('accelerometer', 'normality_alpha')) # subject > run > test_type > feature > value
+    subject_features = _LazyLevel('calculate_subject_features', _settings) # subject > feature > value
+    subject_features_by_type = _LazyLevel('calculate_subject_features_by_type', _settings + ('accelerometer', 'normality_alpha')) # subject > test_type > feature > value
+    overall_features = _LazyLevel('calculate_overall_features', _settings) # feature > value
+    overall_features_by_type = _LazyLevel('calculate_overall_features_by_type', _settings + ('accelerometer', 'normality_alpha')) # test_type > feature > value
 
-    def calculate_single_run_features(self):
-        # For each run, get all the RTs and features
-        for subject in self.dataset:
-            if subject not in self.single_run_features:
-                self.single_run_features[subject] = dict()
+    run_hetero_homo_ratio = _LazyLevel('calculate_single_run_features_by_type', _settings + ('accelerometer', 'normality_alpha')) # subject > run > value
+    subject_hetero_homo_ratio = _LazyLevel('calculate_subject_features_by_type', _settings + ('accelerometer', 'normality_alpha')) # subject > value
+    overall_hetero_homo_ratio = _LazyLevel('calculate_overall_features_by_type', _settings + ('accelerometer', 'normality_alpha'))
+
+    # Previous > current test type transitions, from the full trial lists
+    run_sequential_effects = _LazyLevel('calculate_sequential_effects', _settings + ('accelerometer',), incremental=False) # subject > run > transition > feature > value
+    subject_sequential_effects = _LazyLevel('calculate_sequential_effects', _settings + ('accelerometer',), incremental=False) # subject > transition > feature > value
+    overall_sequential_effects = _LazyLevel('calculate_sequential_effects', _settings + ('accelerometer',), incremental=False) # transition > feature > value
 
-            for run in self.dataset[subject]:
-                if run not in self.single_run_features[subject]:
-                    self.single_run_features[subject][run] = dict()
+    def __init__(self, dataset:dict[str, list[dict]] | TrialStore, only_physiological:bool = False, accelerometer:bool = False):
+        self._levels:dict = dict() # level > value
+        self._level_keys:dict[str, tuple] = dict() # level > settings it was computed with
+        self._dataset_version = 0
 
-                # Simplify the variable names
-                rt_acc = self.dataset[subject][run]['rt_acc'].flatten()
-                if self.only_physiological:
-                    rt_acc = rt_acc[(rt_acc > Features.lower_limit) & (rt_acc < Features.upper_limit)]
+        self._trial_table:TrialTable = None
+        self._full_trials:dict[bool, tuple] = dict() # accelerometer > (RT, test type, run offsets)
 
-                if len(rt_acc) == 0:
-                    rt_acc = np.array([np.nan])
+        self.dataset = dataset
+        self.only_physiological = only_physiological
+        self.accelerometer = accelerometer # Full RTs from the accelerometer (True) or the box (False)
+
+        # Mergeable statistics used by add_run and remove_run (None is the key of all the test types)
+        self._run_statistics:dict[str, dict[str, dict]] = dict() # subject > run > test_type > statistics
+        self._subject_statistics:dict[str, dict] = dict() # subject > test_type > statistics
+        self._overall_statistics:dict = dict() # test_type > statistics
+        self._statistics_key:tuple = None
+        # Kept RTs of the overall groups (None: all the test types, 'RT' and 'test_type': full trial lists), spliced run by run once gathered
+        self._overall_rt:dict = None
+        # Subjects (ordered, as a dict) and overall whose features are computed again from the statistics when next read
+        self._stale_subjects:dict[str, None] = dict()
+        self._stale_overall = False
+
+        # Quality of the vibration stimulus of each run (see calculate_vibration_quality), None until computed
+        self.run_vibration_quality:np.ndarray = None
+
+        self.keep_rt = True # Keep the raw RTs in the results (for the plots and the normality tests)
+        self._streaming = False # Built from a stream of runs, the dataset is not kept
+
+    @property
+    def dataset(self) -> dict[str, dict] | TrialStore:
+        return self._dataset
+
+    @dataset.setter
+    def dataset(self, dataset:dict[str, dict] | TrialStore):
+        self._dataset = dataset
+        self.invalidate()
+
+    def invalidate(self):
+        # Forget everything computed from the dataset, e.g. after changing it in place
+        self._dataset_version += 1
+        self._trial_table = None
+        self._full_trials = dict()
+
+    def _dependency_key(self, dependencies:tuple[str, ...]) -> tuple:
+        return tuple(self._dataset_version if dependency == 'dataset' else getattr(self, dependency) for dependency in dependencies)
+
+    def _get_full_rt(self, vb_index:np.ndarray, mv_index:np.ndarray, t:np.ndarray) -> np.ndarray:
+        return get_full_rt(vb_index, mv_index, t)
+
+    def _get_trial_table(self) -> TrialTable:
+        if self._streaming:
+            raise RuntimeError('The dataset of streamed features is not kept, use add_run to update them')
+        if self._trial_table is None:
+            self._trial_table = TrialTable(self.dataset)
+        self._trial_table.set_validity(self.only_physiological, self.lower_limit, self.upper_limit)
+        return self._trial_table
+
+    def _get_run_full_trials(self, data:dict, accelerometer:bool) -> tuple[np.ndarray, np.ndarray]:
+        # Full RT (NaN if missing) and test type of every trial of one run
+        if accelerometer == True:
+            rt = self._get_full_rt(data['vb_index'], data['mv_index'], data['t'])
+        else:
+            # Missing presses may still be marked with -1
+            rt = np.asarray(data['all_rt_box'], dtype=float).ravel()
+            rt = np.where(rt == -1, np.nan, rt)
+        return rt, data['test_type'].flatten()
+
+    def _get_full_trials(self, accelerometer:bool) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Full RT (NaN if missing) and test type of every trial, run after run
+        if accelerometer not in self._full_trials and isinstance(self.dataset, TrialStore):
+            # Views of the store, whose full RTs were read from its kind of data
+            store = self.dataset
+            if accelerometer != (store.kind == 'acc'):
+                raise ValueError(f"The full RTs of a '{store.kind}' store cannot be used with accelerometer={accelerometer}")
+            self._full_trials[accelerometer] = (store.full['rt'], store.full['test_type'], store.full_offsets)
+        elif accelerometer not in self._full_trials:
+            runs = self._get_trial_table().runs
+            all_rt = []
+            all_test_types = []
+            for subject, run in runs:
+                rt, test_type = self._get_run_full_trials(self.dataset[subject][run], accelerometer)
+                all_rt.append(rt)
+                all_test_types.append(test_type)
+
+            offsets = np.concatenate(([0], np.cumsum([len(tt) for tt in all_test_types])))
+            self._full_trials[accelerometer] = (_concatenate(all_rt), _concatenate(all_test_types), offsets)
+
+        return self._full_trials[accelerometer]
+
+    def _get_full_trial_runs(self) -> tuple[list[tuple[str, str]], np.ndarray, np.ndarray, np.ndarray]:
+        # Runs, then full RT, test type and run offsets of every trial, also for streamed features (if the RTs are kept)
+        if not self._streaming:
+            all_rt, all_test_types, offsets = self._get_full_trials(self.accelerometer)
+            return self._get_trial_table().runs, all_rt, all_test_types, offsets
+
+        runs = [(subject, run) for subject in self.single_run_features_by_type for run in self.single_run_features_by_type[subject]]
+        if any('RT' not in self.single_run_features_by_type[subject][run] for subject, run in runs):
+            raise ValueError('The trials are not kept, use keep_rt=True')
+        rt = [np.ravel(self.single_run_features_by_type[subject][run]['RT']) for subject, run in runs]
+        test_types = [np.ravel(self.single_run_features_by_type[subject][run]['test_type']) for subject, run in runs]
+        return runs, _concatenate(rt), _concatenate(test_types), np.concatenate(([0], np.cumsum([len(r) for r in rt]))).astype(np.int64)
+
+    def query(self, subjects:Iterable[str] = None, runs:Iterable[str] = None, test_types:Iterable = None) -> TrialSelection:
+        """
+        Select the trials kept by the analysis of some subjects, runs and test types.
+
+            selection = features.query(subjects=['X03004', 'X05398'], runs=['2'], test_types=[2])
+            rt_acc = selection.take(features.trials.rt_acc)
+
+        Parameters:
+            subjects (Iterable[str]): Subjects (all by default).
+            runs (Iterable[str]): Run names (all by default).
+            test_types (Iterable): Test types (all the trials by default).
+
+        Returns:
+            TrialSelection: Selected trials, in trial order.
+        """
+        table = self._get_trial_table()
+        if subjects is None and runs is None and test_types is None:
+            return table.valid_trials
+        if self.only_physiological:
+            return table.index.query(subjects, runs, test_types, self.lower_limit, self.upper_limit)
+        return table.index.query(subjects, runs, test_types)
+
+    def _count_subjects(self, table:TrialTable):
+        # Runs and trials of each subject in a stage of every subject at once, only when profiling
+        if active() is not None:
+            run_offsets = table.index.run_offsets[table.index.subject_run_offsets]
+            count_subjects(table.subjects, runs=np.diff(table.index.subject_run_offsets), trials=np.diff(run_offsets))
+
+    @property
+    def trials(self) -> TrialTable:
+        # Columns of all the trials (rt_acc, test_type, ...), read with TrialSelection.take
+        return self._get_trial_table()
+
+    def _group_features(self, *keys:str) -> tuple[dict[str, np.ndarray], list[np.ndarray]]:
+        # Statistical features and RTs of each group of valid trials (see TrialSelection.group_by)
+        selection = self.query()
+        group, n_groups, _ = selection.group_by(*keys)
+        rt_acc = selection.take(self.trials.rt_acc)
+        return _group_statistics(group, rt_acc, n_groups), _group_views(group, rt_acc, n_groups)
+
+    def _group_hetero_homo_ratio(self, *keys:str) -> np.ndarray:
+        # Mean heterotopic RT over mean homotopic RT of each group of valid trials
+        means = []
+        for test_types in (Features.hetero_types, Features.homo_types):
+            selection = self.query(test_types=test_types)
+            group, n_groups, _ = selection.group_by(*keys)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means.append(np.bincount(group, weights=selection.take(self.trials.rt_acc), minlength=n_groups) / np.bincount(group, minlength=n_groups))
+        return means[0] / means[1]
+
+    def _set_normality(self, features:list[dict]):
+        # Shapiro-Wilk verdict of every group of a level at once, the groups already tested come from the cache
+        results = shapiro_groups([f['rt_acc'] for f in features], self.normality_alpha, self.normality_workers)
+        for f, verdict in zip(features, results['verdict']):
+            f['normality'] = str(verdict)
+
+    def _feature_dict(self, statistics:dict[str, np.ndarray], i:int, rt_acc:np.ndarray) -> dict:
+        if len(rt_acc) == 0:
+            rt_acc = np.array([np.nan])
+        features = {feature: statistics[feature][i] for feature in ['mean', 'median', 'std', 'min', 'max']}
+        features['rt_acc'] = rt_acc
+        return features
+
+    @profiled('features')
+    def calculate_single_run_features(self):
+        # For each run, get all the RTs and features
+        table = self._get_trial_table()
+        count(subjects=len(table.subjects), runs=len(table.runs), trials=len(table.rt_acc))
+        self._count_subjects(table)
+        self.single_run_features = dict()
+        statistics, rts = self._group_features('run')
 
-                self.single_run_features[subject][run]['mean'] = np.mean(rt_acc)
-                self.single_run_features[subject][run]['median'] = np.median(rt_acc)
-                self.single_run_features[subject][run]['std'] = np.std(rt_acc)
-                self.single_run_features[subject][run]['min'] = np.min(rt_acc)
-                self.single_run_features[subject][run]['max'] = np.max(rt_acc)
-                self.single_run_features[subject][run]['rt_acc'] = rt_acc
+        for i, (subject, run) in enumerate(table.runs):
+            if subject not in self.single_run_features:
+                self.single_run_features[subject] = dict()
+            self.single_run_features[subject][run] = self._feature_dict(statistics, i, rts[i])
 
     def print_single_run_features(self):
         for subject in self.single_run_features:
@@ -80,67 +519,42 @@ class Features():
                         continue
                     print(f'\t\t{feature}: {self.single_run_features[subject][run][feature]:.6g} ms')
 
-    def calculate_single_run_features_by_type(self, accelerometer:bool = False):
-        # For each run, get all the RTs and features
-        for subject in self.dataset:
+    @profiled('features')
+    def calculate_single_run_features_by_type(self, accelerometer:bool = None):
+        # For each run, get the RTs and features of each test type
+        if accelerometer is not None:
+            self.accelerometer = accelerometer
+        table = self._get_trial_table()
+        count(subjects=len(table.subjects), runs=len(table.runs), trials=len(table.rt_acc))
+        self._count_subjects(table)
+        self.single_run_features_by_type = dict()
+        self.run_hetero_homo_ratio = dict()
+        n_types = len(table.test_types)
+        statistics, rts = self._group_features('run', 'test_type')
+        ratios = self._group_hetero_homo_ratio('run')
+        all_rt, all_test_types, offsets = self._get_full_trials(self.accelerometer)
+        tested = []
+
+        for i, (subject, run) in enumerate(table.runs):
             if subject not in self.single_run_features_by_type:
                 self.single_run_features_by_type[subject] = dict()
             if subject not in self.run_hetero_homo_ratio:
                 self.run_hetero_homo_ratio[subject] = dict()
-            rt_by_type:dict[int, np.ndarray] = dict()
-
-            for run in self.dataset[subject]:
-                # Calculate statistical features by test type for each run
-                if run not in self.single_run_features_by_type[subject]:
-                    self.single_run_features_by_type[subject][run] = dict()
-                if run not in self.run_hetero_homo_ratio[subject]:
-                    self.run_hetero_homo_ratio[subject][run] = dict()
-
-                # Simplify the variable names
-                acc_test_type = self.dataset[subject][run]['acc_test_type'].flatten()
-                test_type = self.dataset[subject][run]['test_type'].flatten()
-                rt_acc = self.dataset[subject][run]['rt_acc'].flatten()
-                if self.only_physiological:
-                    acc_test_type = acc_test_type[(rt_acc > Features.lower_limit) & (rt_acc < Features.upper_limit)]
-                    rt_acc = rt_acc[(rt_acc > Features.lower_limit) & (rt_acc < Features.upper_limit)]
-
-                for type in np.sort(np.unique(test_type[test_type > 0])):
-                    if type not in rt_by_type:
-                        rt_by_type[type] = np.array([])
-                    if type not in self.single_run_features_by_type[subject][run]:
-                        self.single_run_features_by_type[subject][run][type] = dict()
-
-                    rt_by_type[type] = rt_acc[acc_test_type == type]
-
-                    if len(rt_by_type[type]) == 0:
-                        rt_by_type[type] = np.array([np.nan])
-                    self.single_run_features_by_type[subject][run][type] = dict()
-                    self.single_run_features_by_type[subject][run][type]['mean'] = np.mean(rt_by_type[type])
-                    self.single_run_features_by_type[subject][run][type]['median'] = np.median(rt_by_type[type])
-                    self.single_run_features_by_type[subject][run][type]['std'] = np.std(rt_by_type[type])
-                    self.single_run_features_by_type[subject][run][type]['min'] = np.min(rt_by_type[type])
-                    self.single_run_features_by_type[subject][run][type]['max'] = np.max(rt_by_type[type])
-                    self.single_run_features_by_type[subject][run][type]['rt_acc'] = rt_by_type[type]
-
-                    if len(rt_by_type[type]) > 3 and _check_normality(rt_by_type[type]):
-                        self.single_run_features_by_type[subject][run][type]['normality'] = 'Yes'
-                    else:
-                        self.single_run_features_by_type[subject][run][type]['normality'] = 'No'
-
-                hetero = rt_acc[np.logical_or(acc_test_type == 1, acc_test_type == 2)]
-                homo = rt_acc[np.logical_or(acc_test_type == 3, acc_test_type == 4)]
-                self.run_hetero_homo_ratio[subject][run] = np.mean(hetero) / np.mean(homo)
-
-                # Get full rts from matlab
-                if accelerometer == True:
-                    vb_index = self.dataset[subject][run]['vb_index'].flatten()
-                    mv_index = self.dataset[subject][run]['mv_index'].flatten()
-                    t = self.dataset[subject][run]['t'].flatten()
-                    self.single_run_features_by_type[subject][run]['RT'] = self._get_full_rt(vb_index, mv_index, t)
-                    self.single_run_features_by_type[subject][run]['test_type'] = test_type
-                else:
-                    self.single_run_features_by_type[subject][run]['RT'] = self.dataset[subject][run]['all_rt_box']
-                    self.single_run_features_by_type[subject][run]['test_type'] = test_type
+            self.single_run_features_by_type[subject][run] = dict()
+
+            # Only the test types that appear in the run
+            for j in np.flatnonzero(table.run_has_type[i]):
+                features = self._feature_dict(statistics, i * n_types + j, rts[i * n_types + j])
+                tested.append(features)
+                self.single_run_features_by_type[subject][run][table.test_types[j]] = features
+
+            self.run_hetero_homo_ratio[subject][run] = ratios[i]
+
+            # Full rts from matlab (or box), as views of the full trial arrays
+            self.single_run_features_by_type[subject][run]['RT'] = all_rt[offsets[i]:offsets[i + 1]]
+            self.single_run_features_by_type[subject][run]['test_type'] = all_test_types[offsets[i]:offsets[i + 1]]
+
+        self._set_normality(tested)
 
     def get_single_run_features_by_type(self):
         return self.single_run_features_by_type
@@ -163,33 +577,17 @@ class Features():
                         print(f'\t\t\t{feature}: {self.single_run_features_by_type[subject][run][test_type][feature]:.6g} ms')
                 print(f'\t\tHeterotopic over homotopic ratio: {self.run_hetero_homo_ratio[subject][run]:.6g}')
 
+    @profiled('features')
     def calculate_subject_features(self):
         # For each subject, get all the RTs and features
-        for subject in self.dataset:
-            if subject not in self.subject_features:
-                self.subject_features[subject] = dict()
-
-            rt = np.array([])
-
-            # Loop through the runs of each subject
-            for run in self.dataset[subject]:
-                # Simplify the variable names
-                rt_acc = self.dataset[subject][run]['rt_acc'].flatten()
-                if self.only_physiological:
-                    rt_acc = rt_acc[(rt_acc > Features.lower_limit) & (rt_acc < Features.upper_limit)]
+        table = self._get_trial_table()
+        count(subjects=len(table.subjects), runs=len(table.runs), trials=len(table.rt_acc))
+        self._count_subjects(table)
+        self.subject_features = dict()
+        statistics, rts = self._group_features('subject')
 
-                rt = np.concatenate((rt, rt_acc), axis=None)
-
-            if len(rt) == 0:
-                rt = np.array([np.nan])
-
-            # Calculate statistical features for each subject
-            self.subject_features[subject]['mean'] = np.mean(rt)
-            self.subject_features[subject]['median'] = np.median(rt)
-            self.subject_features[subject]['std'] = np.std(rt)
-            self.subject_features[subject]['min'] = np.min(rt)
-            self.subject_features[subject]['max'] = np.max(rt)
-            self.subject_features[subject]['rt_acc'] = rt
+        for i, subject in enumerate(table.subjects):
+            self.subject_features[subject] = self._feature_dict(statistics, i, rts[i])
 
     def print_subject_features(self):
         for subject in self.subject_features:
@@ -199,73 +597,38 @@ class Features():
                     continue
                 print(f'\t{feature}: {self.subject_features[subject][feature]:.6g} ms')
 
-    def calculate_subject_features_by_type(self, accelerometer:bool = False):
-        # For each subject, get all the RTs and features
-        for subject in self.dataset:
-            if subject not in self.subject_features_by_type:
-                self.subject_features_by_type[subject] = dict()
-            if subject not in self.subject_hetero_homo_ratio:
-                self.subject_hetero_homo_ratio[subject] = dict()
-
-            rt_by_type:dict[int, np.ndarray] = dict()
-            all_rt = np.array([])
-            all_test_types = np.array([])
-            # Loop through the runs of each subject
-            for run in self.dataset[subject]:
-                # Simplify the variable names
-                acc_test_type = self.dataset[subject][run]['acc_test_type'].flatten()
-                test_type = self.dataset[subject][run]['test_type'].flatten()
-                rt_acc = self.dataset[subject][run]['rt_acc'].flatten()
-                if self.only_physiological:
-                    acc_test_type = acc_test_type[(rt_acc > Features.lower_limit) & (rt_acc < Features.upper_limit)]
-                    rt_acc = rt_acc[(rt_acc > Features.lower_limit) & (rt_acc < Features.upper_limit)]
-
-                # Loop through each test type and calculate the average reaction times
-                for i in np.sort(np.unique(test_type[test_type > 0])):
-                    if i not in rt_by_type:
-                        rt_by_type[i] = np.array([])
-
-                    rt_by_type[i] = np.concatenate((rt_by_type[i], rt_acc[acc_test_type == i]), axis=None)
-
-                # Get full rts from matlab
-                if accelerometer == True:
-                    vb_index = self.dataset[subject][run]['vb_index'].flatten()
-                    mv_index = self.dataset[subject][run]['mv_index'].flatten()
-                    t = self.dataset[subject][run]['t'].flatten()
-
-                    all_rt = np.concatenate((all_rt, self._get_full_rt(vb_index, mv_index, t)), axis=None)
-                    all_test_types = np.concatenate((all_test_types, test_type), axis=None)
-                else:
-                    all_rt = np.concatenate((all_rt, self.dataset[subject][run]['all_rt_box']), axis=None)
-                    all_test_types = np.concatenate((all_test_types, test_type), axis=None)
-
-            self.subject_features_by_type[subject]['RT'] = all_rt
-            self.subject_features_by_type[subject]['test_type'] = all_test_types
+    @profiled('features')
+    def calculate_subject_features_by_type(self, accelerometer:bool = None):
+        # For each subject, get the RTs and features of each test type
+        if accelerometer is not None:
+            self.accelerometer = accelerometer
+        table = self._get_trial_table()
+        count(subjects=len(table.subjects), runs=len(table.runs), trials=len(table.rt_acc))
+        self._count_subjects(table)
+        self.subject_features_by_type = dict()
+        self.subject_hetero_homo_ratio = dict()
+        n_types = len(table.test_types)
+        statistics, rts = self._group_features('subject', 'test_type')
+        ratios = self._group_hetero_homo_ratio('subject')
+        all_rt, all_test_types, offsets = self._get_full_trials(self.accelerometer)
+        tested = []
+
+        for i, subject in enumerate(table.subjects):
+            # The runs of a subject are contiguous in the full trial arrays
+            first_run, last_run = table.subject_run_offsets[i], table.subject_run_offsets[i + 1]
+            self.subject_features_by_type[subject] = dict()
+            self.subject_features_by_type[subject]['RT'] = all_rt[offsets[first_run]:offsets[last_run]]
+            self.subject_features_by_type[subject]['test_type'] = all_test_types[offsets[first_run]:offsets[last_run]]
 
             # Calculate statistical features by test type for each subject
-            for i in np.sort(np.unique(test_type[test_type > 0])):
-                if i not in self.subject_features_by_type[subject]:
-                    self.subject_features_by_type[subject][i] = dict()
-
-                if len(rt_by_type[i]) == 0:
-                    rt_by_type[i] = np.array([np.nan])
-                self.subject_features_by_type[subject][i]['mean'] = np.mean(rt_by_type[i])
-                self.subject_features_by_type[subject][i]['median'] = np.median(rt_by_type[i])
-                self.subject_features_by_type[subject][i]['std'] = np.std(rt_by_type[i])
-                self.subject_features_by_type[subject][i]['min'] = np.min(rt_by_type[i])
-                self.subject_features_by_type[subject][i]['max'] = np.max(rt_by_type[i])
-                self.subject_features_by_type[subject][i]['rt_acc'] = rt_by_type[i]
-
-                if len(rt_by_type[i]) < 3:
-                    self.subject_features_by_type[subject][i]['normality'] = 'Not enough data'
-                elif _check_normality(rt_by_type[i]):
-                    self.subject_features_by_type[subject][i]['normality'] = 'Yes'
-                else:
-                    self.subject_features_by_type[subject][i]['normality'] = 'No'
-
-            hetero = np.concatenate((rt_by_type[1], rt_by_type[2]), axis=None)
-            homo = np.concatenate((rt_by_type[3], rt_by_type[4]), axis=None)
-            self.subject_hetero_homo_ratio[subject] = np.mean(hetero) / np.mean(homo)
+            for j in np.flatnonzero(table.run_has_type[first_run:last_run].any(axis=0)):
+                features = self._feature_dict(statistics, i * n_types + j, rts[i * n_types + j])
+                tested.append(features)
+                self.subject_features_by_type[subject][table.test_types[j]] = features
+
+            self.subject_hetero_homo_ratio[subject] = ratios[i]
+
+        self._set_normality(tested)
 
     def get_subject_features_by_type(self):
         return self.subject_features_by_type
@@ -286,28 +649,15 @@ class Features():
                     print(f'\t\t{feature}: {self.subject_features_by_type[subject][test_type][feature]:.6g} ms')
             print(f'\tHeterotopic over homotopic ratio: {self.subject_hetero_homo_ratio[subject]:.6g}')
 
+    @profiled('features')
     def calculate_overall_features(self):
         # Get all the RTs and features
-        rt = np.array([])
-
-        for subject in self.dataset:
-            for run in self.dataset[subject]:
-                # Simplify the variable names
-                rt_acc = self.dataset[subject][run]['rt_acc'].flatten()
-                if self.only_physiological:
-                    rt_acc = rt_acc[(rt_acc > Features.lower_limit) & (rt_acc < Features.upper_limit)]
-
-                rt = np.concatenate((rt, rt_acc), axis=None)
-
-        if len(rt) == 0:
-            rt = np.array(np.nan)
-        # Calculate statistical features for all subjects
-        self.overall_features['mean'] = np.mean(rt)
-        self.overall_features['median'] = np.median(rt)
-        self.overall_features['std'] = np.std(rt)
-        self.overall_features['min'] = np.min(rt)
-        self.overall_features['max'] = np.max(rt)
-        self.overall_features['rt_acc'] = rt
+        table = self._get_trial_table()
+        count(subjects=len(table.subjects), runs=len(table.runs), trials=len(table.rt_acc))
+        self._count_subjects(table)
+        statistics, rts = self._group_features()
+
+        self.overall_features = self._feature_dict(statistics, 0, rts[0])
 
     def print_overall_features(self):
         for feature in self.overall_features:
@@ -316,67 +666,28 @@ class Features():
             print(f'{feature}: {self.overall_features[feature]:.6g} ms')
         print(' \n')
 
-    def calculate_overall_features_by_type(self, accelerometer:bool = False):
-        # Get all the RTs and features
-        rt_by_type:dict[int, np.ndarray] = dict()
-
-        all_rt = np.array([])
-        all_test_types = np.array([])
-        for subject in self.dataset:
-            for run in self.dataset[subject]:
-                # Simplify the variable names
-                acc_test_type = self.dataset[subject][run]['acc_test_type'].flatten()
-                test_type = self.dataset[subject][run]['test_type'].flatten()
-                rt_acc = self.dataset[subject][run]['rt_acc'].flatten()
-                if self.only_physiological:
-                    acc_test_type = acc_test_type[(rt_acc > Features.lower_limit) & (rt_acc < Features.upper_limit)]
-                    rt_acc = rt_acc[(rt_acc > Features.lower_limit) & (rt_acc < Features.upper_limit)]
-
-                # Loop through each test type and calculate the average reaction times
-                for i in np.sort(np.unique(test_type[test_type > 0])):
-                    if i not in rt_by_type:
-                        rt_by_type[i] = np.array([])
-
-                    rt_by_type[i] = np.concatenate((rt_by_type[i], rt_acc[acc_test_type == i]), axis=None)
-
-                # Get full rts from matlab
-                if accelerometer == True:
-                    vb_index = self.dataset[subject][run]['vb_index'].flatten()
-                    mv_index = self.dataset[subject][run]['mv_index'].flatten()
-                    t = self.dataset[subject][run]['t'].flatten()
-
-                    all_rt = np.concatenate((all_rt, self._get_full_rt(vb_index, mv_index, t)), axis=None)
-                    all_test_types = np.concatenate((all_test_types, test_type), axis=None)
-                else:
-                    all_rt = np.concatenate((all_rt, self.dataset[subject][run]['all_rt_box']), axis=None)
-                    all_test_types = np.concatenate((all_test_types, test_type), axis=None)
+    @profiled('features')
+    def calculate_overall_features_by_type(self, accelerometer:bool = None):
+        # Get the RTs and features of each test type
+        if accelerometer is not None:
+            self.accelerometer = accelerometer
+        table = self._get_trial_table()
+        count(subjects=len(table.subjects), runs=len(table.runs), trials=len(table.rt_acc))
+        self._count_subjects(table)
+        self.overall_features_by_type = dict()
+        n_types = len(table.test_types)
+        statistics, rts = self._group_features('test_type')
+        all_rt, all_test_types, _ = self._get_full_trials(self.accelerometer)
 
         self.overall_features_by_type['RT'] = all_rt
         self.overall_features_by_type['test_type'] = all_test_types
 
         # Calculate statistical features by test type for all subjects
-        for i in np.sort(np.unique(test_type[test_type > 0])):
-            if i not in self.overall_features_by_type:
-                self.overall_features_by_type[i] = dict()
-
-            if len(rt_by_type[i]) == 0:
-                rt_by_type[i] = np.array([np.nan])
-
-            self.overall_features_by_type[i]['mean'] = np.mean(rt_by_type[i])
-            self.overall_features_by_type[i]['median'] = np.median(rt_by_type[i])
-            self.overall_features_by_type[i]['std'] = np.std(rt_by_type[i])
-            self.overall_features_by_type[i]['min'] = np.min(rt_by_type[i])
-            self.overall_features_by_type[i]['max'] = np.max(rt_by_type[i])
-            self.overall_features_by_type[i]['rt_acc'] = rt_by_type[i]
-
-            if _check_normality(rt_by_type[i]):
-                self.overall_features_by_type[i]['normality'] = 'Yes'
-            else:
-                self.overall_features_by_type[i]['normality'] = 'No'
+        for j in range(n_types):
+            self.overall_features_by_type[table.test_types[j]] = self._feature_dict(statistics, j, rts[j])
+        self._set_normality([self.overall_features_by_type[t] for t in table.test_types])
 
-        hetero = np.concatenate((rt_by_type[1], rt_by_type[2]), axis=None)
-        homo = np.concatenate((rt_by_type[3], rt_by_type[4]), axis=None)
-        self.overall_hetero_homo_ratio = np.mean(hetero) / np.mean(homo)
+        self.overall_hetero_homo_ratio = self._group_hetero_homo_ratio()[0]
 
     def get_overall_features_by_type(self):
         return self.overall_features_by_type
@@ -395,6 +706,790 @@ class Features():
                 print(f'\t{feature}: {self.overall_features_by_type[test_type][feature]:.6g} ms')
         print(f'Heterotopic over homotopic ratio: {self.overall_hetero_homo_ratio:.6g}')
 
+    def _sequence_dict(self, cells:dict[str, np.ndarray], transitions:dict[str, np.ndarray], i:int, test_types:np.ndarray) -> dict:
+        # Features of each transition of group i: 'repeat', 'switch', (previous, current) cells and the switch cost (ms)
+        def features(statistics:dict[str, np.ndarray], k:int) -> dict:
+            return {feature: statistics[feature][k] for feature in ['count', 'mean', 'median', 'std', 'min', 'max']}
+
+        n_types = len(test_types)
+        effects = {'repeat': features(transitions, 2 * i), 'switch': features(transitions, 2 * i + 1)}
+        for p in range(n_types):
+            for c in range(n_types):
+                effects[(test_types[p], test_types[c])] = features(cells, (i * n_types + p) * n_types + c)
+        effects['switch_cost'] = effects['switch']['mean'] - effects['repeat']['mean']
+        return effects
+
+    @profiled('features')
+    def calculate_sequential_effects(self, accelerometer:bool = None):
+        """
+        RT features of each transition from the test type of the previous trial
+        to the current one (previous > current, repeat, switch and switch cost),
+        in each run, subject and overall.
+
+        Parameters:
+            accelerometer (bool): Source of the full RTs (default: self.accelerometer).
+        """
+        if accelerometer is not None:
+            self.accelerometer = accelerometer
+        table = self._get_trial_table()
+        all_rt, all_test_types, offsets = self._get_full_trials(self.accelerometer)
+        n_runs = len(table.runs)
+        n_subjects = len(table.subjects)
+        n_types = len(table.test_types)
+        n_cells = n_types * n_types
+        count(subjects=n_subjects, runs=n_runs, trials=len(all_rt))
+        self._count_subjects(table)
+
+        rt = np.asarray(all_rt, dtype=float) * 1000 # ms
+        known = np.isin(all_test_types, table.test_types)
+        current = np.where(known, np.searchsorted(table.test_types, all_test_types), n_types)
+
+        # Test type of the previous trial, shifting the whole cohort at once (none for the first trial of each run)
+        previous = np.empty_like(current)
+        previous[1:] = current[:-1]
+        first = offsets[:-1]
+        previous[first[first < len(previous)]] = n_types
+
+        with np.errstate(invalid='ignore'):
+            kept = (current < n_types) & (previous < n_types) & ~np.isnan(rt) & _valid_trials(rt, self.only_physiological, self.lower_limit, self.upper_limit)
+        # Only the counted trials are grouped
+        rt = rt[kept]
+        cell = (previous * n_types + current)[kept]
+        switch = (previous != current)[kept].astype(np.intp)
+        run_index = np.repeat(np.arange(n_runs), np.diff(offsets))[kept]
+
+        def level(index:np.ndarray, n_groups:int) -> list[dict]:
+            cells = _group_statistics(index * n_cells + cell, rt, n_groups * n_cells)
+            transitions = _group_statistics(index * 2 + switch, rt, n_groups * 2)
+            return [self._sequence_dict(cells, transitions, i, table.test_types) for i in range(n_groups)]
+
+        runs = level(run_index, n_runs)
+        subjects = level(table.run_subject[run_index], n_subjects)
+
+        self.run_sequential_effects = dict()
+        for i, (subject, run) in enumerate(table.runs):
+            self.run_sequential_effects.setdefault(subject, dict())[run] = runs[i]
+        self.subject_sequential_effects = dict(zip(table.subjects, subjects))
+        self.overall_sequential_effects = level(np.zeros(len(rt), dtype=np.intp), 1)[0]
+
+    def get_transition_matrix(self, feature:str = 'mean', subject:str = None, run:str = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Previous > current matrix of one feature of the sequential effects.
+
+        Parameters:
+            feature (str): 'count', 'mean', 'median', 'std', 'min' or 'max'.
+            subject (str): Subject (overall by default).
+            run (str): Run of the subject (all the runs by default).
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Test types and matrix (previous type x current type).
+        """
+        if subject is None:
+            effects = self.overall_sequential_effects
+        elif run is None:
+            effects = self.subject_sequential_effects[subject]
+        else:
+            effects = self.run_sequential_effects[subject][run]
+        test_types = np.array(sorted({previous for previous, _ in (key for key in effects if isinstance(key, tuple))}))
+        return test_types, np.array([[effects[(previous, current)][feature] for current in test_types] for previous in test_types])
+
+    def print_sequential_effects(self):
+        effects = self.overall_sequential_effects
+        for transition in ['repeat', 'switch']:
+            print(f"{transition.capitalize()}: mean {effects[transition]['mean']:.6g} ms - median {effects[transition]['median']:.6g} ms (n = {effects[transition]['count']})")
+        print(f"Switch cost: {effects['switch_cost']:.6g} ms")
+        test_types, matrix = self.get_transition_matrix('mean')
+        print('Mean RT (ms), previous type (rows) > current type (columns):')
+        print('\t' + '\t'.join(str(t) for t in test_types))
+        for previous, row in zip(test_types, matrix):
+            print(f'{previous}\t' + '\t'.join(f'{value:.6g}' for value in row))
+        for subject in self.subject_sequential_effects:
+            print(f"Subject {subject} - switch cost: {self.subject_sequential_effects[subject]['switch_cost']:.6g} ms")
+
+    def calculate_all_features(self, accelerometer:bool = None):
+        self.calculate_single_run_features()
+        self.calculate_single_run_features_by_type(accelerometer)
+        self.calculate_subject_features()
+        self.calculate_subject_features_by_type(accelerometer)
+        self.calculate_overall_features()
+        self.calculate_overall_features_by_type(accelerometer)
+
+    @profiled('bootstrap')
+    def bootstrap_hetero_homo_ratio(self, n_resamples:int = 10000, confidence:float = 0.95, method:str = 'bca', seed:int = None, max_memory:int = 2**26) -> dict[str, np.ndarray]:
+        """
+        Bootstrap confidence intervals of the heterotopic over homotopic ratio of
+        the means and of the medians, for every run, subject and overall (the
+        trials are redrawn within each run and condition).
+
+        The cost grows with trials x resamples: about 25 s on one core for 200
+        subjects of 2 runs of 200 trials and 10000 resamples, two thirds drawing
+        the resamples and one third sorting them for the subject and overall medians.
+
+        Parameters:
+            n_resamples (int): Number of resamples.
+            confidence (float): Confidence level of the intervals.
+            method (str): 'percentile' or 'bca' (bias-corrected and accelerated).
+            seed (int): Seed of the random generator, for reproducible intervals.
+            max_memory (int): Approximate memory limit of the temporary arrays, in bytes.
+
+        Returns:
+            dict[str, np.ndarray]: 'run', 'subject' and 'overall' tables (see ratio_intervals_dtype).
+        """
+        table = self._get_trial_table()
+        selection = self.query(test_types=Features.hetero_types + Features.homo_types)
+        hetero = np.isin(selection.take(table.test_type), Features.hetero_types)
+        run_index = selection.run_index
+        subject_index = selection.subject_index
+        overall = np.zeros(len(run_index), dtype=np.intp)
+
+        levels = [
+            ('run', run_index, [(subject, run) for subject, run in table.runs]),
+            ('subject', subject_index, [(subject, '') for subject in table.subjects]),
+            ('overall', overall, [('', '')]),
+        ]
+        intervals = bootstrap_ratio(selection.take(table.rt_acc), hetero, run_index, [(group, len(names)) for _, group, names in levels], n_resamples, confidence, method, seed, max_memory)
+
+        results = dict()
+        for (level, group, names), level_intervals in zip(levels, intervals):
+            n_hetero = np.bincount(group[hetero], minlength=len(names))
+            n_homo = np.bincount(group[~hetero], minlength=len(names))
+            rows = np.zeros(2 * len(names), dtype=ratio_intervals_dtype)
+            for k, statistic in enumerate(['mean', 'median']):
+                rows[k::2]['subject'] = [subject for subject, _ in names]
+                rows[k::2]['run'] = [run for _, run in names]
+                rows[k::2]['statistic'] = statistic
+                rows[k::2]['n_hetero'] = n_hetero
+                rows[k::2]['n_homo'] = n_homo
+                for column in ['ratio', 'low', 'high']:
+                    rows[k::2][column] = level_intervals[statistic][column]
+            results[level] = rows
+
+        return results
+
+    def print_ratio_intervals(self, results:np.ndarray):
+        for row in results:
+            if row['run']:
+                name = f"Subject {row['subject']} - Run {row['run']}"
+            elif row['subject']:
+                name = f"Subject {row['subject']}"
+            else:
+                name = 'Overall'
+            print(f"{name} - ratio of the {row['statistic']}s: {row['ratio']:.6g} [{row['low']:.6g}, {row['high']:.6g}] (n = {row['n_hetero']} hetero, {row['n_homo']} homo)")
+
+    @profiled('features')
+    def sweep_limits(self, windows:Iterable[tuple[float, float]], level:str = 'run') -> np.ndarray:
+        """
+        Features of every group and test type for many physiological windows
+        (lower < RT < upper) at once, without changing the limits.
+
+            features.sweep_limits(itertools.product([150, 200, 250], [600, 700, 800]))
+
+        Parameters:
+            windows (Iterable[tuple[float, float]]): (lower, upper) limits (ms) of each window.
+            level (str): 'run', 'subject' or 'overall'.
+
+        Returns:
+            np.ndarray: One row per window, group and test type (limits_sweep_dtype), test type 0 being all the trials.
+        """
+        if level not in ('run', 'subject', 'overall'):
+            raise ValueError(f"Unknown level '{level}', expected 'run', 'subject' or 'overall'")
+        windows = np.array(list(windows), dtype=float).reshape(-1, 2)
+        table = self._get_trial_table()
+        n_types = len(table.test_types)
+
+        # Every trial, the windows replace the limits
+        selection = table.index.query()
+        index, n_groups, names = selection.group_by(*level_keys[level])
+        by_type, _, _ = selection.group_by(*level_keys[level], 'test_type')
+        names = _level_names(names)
+        count(groups=n_groups, windows=len(windows), trials=len(table.rt_acc))
+
+        # (window, group, type) statistics, the first type being all the trials
+        by_type = SortedGroups(by_type, table.rt_acc, n_groups * n_types).window(windows[:, 0], windows[:, 1])
+        pooled = SortedGroups(index, table.rt_acc, n_groups).window(windows[:, 0], windows[:, 1])
+        statistics = {feature: np.concatenate((pooled[feature][:, :, None], by_type[feature].reshape(len(windows), n_groups, n_types)), axis=2)
+                      for feature in ['count', 'sum', 'mean', 'median', 'std', 'min', 'max']}
+
+        # Mean heterotopic RT over mean homotopic RT from the sums of the test types
+        hetero = np.concatenate(([False], np.isin(table.test_types, Features.hetero_types)))
+        homo = np.concatenate(([False], np.isin(table.test_types, Features.homo_types)))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_hetero = statistics['sum'][:, :, hetero].sum(axis=2) / statistics['count'][:, :, hetero].sum(axis=2)
+            mean_homo = statistics['sum'][:, :, homo].sum(axis=2) / statistics['count'][:, :, homo].sum(axis=2)
+            ratio = mean_hetero / mean_homo
+
+        shape = (len(windows), n_groups, n_types + 1)
+        results = np.zeros(shape, dtype=limits_sweep_dtype)
+        results['lower'] = windows[:, 0, None, None]
+        results['upper'] = windows[:, 1, None, None]
+        results['subject'] = np.array([subject for subject, _ in names], dtype=str).reshape(1, n_groups, 1)
+        results['run'] = np.array([run for _, run in names], dtype=str).reshape(1, n_groups, 1)
+        results['test_type'] = np.concatenate(([0], table.test_types)).astype(np.int64)
+        for feature in ['count', 'mean', 'median', 'std', 'min', 'max']:
+            results[feature] = statistics[feature]
+        results['hetero_homo_ratio'] = ratio[:, :, None]
+        return results.ravel()
+
+    @profiled('distribution')
+    def fit_distributions(self, max_iterations:int = 200) -> dict[str, np.ndarray]:
+        """
+        Shape of the RT distribution (CV, skewness, quantiles and ex-Gaussian
+        fit) of every run, subject and overall, by test type and for all the trials.
+
+        Parameters:
+            max_iterations (int): Maximum number of iterations of the fits.
+
+        Returns:
+            dict[str, np.ndarray]: 'run', 'subject' and 'overall' tables (see distribution_fit_dtype),
+                test type 0 being all the trials.
+        """
+        table = self._get_trial_table()
+        n_types = len(table.test_types)
+        selection = self.query()
+        rt_acc = selection.take(table.rt_acc)
+        type_index = selection.type_index
+
+        levels = []
+        for level, keys in level_keys.items():
+            index, _, names = selection.group_by(*keys)
+            levels.append((level, index, _level_names(names)))
+
+        # Every (group, type) of every level is one segment, each RT is in its type and in all the trials (type 0)
+        groups, values, offset = [], [], 0
+        for _, index, names in levels:
+            cell = offset + index * (n_types + 1)
+            groups += [cell, np.where(type_index < n_types, cell + 1 + type_index, -1)]
+            values += [rt_acc, rt_acc]
+            offset += len(names) * (n_types + 1)
+        group = np.concatenate(groups)
+        values = np.concatenate(values).astype(float)
+        group = np.where(group < 0, offset, group)
+        count(groups=offset, trials=len(rt_acc))
+
+        shape = describe_groups(group, values, offset)
+        fit = fit_exgaussian(group, values, offset, max_iterations)
+
+        results = dict()
+        offset = 0
+        for level, _, names in levels:
+            cells = slice(offset, offset + len(names) * (n_types + 1))
+            rows = np.zeros(len(names) * (n_types + 1), dtype=distribution_fit_dtype)
+            rows['subject'] = np.repeat([subject for subject, _ in names], n_types + 1)
+            rows['run'] = np.repeat([run for _, run in names], n_types + 1)
+            rows['test_type'] = np.tile(np.concatenate(([0], table.test_types)).astype(np.int64), len(names))
+            for column, value in list(shape.items()) + list(fit.items()):
+                rows[column] = value[cells]
+            results[level] = rows
+            offset = cells.stop
+
+        return results
+
+    def print_distribution_fits(self, results:np.ndarray):
+        for row in results:
+            if row['run']:
+                name = f"Subject {row['subject']} - Run {row['run']}"
+            elif row['subject']:
+                name = f"Subject {row['subject']}"
+            else:
+                name = 'Overall'
+            test_type = f"test type {row['test_type']}" if row['test_type'] else 'all the test types'
+            print(f"{name} - {test_type} (n = {row['n']}): CV = {row['cv']:.3f}, skewness = {row['skewness']:.3f}, "
+                  f"ex-Gaussian mu = {row['mu']:.6g} ms, sigma = {row['sigma']:.6g} ms, tau = {row['tau']:.6g} ms")
+
+    def calculate_vibration_quality(self, signals:'SignalStore', workers:int = 1) -> np.ndarray:
+        """
+        Quality of the vibration stimulus of every run from the spectra of its
+        raw signal (see Spectrum.vibration_quality), also added to get_tables.
+
+        Parameters:
+            signals (SignalStore): Raw signals of the runs (e.g. from convert_directory).
+            workers (int): Number of processes (1 runs in this process, None uses every CPU).
+
+        Returns:
+            np.ndarray: One row per run (vibration_quality_dtype with the subject and the run).
+        """
+        # scipy.signal is only imported when the spectra are computed
+        from Functions.Spectrum import vibration_quality, vibration_quality_dtype
+
+        table = self._get_trial_table()
+        stored = {_parse_filename(name): name for name in signals.names() if '_run' in name.lower()}
+        found = [i for i, run in enumerate(table.runs) if run in stored]
+        quality = vibration_quality([os.path.join(signals.directory, stored[table.runs[i]]) for i in found], workers)
+
+        results = np.zeros(len(table.runs), dtype=[('subject', 'U32'), ('run', 'U16')] + vibration_quality_dtype.descr)
+        results['subject'] = [subject for subject, _ in table.runs]
+        results['run'] = [run for _, run in table.runs]
+        for feature in ('peak_frequency', 'band_power', 'snr_db', 'off_band_fraction', 'low_snr_fraction'):
+            results[feature] = np.nan
+        for feature in vibration_quality_dtype.names:
+            results[feature][found] = quality[feature]
+        self.run_vibration_quality = results
+        return results
+
+    def print_vibration_quality(self):
+        if self.run_vibration_quality is None:
+            return
+        for row in self.run_vibration_quality:
+            flag = ' - BAD STIMULUS' if row['bad_stimulus'] else ''
+            print(f"Subject {row['subject']} - Run {row['run']} ({row['n_trials']} trials): peak {row['peak_frequency']:.4g} Hz, "
+                  f"band power {row['band_power']:.4g}, SNR {row['snr_db']:.3g} dB, {100 * row['off_band_fraction']:.3g}% off band{flag}")
+
+    def _get_run_trials(self, data:dict) -> tuple[np.ndarray, np.ndarray]:
+        # Valid RTs of one run and their test types
+        rt_acc = np.asarray(data['rt_acc'], dtype=float).ravel()
+        test_type = np.asarray(data['acc_test_type']).ravel()
+        valid = _valid_trials(rt_acc, self.only_physiological, self.lower_limit, self.upper_limit)
+        return rt_acc[valid], test_type[valid]
+
+    def _get_run_statistics(self, data:dict) -> dict:
+        # Statistics of all the RTs of one run and of each test type found in its full trial list
+        rt_acc, test_type = self._get_run_trials(data)
+        statistics = {None: GroupStatistics.from_values(rt_acc)}
+        for t in np.unique(data['test_type']):
+            if t > 0:
+                statistics[t] = GroupStatistics.from_values(rt_acc[test_type == t])
+        return statistics
+
+    def _build_statistics(self):
+        # Statistics of every group of the current dataset, built once and then updated run by run
+        key = self._dependency_key(Features._settings)
+        if self._statistics_key == key:
+            return
+        if self._streaming:
+            raise RuntimeError('The limits of streamed features cannot be changed, the RTs are not kept')
+
+        table = self._get_trial_table()
+        n_subjects = len(table.subjects)
+        n_types = len(table.test_types)
+        selection = self.query()
+        rt_acc = selection.take(table.rt_acc)
+
+        def level(keys:tuple[str, ...], has_type:np.ndarray) -> list[dict]:
+            index, n_groups, _ = selection.group_by(*keys)
+            all_types = group_statistics(index, rt_acc, n_groups)
+            by_type = group_statistics(selection.group_by(*keys, 'test_type')[0], rt_acc, n_groups * n_types)
+            return [{None: all_types[i], **{table.test_types[j]: by_type[i * n_types + j] for j in np.flatnonzero(has_type[i])}} for i in range(n_groups)]
+
+        subject_has_type = np.array([table.run_has_type[table.subject_run_offsets[i]:table.subject_run_offsets[i + 1]].any(axis=0) for i in range(n_subjects)], dtype=bool).reshape(n_subjects, n_types)
+        runs = level(level_keys['run'], table.run_has_type)
+        subjects = level(level_keys['subject'], subject_has_type)
+        overall = level(level_keys['overall'], np.ones((1, n_types), dtype=bool))
+
+        self._run_statistics = dict()
+        for (subject, run), statistics in zip(table.runs, runs):
+            if subject not in self._run_statistics:
+                self._run_statistics[subject] = dict()
+            self._run_statistics[subject][run] = statistics
+        self._subject_statistics = dict(zip(table.subjects, subjects))
+        self._overall_statistics = overall[0]
+        self._overall_rt = None
+        self._statistics_key = key
+
+    def _levels_current(self) -> bool:
+        # Whether every incremental level is up to date, add_run and remove_run then update them in place
+        return all(self._level_keys.get(name) == self._dependency_key(level.dependencies) for name, level in vars(Features).items() if isinstance(level, _LazyLevel) and level.incremental)
+
+    def _mark_levels_current(self):
+        # The incremental levels and statistics were updated in place to match the new dataset, the others are now stale
+        self._dataset_version += 1
+        for name, level in vars(Features).items():
+            if isinstance(level, _LazyLevel) and level.incremental:
+                self._level_keys[name] = self._dependency_key(level.dependencies)
+        self._statistics_key = self._dependency_key(Features._settings)
+
+    def _refresh_levels(self):
+        # Features of the subjects whose runs changed, and overall, from their merged statistics (when a level is read)
+        subjects, self._stale_subjects = self._stale_subjects, dict()
+        overall, self._stale_overall = self._stale_overall, False
+        if self._statistics_key != self._dependency_key(Features._settings):
+            # The settings changed since, the levels are computed again from the dataset
+            return
+        for subject in subjects:
+            if subject in self._subject_statistics:
+                self._update_subject_features(subject)
+        if overall:
+            self._update_overall_features()
+
+    def _merge_statistics(self, target:dict, statistics:dict):
+        for t in statistics:
+            if t not in target:
+                target[t] = GroupStatistics()
+            target[t].merge(statistics[t])
+
+    def _subtract_statistics(self, target:dict, statistics:dict, parts:list[dict]):
+        # The min and max cannot be subtracted, they are taken again from the remaining parts when needed
+        for t in statistics:
+            target[t].subtract(statistics[t])
+            remaining = [part[t] for part in parts if t in part]
+            if len(remaining) == 0:
+                del target[t]
+            elif statistics[t].min <= target[t].min or statistics[t].max >= target[t].max:
+                target[t].min = min(part.min for part in remaining)
+                target[t].max = max(part.max for part in remaining)
+
+    def _statistics_hetero_homo_ratio(self, statistics:dict) -> float:
+        hetero = [statistics[t] for t in Features.hetero_types if t in statistics]
+        homo = [statistics[t] for t in Features.homo_types if t in statistics]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_hetero = np.float64(sum(s.sum for s in hetero)) / sum(s.count for s in hetero)
+            mean_homo = np.float64(sum(s.sum for s in homo)) / sum(s.count for s in homo)
+            return mean_hetero / mean_homo
+
+    def _statistics_feature_dict(self, statistics:GroupStatistics, rt_acc:np.ndarray = None) -> dict:
+        # Exact features of the raw RTs when they are kept (as the full computation), else from the statistics (estimated median)
+        if rt_acc is not None:
+            return self._feature_dict(_values_statistics(rt_acc), 0, rt_acc)
+        return statistics.features()
+
+    def _gather_rt(self, features:list[dict], statistics:list[GroupStatistics]) -> np.ndarray:
+        # RTs of several groups put end to end, without the placeholder of the empty ones
+        return _concatenate([f['rt_acc'] for f, s in zip(features, statistics) if s.count > 0])
+
+    def _update_run_features(self, subject:str, run:str, data:dict, accelerometer:bool):
+        # The raw RTs of the run are at hand, so its features and normality are exact
+        levels = self._levels
+        statistics = self._run_statistics[subject][run]
+        rt_acc, test_type = self._get_run_trials(data)
+
+        features = self._feature_dict(_values_statistics(rt_acc), 0, rt_acc)
+        if not self.keep_rt:
+            del features['rt_acc']
+        levels['single_run_features'].setdefault(subject, dict())[run] = features
+
+        features_by_type = dict()
+        for t in sorted(t for t in statistics if t is not None):
+            rt = rt_acc[test_type == t]
+            features_by_type[t] = self._feature_dict(_values_statistics(rt), 0, rt)
+        tested = list(features_by_type.values())
+        self._set_normality(tested)
+        if not self.keep_rt:
+            for features in tested:
+                del features['rt_acc']
+
+        if self.keep_rt and isinstance(self.dataset, TrialStore) and not self._streaming:
+            # Full RTs read by the store (the time vectors are not kept)
+            all_rt, all_test_types, _ = self._get_full_trials(accelerometer)
+            full = self.dataset.run_slice(subject, run)[1]
+            features_by_type['RT'], features_by_type['test_type'] = all_rt[full], all_test_types[full]
+        elif self.keep_rt:
+            features_by_type['RT'], features_by_type['test_type'] = self._get_run_full_trials(data, accelerometer)
+        levels['single_run_features_by_type'].setdefault(subject, dict())[run] = features_by_type
+        levels['run_hetero_homo_ratio'].setdefault(subject, dict())[run] = self._statistics_hetero_homo_ratio(statistics)
+
+    def _update_subject_features(self, subject:str):
+        # Features from the merged statistics, the raw RTs are only gathered from the runs of the subject
+        levels = self._levels
+        statistics = self._subject_statistics[subject]
+        runs = self._run_statistics[subject]
+        run_features = levels['single_run_features'][subject]
+        run_features_by_type = levels['single_run_features_by_type'][subject]
+
+        rt_acc = None
+        if self.keep_rt:
+            rt_acc = self._gather_rt([run_features[run] for run in runs], [runs[run][None] for run in runs])
+        levels['subject_features'][subject] = self._statistics_feature_dict(statistics[None], rt_acc)
+
+        features_by_type = dict()
+        if self.keep_rt:
+            features_by_type['RT'] = _concatenate([run_features_by_type[run]['RT'] for run in runs])
+            features_by_type['test_type'] = _concatenate([run_features_by_type[run]['test_type'] for run in runs])
+
+        tested = []
+        for t in sorted(t for t in statistics if t is not None):
+            if not self.keep_rt:
+                features = self._statistics_feature_dict(statistics[t])
+                features['normality'] = 'Not tested'
+                features_by_type[t] = features
+                continue
+
+            runs_with_type = [run for run in runs if t in runs[run]]
+            features = self._statistics_feature_dict(statistics[t], self._gather_rt([run_features_by_type[run][t] for run in runs_with_type], [runs[run][t] for run in runs_with_type]))
+            tested.append(features)
+            features_by_type[t] = features
+        self._set_normality(tested)
+
+        levels['subject_features_by_type'][subject] = features_by_type
+        levels['subject_hetero_homo_ratio'][subject] = self._statistics_hetero_homo_ratio(statistics)
+
+    def _run_rt(self, subject:str, run:str) -> dict:
+        # Kept RTs of each group of a run (None: all the test types) and its full trial list ('RT' and 'test_type'), from its features
+        statistics = self._run_statistics[subject][run]
+        features_by_type = self._levels['single_run_features_by_type'][subject][run]
+        features = {None: self._levels['single_run_features'][subject][run], **{t: features_by_type[t] for t in statistics if t is not None}}
+        rt = {t: features[t]['rt_acc'] if statistics[t].count > 0 else features[t]['rt_acc'][:0] for t in features}
+        rt['RT'], rt['test_type'] = features_by_type['RT'], features_by_type['test_type']
+        return rt
+
+    def _gather_overall_rt(self) -> dict:
+        # Kept RTs of the overall groups, the ones of every run put end to end
+        rt = dict()
+        for subject, runs in self._run_statistics.items():
+            for run in runs:
+                for key, values in self._run_rt(subject, run).items():
+                    rt.setdefault(key, []).append(values)
+        return {key: _concatenate(values) for key, values in rt.items()}
+
+    def _overall_rt_offsets(self, subject:str, run:str) -> dict:
+        # Position of a run (or of a new run of the subject) in the overall RTs of each group: the number of RTs of the runs before it
+        if subject not in self._run_statistics or (subject == next(reversed(self._run_statistics)) and run not in self._run_statistics[subject]):
+            # After all the runs
+            return {key: len(values) for key, values in self._overall_rt.items()}
+        offsets = dict()
+        for other_subject, runs in self._run_statistics.items():
+            for other_run in runs:
+                if (other_subject, other_run) == (subject, run):
+                    return offsets
+                for key, values in self._run_rt(other_subject, other_run).items():
+                    offsets[key] = offsets.get(key, 0) + len(values)
+            if other_subject == subject:
+                break
+        return offsets
+
+    def _splice_overall_rt(self, offsets:dict, previous:dict, current:dict):
+        # Replace the RTs of a run (previous, None for a new run) with its new ones (current, None when removed), the RTs after them are moved once
+        previous, current = previous or dict(), current or dict()
+        for key in previous.keys() | current.keys():
+            start = offsets.get(key, 0)
+            stop = start + len(previous.get(key, ()))
+            rt = self._overall_rt.get(key)
+            new = current.get(key)
+            rt = new[:0] if rt is None else rt
+            new = rt[:0] if new is None else new
+            self._overall_rt[key] = _concatenate([rt[:start], new, rt[stop:]])
+
+    def _update_overall_features(self):
+        # Features from the merged statistics, the raw RTs are gathered once and then spliced by add_run and remove_run
+        levels = self._levels
+        statistics = self._overall_statistics
+
+        rt = None
+        if self.keep_rt:
+            if self._overall_rt is None:
+                self._overall_rt = self._gather_overall_rt()
+            rt = self._overall_rt
+        empty = np.zeros(0)
+        levels['overall_features'] = self._statistics_feature_dict(statistics.get(None, GroupStatistics()), None if rt is None else rt.get(None, empty))
+
+        features_by_type = dict()
+        if self.keep_rt:
+            features_by_type['RT'] = rt.get('RT', empty)
+            features_by_type['test_type'] = rt.get('test_type', empty)
+
+        tested = []
+        for t in sorted(t for t in statistics if t is not None):
+            if not self.keep_rt:
+                features = self._statistics_feature_dict(statistics[t])
+                features['normality'] = 'Not tested'
+                features_by_type[t] = features
+                continue
+
+            features = self._statistics_feature_dict(statistics[t], rt.get(t, empty))
+            tested.append(features)
+            features_by_type[t] = features
+        self._set_normality(tested)
+
+        levels['overall_features_by_type'] = features_by_type
+        levels['overall_hetero_homo_ratio'] = self._statistics_hetero_homo_ratio(statistics)
+
+    def _table_position(self, subject:str, run:str) -> tuple[int, int]:
+        # Runs [start, stop) of the trial table replaced when setting or removing a run of the dataset
+        table = self._trial_table
+        if (subject, run) in table.runs:
+            start = table.runs.index((subject, run))
+            return start, start + 1
+        if subject in table.subjects:
+            end = int(table.subject_run_offsets[table.subjects.index(subject) + 1])
+            return end, end
+        return len(table.runs), len(table.runs)
+
+    def _splice_trials(self, start:int, stop:int, runs:list[tuple[str, str]], data:list[dict]):
+        # Splice the runs set or removed in the dataset into the trial table and full trials already built, instead of building them again
+        store = self.dataset if isinstance(self.dataset, TrialStore) else None
+        if not self._trial_table.splice(start, stop, runs, [d['rt_acc'] for d in data], [d['acc_test_type'] for d in data], [np.unique(d['test_type']) for d in data], store):
+            # The test types changed
+            self.invalidate()
+            return
+        if store is not None:
+            # Views of the store, taken again when needed
+            self._full_trials = dict()
+            return
+        for accelerometer, (all_rt, all_test_types, offsets) in list(self._full_trials.items()):
+            full = [self._get_run_full_trials(d, accelerometer) for d in data]
+            first, last = offsets[start], offsets[stop]
+            lengths = np.array([len(test_type) for _, test_type in full], dtype=np.int64)
+            self._full_trials[accelerometer] = (_concatenate([all_rt[:first]] + [rt for rt, _ in full] + [all_rt[last:]]),
+                                                _concatenate([all_test_types[:first]] + [test_type for _, test_type in full] + [all_test_types[last:]]),
+                                                np.concatenate((offsets[:start + 1], first + np.cumsum(lengths), offsets[stop + 1:] + lengths.sum() - (last - first))))
+
+    def _set_dataset_run(self, subject:str, run:str, data:dict) -> dict:
+        # Variables of the run as kept by the dataset (the dataset of streamed features is not kept)
+        if self._streaming:
+            return data
+        position = None if self._trial_table is None else self._table_position(subject, run)
+        if isinstance(self.dataset, TrialStore):
+            self.dataset.set_run(subject, run, data)
+            data = self.dataset.run(subject, run)
+        else:
+            self.dataset.setdefault(subject, dict())[run] = data
+        if position is not None:
+            self._splice_trials(*position, [(subject, run)], [data])
+        else:
+            self._full_trials = dict()
+        return data
+
+    def _remove_dataset_run(self, subject:str, run:str):
+        if self._streaming:
+            return
+        position = None if self._trial_table is None else self._table_position(subject, run)
+        if isinstance(self.dataset, TrialStore):
+            # The store drops the subject with its last run
+            self.dataset.remove_run(subject, run)
+        else:
+            del self.dataset[subject][run]
+            if len(self.dataset[subject]) == 0:
+                del self.dataset[subject]
+        if position is not None:
+            self._splice_trials(*position, [], [])
+        else:
+            self._full_trials = dict()
+
+    def _add_run(self, subject:str, run:str, data:dict, accelerometer:bool):
+        # Merge the statistics of the run and compute its features, the subject and overall features are left to the caller
+        splice = self.keep_rt and self._overall_rt is not None
+        offsets = self._overall_rt_offsets(subject, run) if splice else None
+        previous_rt = None
+        if subject in self._run_statistics and run in self._run_statistics[subject]:
+            # Replace the run, keeping its place
+            if splice:
+                previous_rt = self._run_rt(subject, run)
+            previous = self._run_statistics[subject][run]
+            self._subtract_statistics(self._subject_statistics[subject], previous, [self._run_statistics[subject][other] for other in self._run_statistics[subject] if other != run])
+            self._subtract_statistics(self._overall_statistics, previous, list(self._subject_statistics.values()))
+        elif subject not in self._run_statistics:
+            self._run_statistics[subject] = dict()
+            self._subject_statistics[subject] = dict()
+
+        # The trials as kept by the dataset (float32 in a store), as when computed from it
+        data = self._set_dataset_run(subject, run, data)
+        statistics = self._get_run_statistics(data)
+        self._run_statistics[subject][run] = statistics
+        self._merge_statistics(self._subject_statistics[subject], statistics)
+        self._merge_statistics(self._overall_statistics, statistics)
+
+        self._update_run_features(subject, run, data, accelerometer)
+        if splice:
+            self._splice_overall_rt(offsets, previous_rt, self._run_rt(subject, run))
+
+    def add_run(self, subject:str, run:str, data:dict, accelerometer:bool = None):
+        """
+        Add a run to the dataset (or replace it), only the features of the run,
+        its subject and overall are computed again. Without keep_rt, the subject
+        and overall medians are estimated within 0.1%.
+
+        The statistics and RTs of the run are merged into the ones of its
+        subject and overall, and the run is spliced into the trial table
+        (TrialTable.splice). What stays O(cohort): the copies of the trial
+        arrays (and of a TrialStore, unless the run goes after all the others)
+        and, with keep_rt, the exact overall medians and normality tests, that
+        read all the RTs of their group when the overall level is next read.
+
+        Parameters:
+            subject (str): Subject code.
+            run (str): Run.
+            data (dict): Variables of the run, as in the dataset.
+            accelerometer (bool): Source of the full RTs (default: self.accelerometer).
+        """
+        if accelerometer is not None:
+            self.accelerometer = accelerometer
+        if not self._streaming and not self._levels_current():
+            # Nothing to update in place but the trial table, the levels are computed again when read
+            self._set_dataset_run(subject, run, data)
+            self._dataset_version += 1
+            return
+
+        self._build_statistics()
+        self._add_run(subject, run, data, self.accelerometer)
+        self._stale_subjects[subject] = None
+        self._stale_overall = True
+        self._mark_levels_current()
+
+    def remove_run(self, subject:str, run:str):
+        """
+        Remove a run from the dataset and update the features of its subject
+        and overall, in place as add_run.
+
+        Parameters:
+            subject (str): Subject code.
+            run (str): Run.
+        """
+        if not self._streaming and not self._levels_current():
+            self._remove_dataset_run(subject, run)
+            self._dataset_version += 1
+            return
+
+        self._build_statistics()
+        if self.keep_rt and self._overall_rt is not None:
+            self._splice_overall_rt(self._overall_rt_offsets(subject, run), self._run_rt(subject, run), None)
+        self._remove_dataset_run(subject, run)
+        levels = self._levels
+        statistics = self._run_statistics[subject].pop(run)
+        self._subtract_statistics(self._subject_statistics[subject], statistics, list(self._run_statistics[subject].values()))
+        for results in [levels['single_run_features'], levels['single_run_features_by_type'], levels['run_hetero_homo_ratio']]:
+            del results[subject][run]
+
+        if len(self._run_statistics[subject]) == 0:
+            # Last run of the subject (whose features may not have been read yet)
+            for results in [self._run_statistics, self._subject_statistics, levels['single_run_features'], levels['single_run_features_by_type'], levels['run_hetero_homo_ratio'],
+                            levels['subject_features'], levels['subject_features_by_type'], levels['subject_hetero_homo_ratio']]:
+                results.pop(subject, None)
+            self._stale_subjects.pop(subject, None)
+        else:
+            self._stale_subjects[subject] = None
+        self._subtract_statistics(self._overall_statistics, statistics, list(self._subject_statistics.values()))
+
+        self._stale_overall = True
+        self._mark_levels_current()
+
+    @classmethod
+    def from_stream(cls, runs:Iterable[tuple[str, str, dict]], only_physiological:bool = False, accelerometer:bool = False, keep_rt:bool = False) -> 'Features':
+        """
+        Compute all the features of a stream of runs with bounded memory, each
+        run is dropped once merged. Without keep_rt, the subject and overall
+        medians are estimated within 0.1% and their normality is not tested.
+
+        Parameters:
+            runs (Iterable[tuple[str, str, dict]]): (subject, run, variables of the run).
+            only_physiological (bool): Only keep the RTs between the limits.
+            accelerometer (bool): Source of the full RTs.
+            keep_rt (bool): Keep the raw RTs in the results, for the plots and the normality tests.
+
+        Returns:
+            Features: Features of all the levels, the dataset is left empty.
+        """
+        features = cls(dict(), only_physiological, accelerometer)
+        features.keep_rt = keep_rt
+        features._streaming = True
+        features._statistics_key = features._dependency_key(Features._settings)
+
+        # Start from empty levels, filled run by run
+        features.single_run_features = dict()
+        features.single_run_features_by_type = dict()
+        features.run_hetero_homo_ratio = dict()
+        features.subject_features = dict()
+        features.subject_features_by_type = dict()
+        features.subject_hetero_homo_ratio = dict()
+
+        for subject, run, data in runs:
+            features._add_run(subject, run, data, accelerometer)
+
+        # The subject and overall features only depend on the merged statistics, compute them once
+        for subject in features._subject_statistics:
+            features._update_subject_features(subject)
+        features._update_overall_features()
+        features._mark_levels_current()
+
+        return features
+
     def save_single_run_features(self, folder:str = './Export/'):
         # Save single run features
         path = folder + 'single_run_features.csv'
@@ -478,6 +1573,10 @@ class Features():
             writer.writerow(['Heterotopic over homotopic ratio'])
             writer.writerow([self.overall_hetero_homo_ratio])
 
+    def save_sequential_effects(self, folder:str = './Export/', format:str = 'csv'):
+        # Save the RT features of each transition, one table per file for the runs, the subjects and overall (as save_all)
+        _save_tables(self._sequential_effects_tables(), folder, format)
+
     def save_all_to_csv(self, folder:str = './Export/'):
         self.save_single_run_features(folder)
         self.save_single_run_features_by_type(folder)
@@ -485,109 +1584,355 @@ class Features():
         self.save_subject_features_by_type(folder)
         self.save_overall_features(folder)
         self.save_overall_features_by_type(folder)
+        self.save_sequential_effects(folder)
+
+    def get_tables(self, trials:bool = False) -> dict[str, 'pd.DataFrame']:
+        """
+        Features of each level as typed tables, the ratios in their own tables.
+
+        Parameters:
+            trials (bool): Also get the full RT (s) and test type of every trial of every run.
+
+        Returns:
+            dict[str, pd.DataFrame]: Table name > table.
+        """
+        statistics = ['mean', 'median', 'std', 'min', 'max']
+        statistics_types = {feature: np.float64 for feature in statistics}
+        tables = dict()
+
+        import pandas as pd
+
+        tables['single_run_features'] = _table(
+            [[subject, run] + [features[f] for f in statistics] for subject in self.single_run_features for run, features in self.single_run_features[subject].items()],
+            ['subject', 'run'] + statistics, {'subject': 'string', 'run': 'string', **statistics_types})
+        tables['single_run_features_by_type'] = _table(
+            [[subject, run, test_type] + [features[f] for f in statistics] + [features['normality']] for subject in self.single_run_features_by_type for run in self.single_run_features_by_type[subject] for test_type, features in self.single_run_features_by_type[subject][run].items() if test_type != 'RT' and test_type != 'test_type'],
+            ['subject', 'run', 'test_type'] + statistics + ['normality'], {'subject': 'string', 'run': 'string', 'test_type': np.int64, **statistics_types, 'normality': 'category'})
+        if self.run_vibration_quality is not None:
+            # Quality of the vibration stimulus of each run, as more columns of its features
+            quality = self.run_vibration_quality
+            columns = ['peak_frequency', 'band_power', 'snr_db', 'off_band_fraction', 'low_snr_fraction', 'bad_stimulus']
+            tables['single_run_features'] = tables['single_run_features'].merge(pd.DataFrame({
+                'subject': pd.array(quality['subject'], dtype='string'), 'run': pd.array(quality['run'], dtype='string'),
+                **{column: quality[column] for column in columns}}), on=['subject', 'run'], how='left')
+        tables['run_hetero_homo_ratio'] = _table(
+            [[subject, run, ratio] for subject in self.run_hetero_homo_ratio for run, ratio in self.run_hetero_homo_ratio[subject].items()],
+            ['subject', 'run', 'hetero_homo_ratio'], {'subject': 'string', 'run': 'string', 'hetero_homo_ratio': np.float64})
+
+        tables['subject_features'] = _table(
+            [[subject] + [features[f] for f in statistics] for subject, features in self.subject_features.items()],
+            ['subject'] + statistics, {'subject': 'string', **statistics_types})
+        tables['subject_features_by_type'] = _table(
+            [[subject, test_type] + [features[f] for f in statistics] + [features['normality']] for subject in self.subject_features_by_type for test_type, features in self.subject_features_by_type[subject].items() if test_type != 'RT' and test_type != 'test_type'],
+            ['subject', 'test_type'] + statistics + ['normality'], {'subject': 'string', 'test_type': np.int64, **statistics_types, 'normality': 'category'})
+        tables['subject_hetero_homo_ratio'] = _table(
+            [[subject, ratio] for subject, ratio in self.subject_hetero_homo_ratio.items()],
+            ['subject', 'hetero_homo_ratio'], {'subject': 'string', 'hetero_homo_ratio': np.float64})
+
+        tables['overall_features'] = _table(
+            [[self.overall_features[f] for f in statistics]] if self.overall_features else [],
+            statistics, statistics_types)
+        tables['overall_features_by_type'] = _table(
+            [[test_type] + [features[f] for f in statistics] + [features['normality']] for test_type, features in self.overall_features_by_type.items() if test_type != 'RT' and test_type != 'test_type'],
+            ['test_type'] + statistics + ['normality'], {'test_type': np.int64, **statistics_types, 'normality': 'category'})
+        tables['overall_hetero_homo_ratio'] = _table(
+            [[self.overall_hetero_homo_ratio]], ['hetero_homo_ratio'], {'hetero_homo_ratio': np.float64})
+
+        if not self._streaming:
+            tables.update(self._sequential_effects_tables())
+
+        if trials:
+            runs = [(subject, run) for subject in self.single_run_features_by_type for run in self.single_run_features_by_type[subject]]
+            if any('RT' not in self.single_run_features_by_type[subject][run] for subject, run in runs):
+                raise ValueError('The trials are not kept, use keep_rt=True')
+
+            rt = [np.ravel(self.single_run_features_by_type[subject][run]['RT']) for subject, run in runs]
+            count = [len(r) for r in rt]
+            tables['trials'] = pd.DataFrame({
+                'subject': pd.array(np.repeat([subject for subject, _ in runs], count), dtype='string'),
+                'run': pd.array(np.repeat([run for _, run in runs], count), dtype='string'),
+                'trial': np.concatenate([np.arange(n) for n in count]).astype(np.int64) if runs else np.array([], dtype=np.int64),
+                'test_type': _concatenate([np.ravel(self.single_run_features_by_type[subject][run]['test_type']) for subject, run in runs]).astype(np.int64),
+                'rt_s': _concatenate(rt).astype(np.float64),
+            })
+
+        return tables
+
+    def _sequential_effects_tables(self) -> dict[str, 'pd.DataFrame']:
+        # Run, subject and overall tables of the sequential effects, repeat and switch rows have no previous and current type
+        statistics = ['mean', 'median', 'std', 'min', 'max']
+        columns = ['transition', 'previous_type', 'current_type', 'count'] + statistics
+        types = {'transition': 'category', 'previous_type': 'Int64', 'current_type': 'Int64', 'count': np.int64, **{feature: np.float64 for feature in statistics}}
+        return {
+            'run_sequential_effects': _table(
+                [[subject, run] + row for subject in self.run_sequential_effects for run, effects in self.run_sequential_effects[subject].items() for row in _sequence_rows(effects)],
+                ['subject', 'run'] + columns, {'subject': 'string', 'run': 'string', **types}),
+            'subject_sequential_effects': _table(
+                [[subject] + row for subject, effects in self.subject_sequential_effects.items() for row in _sequence_rows(effects)],
+                ['subject'] + columns, {'subject': 'string', **types}),
+            'overall_sequential_effects': _table(_sequence_rows(self.overall_sequential_effects), columns, types),
+        }
+
+    def save_all(self, folder:str = './Export/', format:str = 'parquet', trials:bool = False):
+        """
+        Save the features of each level, one typed table per file (see get_tables).
+
+        Parameters:
+            folder (str): Output folder.
+            format (str): 'parquet', 'arrow' (Arrow IPC / Feather) or 'csv'.
+            trials (bool): Also save the full RT (s) and test type of every trial.
+        """
+        _save_tables(self.get_tables(trials), folder, format)
+
+def _regressions(panels:list[np.ndarray]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Least squares line (as np.polyfit(x, rt, 1)) and mean of the RTs of every panel at once, NaN lines below 2 points
+    lengths = np.array([len(rt) for rt in panels], dtype=np.intp)
+    group = np.repeat(np.arange(len(panels)), lengths)
+    y = _concatenate(panels).astype(float)
+    # Position of each RT in its panel
+    x = np.arange(len(y)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    n = lengths.astype(float)
+    sum_x = np.bincount(group, weights=x, minlength=len(panels))
+    sum_y = np.bincount(group, weights=y, minlength=len(panels))
+    sum_xx = np.bincount(group, weights=x * x, minlength=len(panels))
+    sum_xy = np.bincount(group, weights=x * y, minlength=len(panels))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x**2)
+        intercept = (sum_y - slope * sum_x) / n
+        mean = sum_y / n
+    slope[lengths < 2] = np.nan
+    intercept[lengths < 2] = np.nan
+    return slope, intercept, mean
+
+def _decimate(x_axis:np.ndarray, rt_acc:np.ndarray, max_points:int) -> tuple[np.ndarray, np.ndarray]:
+    # Evenly spaced points of a panel with too many of them (the lines are from all of them)
+    if max_points is None or len(rt_acc) <= max_points:
+        return x_axis, rt_acc
+    kept = np.linspace(0, len(rt_acc) - 1, max_points).astype(np.intp)
+    return x_axis[kept], rt_acc[kept]
+
+def _draw_panels(axs:np.ndarray, panels:dict, max_points:int = None):
+    # RTs of each test type with their regression line and mean on 2 x 2 axes, at most max_points evenly spaced points per panel
+    for i, ax in enumerate(axs.flatten()):
+        test_type = i + 1
+        if test_type not in panels:
+            continue
+        rt_acc, slope, intercept, mean = panels[test_type]
+        x_axis, points = _decimate(np.arange(len(rt_acc)), rt_acc, max_points)
+
+        # Straight lines only need their ends
+        ends = np.array([0, max(len(rt_acc) - 1, 0)])
+        ax.scatter(x_axis, points, label='Data', marker = 's', s=10)
+        ax.plot(ends, slope * ends + intercept, color = 'red', linestyle = '--', label = 'Linear regression')
+        ax.plot(ends, np.full(2, mean), color = 'orange', linestyle = '--', label = 'Mean')
+
+        ax.set_title(f'Test Type {test_type}')
+        ax.set_xlabel('Data #')
+        ax.set_ylabel('RT (ms)')
+        ax.grid()
+        ax.legend()
+
+class _PanelFigure():
+    # Figure of the 4 test types drawn once, only the data and the limits change for each saved figure (no pyplot)
+
+    def __init__(self):
+        from matplotlib.figure import Figure
+        self.figure = Figure(figsize=figure_size)
+        self.axs = self.figure.subplots(2, 2).flatten()
+        self.figure.subplots_adjust(left=0.08, right=0.97, bottom=0.07, top=0.95, wspace=0.25, hspace=0.3)
+        self.artists = []
+        for i, ax in enumerate(self.axs):
+            points = ax.scatter([], [], label='Data', marker = 's', s=10)
+            regression, = ax.plot([], [], color = 'red', linestyle = '--', label = 'Linear regression')
+            mean, = ax.plot([], [], color = 'orange', linestyle = '--', label = 'Mean')
+            ax.set_title(f'Test Type {i + 1}')
+            ax.set_xlabel('Data #')
+            ax.set_ylabel('RT (ms)')
+            ax.grid()
+            ax.legend()
+            self.artists.append((points, regression, mean))
+
+    def update(self, panels:dict, max_points:int = None):
+        for i, (ax, (points, regression, mean_line)) in enumerate(zip(self.axs, self.artists)):
+            ax.set_visible(i + 1 in panels)
+            if i + 1 not in panels:
+                continue
+            rt_acc, slope, intercept, mean = panels[i + 1]
+            x_axis, y_axis = _decimate(np.arange(len(rt_acc)), rt_acc, max_points)
+            ends = np.array([0, max(len(rt_acc) - 1, 0)])
+            points.set_offsets(np.column_stack((x_axis, y_axis)))
+            regression.set_data(ends, slope * ends + intercept)
+            mean_line.set_data(ends, np.full(2, mean))
+
+            # Limits of the data with the default margins (autoscaling ignores the scatter data set afterwards)
+            y_values = np.concatenate((y_axis, slope * ends + intercept, [mean]))
+            y_values = y_values[np.isfinite(y_values)]
+            low, high = (y_values.min(), y_values.max()) if len(y_values) else (0, 1)
+            ax.set_xlim(-0.05 * max(ends[1], 1), ends[1] + 0.05 * max(ends[1], 1))
+            ax.set_ylim(low - 0.05 * max(high - low, 1), high + 0.05 * max(high - low, 1))
+
+def _render_figures(jobs:list[tuple[str, dict]], formats:tuple[str, ...], dpi:int, max_points:int) -> list[str]:
+    # Render figures with one reused figure (safe in workers, no pyplot)
+    figure = _PanelFigure()
+    paths = []
+    for path, panels in jobs:
+        figure.update(panels, max_points)
+        for format in formats:
+            figure.figure.savefig(f'{path}.{format}', format=format, dpi=dpi)
+            paths.append(f'{path}.{format}')
+    return paths
 
 class FeaturePlotter():
+    # Folder of the figures of each level in render_all
+    level_folders = {'run': 'single_run_features_by_type', 'subject': 'subject_features_by_type', 'overall': 'overall_features_by_type'}
+
     def __init__(self, features:Features):
         self.features = features
 
-    def plot_single_run_features_by_type(self):
-        features = self.features.single_run_features_by_type
-        
-        for subject in features:
-            for run in features[subject]:
-                print(f'Subject: {subject}, Run: {run}')
-                plt.figure()
+    def _get_panels(self, level:str) -> list[tuple[tuple[str, ...], dict]]:
+        # (subject, run), (subject,) or () > test type > (RTs, slope, intercept, mean) of every figure of a level
+        if self.features._streaming and not self.features.keep_rt:
+            # Streamed features only have the RTs of the panels with keep_rt
+            raise ValueError('The trials are not kept, use keep_rt=True')
+
+        if level == 'run':
+            features = self.features.single_run_features_by_type
+            figures = [((subject, run), features[subject][run]) for subject in features for run in features[subject]]
+        elif level == 'subject':
+            features = self.features.subject_features_by_type
+            figures = [((subject,), features[subject]) for subject in features]
+        elif level == 'overall':
+            figures = [((), self.features.overall_features_by_type)]
+        else:
+            raise ValueError(f"Unknown level '{level}', expected one of {list(self.level_folders)}")
 
-                fig, axs = plt.subplots(2, 2)
+        keys = [(i, test_type) for i, (_, figure) in enumerate(figures) for test_type in range(1, 5) if test_type in figure]
+        if self.features._streaming:
+            rts = [np.asarray(figures[i][1][test_type]['rt_acc'], dtype=float) for i, test_type in keys]
+        else:
+            # RTs of every panel split from the kept trials at once (an empty panel is one NaN, as in the features)
+            selection = self.features.query()
+            _, _, names = selection.group_by(*level_keys[level], 'test_type')
+            groups = dict(zip(names, selection.split(self.features.trials.rt_acc, *level_keys[level], 'test_type')))
+            rts = [np.asarray(groups[figures[i][0] + (test_type,)], dtype=float) for i, test_type in keys]
+            rts = [rt if len(rt) else np.array([np.nan]) for rt in rts]
+        slope, intercept, mean = _regressions(rts)
+
+        panels = [(name, dict()) for name, _ in figures]
+        for k, (i, test_type) in enumerate(keys):
+            panels[i][1][test_type] = (rts[k], slope[k], intercept[k], mean[k])
+        return panels
+
+    def _show(self, panels:dict):
+        import matplotlib.pyplot as plt
+        fig, axs = plt.subplots(2, 2, figsize=figure_size)
+        _draw_panels(axs, panels)
+        plt.tight_layout()
+        plt.show()
 
-                for i, ax in enumerate(axs.flatten()):
-                    test_type = i + 1
-                    if test_type not in features[subject][run]:
-                        continue
-                    rt_acc = features[subject][run][test_type]['rt_acc']
-                    x_axis = np.arange(len(rt_acc))
-
-                    # Perform linear regression
-                    slope, intercept = np.polyfit(x_axis, rt_acc, 1)
-                    regression_line = slope * x_axis + intercept
-
-                    ax.scatter(x_axis, rt_acc, label='Data', marker = 's', s=10)
-                    ax.plot(x_axis, regression_line, color = 'red', linestyle = '--', label = 'Linear regression')
-                    ax.plot(x_axis, np.ones_like(x_axis) * np.mean(rt_acc), color = 'orange', linestyle = '--', label = 'Mean')
-
-                    ax.set_title(f'Test Type {test_type}')
-                    ax.set_xlabel('Data #')
-                    ax.set_ylabel('RT (ms)')
-                    ax.grid()
-                    ax.legend()
-                
-                plt.tight_layout()
-                plt.show()
+    def plot_single_run_features_by_type(self):
+        for (subject, run), panels in self._get_panels('run'):
+            with stage('FeaturePlotter.plot_run', 'plots', subject=subject, run=run):
+                print(f'Subject: {subject}, Run: {run}')
+                self._show(panels)
 
     def plot_subject_features_by_type(self):
-        features = self.features.subject_features_by_type
-        
-        for subject in features:
-            print(f'Subject: {subject}')
-            plt.figure()
-
-            fig, axs = plt.subplots(2, 2)
-
-            for i, ax in enumerate(axs.flatten()):
-                test_type = i + 1
-                if test_type not in features[subject]:
-                    continue
-                rt_acc = features[subject][test_type]['rt_acc']
-                x_axis = np.arange(len(rt_acc))
-
-                # Perform linear regression
-                slope, intercept = np.polyfit(x_axis, rt_acc, 1)
-                regression_line = slope * x_axis + intercept
-
-                ax.scatter(x_axis, rt_acc, label='Data', marker = 's', s=10)
-                ax.plot(x_axis, regression_line, color = 'red', linestyle = '--', label = 'Linear regression')
-                ax.plot(x_axis, np.ones_like(x_axis) * np.mean(rt_acc), color = 'orange', linestyle = '--', label = 'Mean')
-
-                ax.set_title(f'Test Type {test_type}')
-                ax.set_xlabel('Data #')
-                ax.set_ylabel('RT (ms)')
-                ax.grid()
-                ax.legend()
-            
-            plt.tight_layout()
-            plt.show()
+        for (subject,), panels in self._get_panels('subject'):
+            with stage('FeaturePlotter.plot_subject', 'plots', subject=subject):
+                print(f'Subject: {subject}')
+                self._show(panels)
 
+    @profiled('plots')
     def plot_overall_features_by_type(self):
-        features = self.features.overall_features_by_type
-        
         print('Overall features by type')
-        plt.figure()
-
-        fig, axs = plt.subplots(2, 2)
-
-        for i, ax in enumerate(axs.flatten()):
-            test_type = i + 1
-            if test_type not in features:
-                continue
-            rt_acc = features[test_type]['rt_acc']
-            x_axis = np.arange(len(rt_acc))
-
-            # Perform linear regression
-            slope, intercept = np.polyfit(x_axis, rt_acc, 1)
-            regression_line = slope * x_axis + intercept
-
-            ax.scatter(x_axis, rt_acc, label='Data', marker = 's', s=10)
-            ax.plot(x_axis, regression_line, color = 'red', linestyle = '--', label = 'Linear regression')
-            ax.plot(x_axis, np.ones_like(x_axis) * np.mean(rt_acc), color = 'orange', linestyle = '--', label = 'Mean')
+        self._show(self._get_panels('overall')[0][1])
+
+    @profiled('plots')
+    def render_all(self, folder:str = './Images/Features/', formats:tuple[str, ...] = ('png',), levels:tuple[str, ...] = ('run', 'subject', 'overall'),
+                   workers:int = None, dpi:int = 100, max_points:int = 20000) -> list[str]:
+        """
+        Save the figures by type of every run, subject and overall in parallel, without showing them.
+
+        Parameters:
+            folder (str): Output folder, with one subfolder per level (level_folders).
+            formats (tuple[str, ...]): File formats, e.g. ('png', 'svg', 'pdf').
+            levels (tuple[str, ...]): Levels to render: 'run', 'subject' and/or 'overall'.
+            workers (int): Number of processes (1 renders in the current process, None uses all the CPUs).
+            dpi (int): Resolution of the raster formats.
+            max_points (int): Maximum number of points drawn per test type (e.g. in the overall figure).
+
+        Returns:
+            list[str]: Paths of the saved files.
+        """
+        jobs = []
+        for level in levels:
+            level_folder = os.path.join(folder, self.level_folders[level])
+            os.makedirs(level_folder, exist_ok=True)
+            for name, panels in self._get_panels(level):
+                # Named as the .mat files ('<subject>_Run<run>')
+                filename = f'{name[0]}_Run{name[1]}' if level == 'run' else name[0] if level == 'subject' else 'overall'
+                jobs.append((os.path.join(level_folder, filename), panels))
+        count(figures=len(jobs), files=len(jobs) * len(formats))
+
+        workers = workers or os.cpu_count()
+        if workers == 1 or len(jobs) < 2:
+            return _render_figures(jobs, formats, dpi, max_points)
+
+        # A few chunks per worker, each rendered with one figure
+        chunks = [list(chunk) for chunk in np.array_split(np.arange(len(jobs)), min(len(jobs), 4 * workers)) if len(chunk) > 0]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_render_figures, [[jobs[i] for i in chunk] for chunk in chunks], repeat(formats), repeat(dpi), repeat(max_points))
+            return [path for paths in results for path in paths]
+
+class TrialJoin():
+    """
+    Trials of the accelerometer and box features joined on (subject, run,
+    trial index) for every run they share, indexed by test type (TrialIndex).
+    """
 
-            ax.set_title(f'Test Type {test_type}')
-            ax.set_xlabel('Data #')
-            ax.set_ylabel('RT (ms)')
-            ax.grid()
-            ax.legend()
-        
-        plt.tight_layout()
-        plt.show()
+    def __init__(self, feature_acc:'Features', feature_box:'Features', test_types:list):
+        acc_runs, acc_rt, acc_test_type, acc_offsets = feature_acc._get_full_trial_runs()
+        box_runs, box_rt, box_test_type, box_offsets = feature_box._get_full_trial_runs()
+
+        # Hash join of the runs, in the order of the accelerometer runs
+        box_position = {key: i for i, key in enumerate(box_runs)}
+        acc_index = np.array([i for i, key in enumerate(acc_runs) if key in box_position], dtype=np.intp)
+        box_index = np.array([box_position[acc_runs[i]] for i in acc_index], dtype=np.intp)
+        self.runs:list[tuple[str, str]] = [acc_runs[i] for i in acc_index]
+
+        # Trials of a run are matched by index, up to the shorter of the two trial lists
+        lengths = np.minimum(acc_offsets[acc_index + 1] - acc_offsets[acc_index], box_offsets[box_index + 1] - box_offsets[box_index]) if len(acc_index) else np.zeros(0, dtype=np.int64)
+        self.run_offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        self.run_index = np.repeat(np.arange(len(self.runs)), lengths)
+        self.trial = np.arange(self.run_offsets[-1]) - self.run_offsets[self.run_index]
+        acc_rows = acc_offsets[acc_index][self.run_index] + self.trial if len(acc_index) else np.zeros(0, dtype=np.intp)
+        box_rows = box_offsets[box_index][self.run_index] + self.trial if len(box_index) else np.zeros(0, dtype=np.intp)
+
+        self.rt_acc = np.asarray(acc_rt, dtype=float)[acc_rows] # s, NaN if missing
+        self.rt_box = np.asarray(box_rt, dtype=float)[box_rows]
+        self.test_type = np.asarray(acc_test_type)[acc_rows] # Test types of the accelerometer, used to select the trials
+        self.box_test_type = np.asarray(box_test_type)[box_rows]
+        self.acc_missing = np.isnan(self.rt_acc)
+        self.box_missing = np.isnan(self.rt_box)
+        self.paired = ~self.acc_missing & ~self.box_missing
+
+        # Rows of each test type (in run and trial order), a slice for consecutive runs
+        self.test_types = list(test_types)
+        self.index = TrialIndex(self.runs, self.run_offsets, self.test_type, sorted(self.test_types))
+        self.subjects:list[str] = self.index.subjects
+        self.run_subject = self.index.run_subject
+        self.subject_run_offsets = self.index.subject_run_offsets
+
+    def rows(self, test_type, first_run:int, last_run:int) -> np.ndarray:
+        # Rows of a test type in the runs [first_run, last_run)
+        return self.index.segment(test_type, first_run, last_run)
+
+    def run_rows(self, i:int, test_type) -> np.ndarray:
+        return self.rows(test_type, i, i + 1)
+
+    def subject_rows(self, i:int, test_type) -> np.ndarray:
+        return self.rows(test_type, self.subject_run_offsets[i], self.subject_run_offsets[i + 1])
 
 class FeatureComparator():
     def __init__(self, feature_acc:Features, feature_box:Features, features_to_compare:list[str] = ['mean', 'median', 'std', 'min', 'max']):
@@ -597,11 +1942,16 @@ class FeatureComparator():
 
         self.test_types = [key for key in self.feature_box.overall_features_by_type if key != 'test_type' and key != 'RT']
 
-        # Get common subjects and runs between the two datasets
-        self.common_subjects = list(set(self.feature_acc.dataset.keys()) & set(self.feature_box.dataset.keys()))
+        # Get common subjects and runs between the two datasets (trial-aligned join of their trials)
+        self.join = TrialJoin(feature_acc, feature_box, self.test_types)
+        self.common_subjects = list(self.join.subjects)
         self.common_runs = dict()
-        for subject in self.common_subjects:
-            self.common_runs[subject] = list(set(self.feature_acc.dataset[subject].keys()) & set(self.feature_box.dataset[subject].keys()))
+        for subject, run in self.join.runs:
+            self.common_runs.setdefault(subject, []).append(run)
+
+        # Results of the last permutation tests (see permutation_results_dtype)
+        self.subject_permutation_results:np.ndarray = np.zeros(0, dtype=permutation_results_dtype)
+        self.run_permutation_results:np.ndarray = np.zeros(0, dtype=permutation_results_dtype)
 
     def compare_single_run_features_by_type(self):
         for subject in self.common_subjects:
@@ -646,130 +1996,145 @@ class FeatureComparator():
     def _compute_percentage_difference(self, value_1:float, value_2:float) -> float:
         return self._compute_difference(value_1=value_1, value_2=value_2) / value_2 * 100
     
-    def _calculate_correlation(self, data_1, data_2):
-        # Determine the maximum length
-        max_length = max(len(data_1), len(data_2))
-
-        # Pad both lines to the same length
-        data_1_padded = np.pad(data_1, (0, max_length - len(data_1)), constant_values=np.nan)
-        data_2_padded = np.pad(data_2, (0, max_length - len(data_2)), constant_values=np.nan)
-
-        # Fit polynomials to the padded data (ignoring NaN during fit) >> fit not working
-
-        valid_mask = ~np.isnan(data_1_padded) & ~np.isnan(data_2_padded)
-        correlation_original = np.corrcoef(data_1_padded[valid_mask], data_2_padded[valid_mask])[0, 1]
-
-        return correlation_original
-    
-    def _iterate_test_types(self, data_1, data_2, all_test_types):
-        # Substitute -1 with NaN
-        data_1 = [el if el != -1 else np.nan for el in data_1]
-        data_2 = [el if el != -1 else np.nan for el in data_2]
-
+    def _calculate_correlation(self, rows:np.ndarray) -> float:
+        # Pearson correlation of the paired accelerometer and box RTs of some joined trials
+        rows = rows[self.join.paired[rows]]
+        if len(rows) < 2:
+            return np.nan
+        return np.corrcoef(self.join.rt_acc[rows], self.join.rt_box[rows])[0, 1]
+
+    def _iterate_test_types(self, first_run:int, last_run:int):
         for test_type in self.test_types:
-            data_1_tt = [el for tt,el in zip(all_test_types, data_1) if tt == test_type and not np.isnan(el)]
-            data_2_tt = [el for tt,el in zip(all_test_types, data_2) if tt == test_type and not np.isnan(el)]
-
-            correlation = self._calculate_correlation(data_1_tt, data_2_tt)
+            correlation = self._calculate_correlation(self.join.rows(test_type, first_run, last_run))
             print(f'\tCorrelation for test type {test_type}: {correlation:.6g}')
 
+    def _groups(self, level:str) -> list[tuple[str, str, int, int]]:
+        # (subject, run, first run, last run) of each subject or run of the join
+        join = self.join
+        if level == 'subject':
+            return [(subject, '', join.subject_run_offsets[i], join.subject_run_offsets[i + 1]) for i, subject in enumerate(join.subjects)]
+        return [(subject, run, i, i + 1) for i, (subject, run) in enumerate(join.runs)]
+
+    @profiled('comparator')
     def calculate_correlation_per_subject(self)->None:
-        for subject in self.common_subjects:
+        for subject, _, first_run, last_run in self._groups('subject'):
             print(f"Subject {subject}")
+            self._iterate_test_types(first_run, last_run)
 
-            data_1 = self.feature_acc.subject_features_by_type[subject]['RT']
-            data_2 = self.feature_box.subject_features_by_type[subject]['RT']
-            all_test_types = self.feature_acc.subject_features_by_type[subject]['test_type']
-
-            self._iterate_test_types(data_1, data_2, all_test_types)
-
+    @profiled('comparator')
     def calculate_correlation_per_run(self)->None:
-        for subject in self.common_subjects:
-            print(f"Subject {subject}")
-            for run in self.common_runs[subject]:
-                print(f"\tRun {run}")
-
-                data_1 = self.feature_acc.single_run_features_by_type[subject][run]['RT']
-                data_2 = self.feature_box.single_run_features_by_type[subject][run]['RT']
-                all_test_types = self.feature_acc.subject_features_by_type[subject]['test_type']
-
-                self._iterate_test_types(data_1, data_2, all_test_types)
-
-    def _do_permutation_test(self, data_1, data_2, n_permutations, test_type, avg_r, avg_p):
-        def correlation_statistic(x, y):
-                    return np.corrcoef(x, y)[0, 1]
-        # Perform the permutation test
-        result = permutation_test(
-            (data_1, data_2),  # Paired data
-            correlation_statistic,               # Statistic function
-            n_resamples=n_permutations,          # Number of permutations
-            alternative='two-sided'              # Test for positive or negative correlation
-        )
-
-        # Extract observed correlation and p-value
-        observed_correlation = result.statistic
-        p_value = result.pvalue
-
-        avg_r.append(observed_correlation)
-        avg_p.append(p_value)
-
-        if p_value < 0.05:
-            print(f"\tTest type {test_type}: |r| = {observed_correlation:.3f} - n = {len(data_1)} - p = {p_value:.6f} > The trends are significantly correlated.")
-        else:
-            print(f"\tTest type {test_type}: |r| = {observed_correlation:.3f} - {len(data_1)} - p = {p_value:.6f} > The trends are not significantly correlated.")
-
-    def _iterate_test_type_permutation(self, rt_acc, rt_box, n_permutations, all_test_types, avg_r, avg_p):
+        # Each run is correlated with the test types of its own trials
+        previous = None
+        for subject, run, first_run, last_run in self._groups('run'):
+            if subject != previous:
+                previous = subject
+                print(f"Subject {subject}")
+            print(f"\tRun {run}")
+            self._iterate_test_types(first_run, last_run)
+
+    def _iterate_test_type_permutation(self, subject:str, run:str, first_run:int, last_run:int, pairs:list, rows:list):
+        # Collect the paired trials of each test type, the tests are run later in a single batch
+        join = self.join
         for test_type in self.test_types:
-                # Remove NaN values to handle missing data keeping it paired
-                filtered_data = [
-                    (acc, box, tt) 
-                    for (acc, box, tt) in zip(rt_acc, rt_box, all_test_types) 
-                    if not np.isnan(acc) and not np.isnan(box) and tt == test_type
-                ]
-                if not filtered_data:
-                    rt_acc_nones = [el for el, tt in zip(rt_acc, all_test_types) if np.isnan(el) and tt == test_type]
-                    rt_box_nones = [el for el, tt in zip(rt_box, all_test_types) if np.isnan(el) and tt == test_type]
-                    print(f"\tTest type {test_type}: No data for this test type. Not found: {len(rt_acc_nones)} acc - {len(rt_box_nones)} box")
-                    continue
-
-                filtered_rt_acc, filtered_rt_box, _ = zip(*filtered_data)
-
-                self._do_permutation_test(filtered_rt_acc, filtered_rt_box, n_permutations, test_type, avg_r, avg_p)
-
-    def subject_permuations(self, n_permutations):
-        avg_r = []
-        avg_p = []
-        for subject in self.common_subjects:
-            print(f"Subject {subject}")
-
-            rt_acc = self.feature_acc.subject_features_by_type[subject]['RT']
-            rt_box = self.feature_box.subject_features_by_type[subject]['RT']
-            test_types = self.feature_acc.subject_features_by_type[subject]['test_type']
-
-            # Substitute -1 with NaN
-            rt_acc = [el if el != -1 else np.nan for el in rt_acc]
-            rt_box = [el if el != -1 else np.nan for el in rt_box]
-            
-            self._iterate_test_type_permutation(rt_acc, rt_box, n_permutations, test_types, avg_r, avg_p)
-
-        return avg_r, avg_p
-
-    def run_permutations(self, n_permutations):
-        avg_r = []
-        avg_p = []
-        for subject in self.common_subjects:
-            print(f"Subject {subject}")
-            for run in self.common_runs[subject]:
+            is_type = join.rows(test_type, first_run, last_run)
+            paired = is_type[join.paired[is_type]]
+            if len(paired):
+                cell = len(pairs)
+                pairs.append((join.rt_acc[paired], join.rt_box[paired]))
+            else:
+                cell = -1
+            rows.append((subject, run, test_type, len(paired), np.count_nonzero(join.acc_missing[is_type]), np.count_nonzero(join.box_missing[is_type]), cell))
+
+    @profiled('comparator')
+    def calculate_paired_differences(self, level:str = 'run') -> np.ndarray:
+        """
+        Box RT - accelerometer RT of the joined trials found by both, for each
+        run (or subject) and test type.
+
+        Parameters:
+            level (str): 'run' or 'subject'.
+
+        Returns:
+            np.ndarray: One row per group and test type (paired_differences_dtype), in ms.
+        """
+        if level not in ('run', 'subject'):
+            raise ValueError(f"Unknown level '{level}', expected 'run' or 'subject'")
+        join = self.join
+        n_types = len(self.test_types)
+        groups = self._groups(level)
+        group = join.run_index if level == 'run' else join.run_subject[join.run_index]
+
+        # One segment reduction over every paired trial of a known test type
+        type_index = np.full(len(join.trial), n_types)
+        for j, test_type in enumerate(self.test_types):
+            type_index[join.index.segment(test_type)] = j
+        kept = join.paired & (type_index < n_types)
+        statistics = _group_statistics(group[kept] * n_types + type_index[kept], (join.rt_box - join.rt_acc)[kept] * 1000, len(groups) * n_types)
+
+        results = np.zeros(len(groups) * n_types, dtype=paired_differences_dtype)
+        results['subject'] = np.repeat([subject for subject, _, _, _ in groups], n_types)
+        results['run'] = np.repeat([run for _, run, _, _ in groups], n_types)
+        results['test_type'] = np.tile(self.test_types, len(groups))
+        results['n'] = statistics['count']
+        for feature in ['mean', 'median', 'std']:
+            results[feature] = statistics[feature]
+        return results
+
+    def _do_permutation_tests(self, pairs:list, rows:list, n_permutations:int, seed:int, workers:int) -> np.ndarray:
+        # Run all the permutation tests at once and gather the results in a table
+        r, p = permutation_correlation(pairs, n_permutations, seed, workers=workers)
+        if active() is not None:
+            # Tests and paired trials of each subject
+            count_subjects([row[0] for row in rows], tests=[int(row[6] >= 0) for row in rows], trials=[row[3] for row in rows])
+        r = np.append(r, np.nan)
+        p = np.append(p, np.nan)
+
+        results = np.zeros(len(rows), dtype=permutation_results_dtype)
+        for i, (subject, run, test_type, n, acc_missing, box_missing, cell) in enumerate(rows):
+            results[i] = (subject, run, test_type, n, acc_missing, box_missing, r[cell], p[cell])
+        return results
+
+    def print_permutation_results(self, results:np.ndarray):
+        subject = run = None
+        for row in results:
+            if row['subject'] != subject:
+                subject, run = row['subject'], None
+                print(f"Subject {subject}")
+            if row['run'] and row['run'] != run:
+                run = row['run']
                 print(f"\tRun {run}")
 
-                rt_acc = self.feature_acc.single_run_features_by_type[subject][run]['RT']
-                rt_box = self.feature_box.single_run_features_by_type[subject][run]['RT']
-                test_types = self.feature_acc.single_run_features_by_type[subject][run]['test_type']
-
-                # Substitute -1 with NaN
-                rt_acc = [el if el != -1 else np.nan for el in rt_acc]
-                rt_box = [el if el != -1 else np.nan for el in rt_box]
-                
-                self._iterate_test_type_permutation(rt_acc, rt_box, n_permutations, test_types, avg_r, avg_p)
-
-        return avg_r, avg_p
\ No newline at end of file
+            if row['n'] == 0:
+                print(f"\tTest type {row['test_type']}: No data for this test type. Not found: {row['acc_missing']} acc - {row['box_missing']} box")
+            elif row['p'] < 0.05:
+                print(f"\tTest type {row['test_type']}: |r| = {row['r']:.3f} - n = {row['n']} - p = {row['p']:.6f} > The trends are significantly correlated.")
+            else:
+                print(f"\tTest type {row['test_type']}: |r| = {row['r']:.3f} - {row['n']} - p = {row['p']:.6f} > The trends are not significantly correlated.")
+
+    @profiled('comparator')
+    def subject_permuations(self, n_permutations, seed:int = None, workers:int = 1, verbose:bool = True):
+        pairs = []
+        rows = []
+        for subject, run, first_run, last_run in self._groups('subject'):
+            self._iterate_test_type_permutation(subject, run, first_run, last_run, pairs, rows)
+
+        self.subject_permutation_results = self._do_permutation_tests(pairs, rows, n_permutations, seed, workers)
+        if verbose:
+            self.print_permutation_results(self.subject_permutation_results)
+
+        tested = self.subject_permutation_results[self.subject_permutation_results['n'] > 0]
+        return list(tested['r']), list(tested['p'])
+
+    @profiled('comparator')
+    def run_permutations(self, n_permutations, seed:int = None, workers:int = 1, verbose:bool = True):
+        pairs = []
+        rows = []
+        for subject, run, first_run, last_run in self._groups('run'):
+            self._iterate_test_type_permutation(subject, run, first_run, last_run, pairs, rows)
+
+        self.run_permutation_results = self._do_permutation_tests(pairs, rows, n_permutations, seed, workers)
+        if verbose:
+            self.print_permutation_results(self.run_permutation_results)
+
+        tested = self.run_permutation_results[self.run_permutation_results['n'] > 0]
+        return list(tested['r']), list(tested['p'])
@@ -0,0 +1,191 @@
+import numpy as np
+from collections.abc import Iterator
+from scipy.io import loadmat
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import glob
+import os
+import re
+
+from Functions.Profiling import count, profiled, stage
+from Functions.TrialStore import TrialStore
+
+
+# Variables read from the .mat files, the rest of the MATLAB workspace is never loaded
+variables:dict[str, list[str]] = {
+    'acc': ['rt_acc', 'acc_test_type', 'test_type', 'vb_index', 'mv_index', 't', 'correct_nbr', 'incorrect_nbr'],
+    'box': ['presstime', 'triallist'],
+}
+
+box_null_value = 99 # Value used in the box data to indicate no response
+
+def _parse_filename(file:str) -> tuple[str, str]:
+    """
+    Get the subject code and the run from a file name such as 'X03004_Run1.mat'.
+
+    Parameters:
+        file (str): Name of the .mat file.
+
+    Returns:
+        tuple[str, str]: Subject code and run.
+    """
+    filename = os.path.splitext(os.path.basename(file))[0]
+    code, run = re.split(r'_run', filename, flags=re.IGNORECASE)[:2]
+    return code, run
+
+def _cache_path(path:str, kind:str, cache_dir:str) -> str:
+    # The cache entry is keyed by the modification time and the size of the file
+    stat = os.stat(path)
+    filename = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cache_dir, f'{filename}.{kind}.{stat.st_mtime_ns}.{stat.st_size}.npz')
+
+def _read_cache(path:str, kind:str, cache_dir:str) -> dict[str, np.ndarray]:
+    cache_path = _cache_path(path, kind, cache_dir)
+    if not os.path.exists(cache_path):
+        return None
+
+    with np.load(cache_path) as cached:
+        return {key: cached[key] for key in cached.files}
+
+def _write_cache(path:str, kind:str, cache_dir:str, data:dict[str, np.ndarray]):
+    cache_path = _cache_path(path, kind, cache_dir)
+
+    # Remove the entries of older versions of the same file
+    filename = os.path.splitext(os.path.basename(path))[0]
+    for old_path in glob.glob(os.path.join(glob.escape(cache_dir), f'{glob.escape(filename)}.{kind}.*.npz')):
+        os.remove(old_path)
+
+    # Write to a temporary file first so that an interrupted run never leaves a broken entry
+    temporary_path = cache_path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        np.savez(file, **data)
+    os.replace(temporary_path, cache_path)
+
+@profiled('load')
+def _load_file(path:str, kind:str, cache_dir:str = None) -> dict[str, np.ndarray]:
+    # Only parse the variables that are used by the analysis
+    count(files=1, file=os.path.basename(path), subject=_parse_filename(path)[0])
+    data = loadmat(path, variable_names=variables[kind])
+    data = {key: data[key] for key in variables[kind] if key in data}
+
+    if cache_dir is not None:
+        _write_cache(path, kind, cache_dir, data)
+
+    return data
+
+def _prepare_acc(data:dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    # Trials with a wrong test type guess (0) are treated as not found (-1)
+    data['test_type'] = np.where(data['test_type'] == 0, -1, data['test_type'])
+    return data
+
+def _prepare_box(data:dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    # Remove the trials without a response from the RTs
+    answered = data['presstime'] != box_null_value
+    data['test_type'] = data['triallist']
+    data['acc_test_type'] = data['triallist'][answered]
+    data['rt_acc'] = data['presstime'][answered] * 1000
+    data['all_rt_box'] = np.where(answered, data['presstime'], np.nan).flatten()
+    return data
+
+def _list_files(directory:str) -> list[str]:
+    return [os.path.join(directory, file) for file in sorted(os.listdir(directory)) if file.endswith('.mat')]
+
+def _get_cache_dir(directory:str, cache_dir:str, use_cache:bool) -> str:
+    if not use_cache:
+        return None
+    if cache_dir is None:
+        cache_dir = os.path.join(directory, '.cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+@profiled('load')
+def load_dataset(directory:str, kind:str = 'acc', workers:int = None, cache_dir:str = None, use_cache:bool = True) -> dict[str, dict[str, dict]]:
+    """
+    Load all the .mat files of a directory into a dataset (subject > run > variables)
+    that can be given to Features.
+
+    Files are parsed in parallel and cached on disk, so that loading the same
+    directory again only parses the files that were added or modified.
+
+    Parameters:
+        directory (str): Directory containing files named '<subject>_Run<run>.mat'.
+        kind (str): 'acc' for the accelerometer results, 'box' for the response box data.
+        workers (int): Number of processes used to parse the files (default: number of CPUs).
+        cache_dir (str): Cache directory (default: '<directory>/.cache').
+        use_cache (bool): Read and write the cache.
+
+    Returns:
+        dict[str, dict[str, dict]]: Subject > run > variable > value.
+    """
+    if kind not in variables:
+        raise ValueError(f"Unknown kind '{kind}', expected one of {list(variables)}")
+
+    paths = _list_files(directory)
+    cache_dir = _get_cache_dir(directory, cache_dir, use_cache)
+
+    # Get the up to date files from the cache and parse the others
+    loaded:dict[str, dict[str, np.ndarray]] = dict()
+    if cache_dir is not None:
+        for path in paths:
+            data = _read_cache(path, kind, cache_dir)
+            if data is not None:
+                loaded[path] = data
+    to_parse = [path for path in paths if path not in loaded]
+    count(files=len(paths), cached=len(loaded))
+
+    if len(to_parse) > 1 and workers != 1:
+        # The files parsed by the workers are only seen as this stage
+        with stage('load_dataset.parallel_loadmat', 'load', files=len(to_parse)), ProcessPoolExecutor(max_workers=workers) as executor:
+            loaded.update(zip(to_parse, executor.map(_load_file, to_parse, repeat(kind), repeat(cache_dir))))
+    else:
+        loaded.update((path, _load_file(path, kind, cache_dir)) for path in to_parse)
+
+    prepare = _prepare_acc if kind == 'acc' else _prepare_box
+    dataset:dict[str, dict[str, dict]] = dict()
+    for path in paths:
+        code, run = _parse_filename(path)
+        if code not in dataset:
+            dataset[code] = dict()
+        dataset[code][run] = prepare(loaded[path])
+    count(subjects=len(dataset), runs=len(paths))
+
+    return dataset
+
+def load_store(directory:str, kind:str = 'acc', workers:int = None, cache_dir:str = None, use_cache:bool = True) -> TrialStore:
+    """
+    Load all the .mat files of a directory into a compact TrialStore (see
+    load_dataset for the parameters), that can be given to Features. The
+    variables of each file are dropped once its trials are stored.
+
+    Returns:
+        TrialStore: Trials of all the runs.
+    """
+    dataset = load_dataset(directory, kind, workers, cache_dir, use_cache)
+    runs = [(subject, run) for subject in dataset for run in dataset[subject]]
+    return TrialStore.from_runs((subject, run, dataset[subject].pop(run)) for subject, run in runs)
+
+def iterate_dataset(directory:str, kind:str = 'acc', cache_dir:str = None, use_cache:bool = True) -> Iterator[tuple[str, str, dict]]:
+    """
+    Read the .mat files of a directory one at a time, so that only one run is
+    in memory. Can be given to Features.from_stream.
+
+    Parameters:
+        directory (str): Directory containing files named '<subject>_Run<run>.mat'.
+        kind (str): 'acc' for the accelerometer results, 'box' for the response box data.
+        cache_dir (str): Cache directory (default: '<directory>/.cache').
+        use_cache (bool): Read and write the cache.
+
+    Returns:
+        Iterator[tuple[str, str, dict]]: (subject, run, variables) of each file.
+    """
+    if kind not in variables:
+        raise ValueError(f"Unknown kind '{kind}', expected one of {list(variables)}")
+
+    cache_dir = _get_cache_dir(directory, cache_dir, use_cache)
+    prepare = _prepare_acc if kind == 'acc' else _prepare_box
+    for path in _list_files(directory):
+        data = _read_cache(path, kind, cache_dir) if cache_dir is not None else None
+        if data is None:
+            data = _load_file(path, kind, cache_dir)
+        code, run = _parse_filename(path)
+        yield code, run, prepare(data)
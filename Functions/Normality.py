@@ -0,0 +1,148 @@
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
+
+from Functions.Profiling import count, profiled
+
+
+min_size = 3 # Smallest group the Shapiro-Wilk test accepts, smaller groups are 'Not enough data'
+# A test costs about 0.2 ms per group and 0.03 ms per thousand values, starting the workers (importing scipy.stats) about 2 s:
+# the groups only go to a pool above min_pool_work groups, counting group_work_values values as one more group
+min_pool_work = 10000
+group_work_values = 7000
+
+# One row per tested group, in the order of the groups
+normality_results_dtype = np.dtype([
+    ('n', np.int64), ('W', np.float64), ('p', np.float64), ('verdict', 'U16'),
+])
+
+def _digest(values:np.ndarray) -> bytes:
+    # Content hash of a group (the same RTs in the same order give the same hash)
+    return hashlib.blake2b(values.tobytes(), digest_size=16).digest()
+
+def _shapiro_chunk(groups:list[np.ndarray]) -> list[tuple[float, float]]:
+    # scipy.stats is slow to import, only load it when a group is actually tested
+    from scipy.stats import shapiro
+    return [tuple(float(value) for value in shapiro(values)) for values in groups]
+
+_executor:ProcessPoolExecutor = None # Pool of the tests, kept between the calls so that its workers only import scipy once
+_executor_workers:int = None
+
+def _get_executor(workers:int) -> ProcessPoolExecutor:
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != workers:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor, _executor_workers = ProcessPoolExecutor(max_workers=workers), workers
+    return _executor
+
+class NormalityCache():
+    """
+    Memo of the Shapiro-Wilk results (W, p) by content hash of the tested
+    values. The verdict is derived from p for each alpha, so changing alpha
+    does not test the groups again. The least recently used results are
+    dropped above max_size.
+    """
+
+    def __init__(self, max_size:int = 100000):
+        self.max_size = max_size
+        self._results:OrderedDict[bytes, tuple[float, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def get(self, digest:bytes) -> tuple[float, float]:
+        result = self._results.get(digest)
+        if result is not None:
+            self._results.move_to_end(digest)
+        return result
+
+    def put(self, digest:bytes, result:tuple[float, float]):
+        self._results[digest] = result
+        self._results.move_to_end(digest)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+    def clear(self):
+        self._results.clear()
+
+    def save(self, path:str):
+        # Keep the results between sessions, read back with load
+        digests = np.array(list(self._results), dtype='S16')
+        results = np.array(list(self._results.values()), dtype=np.float64).reshape(len(digests), 2)
+        np.savez(path, digests=digests, results=results)
+
+    def load(self, path:str):
+        if not os.path.exists(path):
+            return
+        with np.load(path) as stored:
+            for digest, result in zip(stored['digests'], stored['results']):
+                self.put(bytes(digest), (float(result[0]), float(result[1])))
+
+default_cache = NormalityCache() # Shared by all the Features, so re-running the pipeline only tests the new groups
+
+@profiled('normality')
+def shapiro_groups(groups:list[np.ndarray], alpha:float = 0.05, workers:int = 1, cache:NormalityCache = default_cache) -> np.ndarray:
+    """
+    Shapiro-Wilk test of many groups at once. Results are memoized by the
+    content of each group, only the groups never tested are computed, split
+    over a pool of processes when they are enough work (min_pool_work).
+
+    Parameters:
+        groups (list[np.ndarray]): Values of each group.
+        alpha (float): Significance level, a group is normal when p > alpha.
+        workers (int): Number of processes (1 runs in this process, None uses every CPU).
+        cache (NormalityCache): Memo of the results (None to test every group).
+
+    Returns:
+        np.ndarray: One row per group (normality_results_dtype): size, W, p and
+            verdict ('Yes', 'No' or 'Not enough data' below min_size values).
+    """
+    results = np.zeros(len(groups), dtype=normality_results_dtype)
+    results['W'] = np.nan
+    results['p'] = np.nan
+    results['verdict'] = 'Not enough data'
+
+    # Find the groups that were never tested, each distinct content once
+    pending:dict[bytes, list[int]] = dict()
+    values:dict[bytes, np.ndarray] = dict()
+    for i, group in enumerate(groups):
+        group = np.ascontiguousarray(group, dtype=np.float64).ravel()
+        results['n'][i] = len(group)
+        if len(group) < min_size:
+            continue
+        digest = _digest(group)
+        result = cache.get(digest) if cache is not None else None
+        if result is not None:
+            results['W'][i], results['p'][i] = result
+        else:
+            pending.setdefault(digest, []).append(i)
+            values[digest] = group
+    n_values = int(sum(len(group) for group in values.values()))
+    count(groups=len(groups), tested=len(pending), values=n_values)
+
+    digests = list(pending)
+    to_test = [values[digest] for digest in digests]
+    if workers != 1 and len(to_test) > 1 and len(to_test) + n_values / group_work_values >= min_pool_work:
+        n_workers = workers if workers is not None else os.cpu_count()
+        n_chunks = min(len(to_test), 4 * n_workers)
+        chunks = [to_test[start::n_chunks] for start in range(n_chunks)]
+        tested = list(_get_executor(workers).map(_shapiro_chunk, chunks))
+        # Undo the round-robin split
+        computed = [None] * len(to_test)
+        for start, chunk in enumerate(tested):
+            computed[start::n_chunks] = chunk
+    else:
+        computed = _shapiro_chunk(to_test)
+
+    for digest, result in zip(digests, computed):
+        if cache is not None:
+            cache.put(digest, result)
+        for i in pending[digest]:
+            results['W'][i], results['p'][i] = result
+
+    tested = results['n'] >= min_size
+    results['verdict'][tested] = np.where(results['p'][tested] > alpha, 'Yes', 'No')
+    return results
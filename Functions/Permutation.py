@@ -0,0 +1,186 @@
+import numpy as np
+from itertools import combinations, permutations
+from math import comb, factorial
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from Functions.Profiling import count, profiled
+
+
+def _pearson(x:np.ndarray, y:np.ndarray) -> np.ndarray:
+    """
+    Pearson correlation along the last axis of two halves of a pooled sample
+    that has been centred and normalized (sum 0, sum of squares 1).
+
+    Parameters:
+        x (np.ndarray): First half of the pooled sample (..., n).
+        y (np.ndarray): Second half of the pooled sample (..., n).
+
+    Returns:
+        np.ndarray: Correlation coefficient of each pair of rows.
+    """
+    n = x.shape[-1]
+    sum_x = x.sum(axis=-1)
+    sum_xx = np.einsum('...i,...i->...', x, x)
+    sum_xy = np.einsum('...i,...i->...', x, y)
+
+    # The pooled sample has sum 0 and sum of squares 1, so sum(y) = -sum(x) and sum(y^2) = 1 - sum(x^2)
+    centred_x = sum_x**2 / n
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sum_xy + centred_x) / np.sqrt((sum_xx - centred_x) * (1 - sum_xx - centred_x))
+
+def _permutation_blocks(width:int, n_permutations:int, block_size:int, rngs:list[np.random.Generator]):
+    # Blocks of random permutations of the indices of a row (2n pooled values or n paired values), drawn from the generator of each cell (cells x block x width)
+    indices = np.tile(np.arange(width), (block_size, 1))
+    for start in range(0, n_permutations, block_size):
+        yield np.stack([rng.permuted(indices[:n_permutations - start], axis=1) for rng in rngs])
+
+def _partition_blocks(n:int, n_cells:int, block_size:int):
+    # Blocks of all the distinct partitions of the 2n pooled indices in two groups of n (exact test)
+    block = []
+    for first in combinations(range(2 * n), n):
+        block.append(list(first) + sorted(set(range(2 * n)) - set(first)))
+        if len(block) == block_size:
+            yield np.broadcast_to(np.array(block), (n_cells, len(block), 2 * n))
+            block = []
+    if block:
+        yield np.broadcast_to(np.array(block), (n_cells, len(block), 2 * n))
+
+def _pairing_blocks(n:int, n_cells:int, block_size:int):
+    # Blocks of all the n! orders of the second sample (exact test of the pairings)
+    block = []
+    for order in permutations(range(n)):
+        block.append(order)
+        if len(block) == block_size:
+            yield np.broadcast_to(np.array(block), (n_cells, len(block), n))
+            block = []
+    if block:
+        yield np.broadcast_to(np.array(block), (n_cells, len(block), n))
+
+def _normalize(samples:np.ndarray) -> np.ndarray:
+    # Centre the rows and scale them to a sum of squares of 1
+    samples = samples - samples.mean(axis=1, keepdims=True)
+    norm = np.sqrt(np.einsum('ij,ij->i', samples, samples))
+    return samples / np.where(norm > 0, norm, 1)[:, None]
+
+def _permutation_correlation_cells(pairs:list[tuple[np.ndarray, np.ndarray]], seeds:list[np.random.SeedSequence], n_permutations:int, max_memory:int, permutation_type:str = 'independent') -> tuple[np.ndarray, np.ndarray]:
+    # Permutation tests of a group of cells, each cell draws from its own seed
+    r = np.full(len(pairs), np.nan)
+    p = np.full(len(pairs), np.nan)
+    sizes = np.array([len(x) for x, _ in pairs], dtype=np.intp)
+
+    for n in np.unique(sizes):
+        if n < 2:
+            continue
+
+        cells = np.flatnonzero(sizes == n)
+        if permutation_type == 'pairings':
+            # Centre and normalize both samples once, the correlation is then their dot product
+            x = _normalize(np.array([np.ravel(pairs[cell][0]) for cell in cells], dtype=float))
+            y = _normalize(np.array([np.ravel(pairs[cell][1]) for cell in cells], dtype=float))
+            observed = np.einsum('ij,ij->i', x, y)
+            # Permuting both samples (as SciPy does) only repeats each of the n! pairings n! times
+            n_distinct = factorial(n)
+            width = n
+        else:
+            # Centre and normalize the pooled samples once, the correlation does not depend on it
+            pooled = _normalize(np.array([np.concatenate((np.ravel(pairs[cell][0]), np.ravel(pairs[cell][1]))) for cell in cells], dtype=float))
+            observed = _pearson(pooled[:, :n], pooled[:, n:])
+            n_distinct = comb(2 * n, n)
+            width = 2 * n
+        # Tolerance for numerically distinct but theoretically equal values (as in SciPy)
+        gamma = np.abs(np.finfo(float).eps * 100 * observed)
+
+        exact = n_distinct <= n_permutations
+        n_resamples = n_distinct if exact else n_permutations
+        adjustment = 0 if exact else 1
+
+        # Bound the (cells x permutations x width) gathered array
+        cell_chunk = max(1, max_memory // (8 * width * 256))
+        for chunk in range(0, len(cells), cell_chunk):
+            chunk_cells = slice(chunk, chunk + cell_chunk)
+            n_chunk = len(cells[chunk_cells])
+            block_size = int(max(1, min(n_resamples, max_memory // (8 * width * n_chunk))))
+            if not exact:
+                blocks = _permutation_blocks(width, n_resamples, block_size, [np.random.default_rng(seeds[cell]) for cell in cells[chunk_cells]])
+            elif permutation_type == 'pairings':
+                blocks = _pairing_blocks(n, n_chunk, block_size)
+            else:
+                blocks = _partition_blocks(n, n_chunk, block_size)
+
+            less = np.zeros(n_chunk, dtype=np.int64)
+            greater = np.zeros(n_chunk, dtype=np.int64)
+            for indices in blocks:
+                if permutation_type == 'pairings':
+                    permuted = np.take_along_axis(y[chunk_cells][:, None, :], indices, axis=2) # (cells, permutations, n)
+                    null = np.einsum('ij,ikj->ik', x[chunk_cells], permuted)
+                else:
+                    permuted = np.take_along_axis(pooled[chunk_cells][:, None, :], indices, axis=2) # (cells, permutations, 2n)
+                    null = _pearson(permuted[..., :n], permuted[..., n:])
+                less += np.count_nonzero(null <= (observed[chunk_cells] + gamma[chunk_cells])[:, None], axis=1)
+                greater += np.count_nonzero(null >= (observed[chunk_cells] - gamma[chunk_cells])[:, None], axis=1)
+
+            p_less = (less + adjustment) / (n_resamples + adjustment)
+            p_greater = (greater + adjustment) / (n_resamples + adjustment)
+            p[cells[chunk_cells]] = np.clip(2 * np.minimum(p_less, p_greater), 0, 1)
+
+        r[cells] = observed
+
+    return r, p
+
+@profiled('permutations')
+def permutation_correlation(pairs:list[tuple[np.ndarray, np.ndarray]], n_permutations:int = 10000, seed:int = None, max_memory:int = 2**26, workers:int = 1, permutation_type:str = 'independent') -> tuple[np.ndarray, np.ndarray]:
+    """
+    Two-sided permutation test of the Pearson correlation of many paired samples at once.
+
+    The null distribution is the one of scipy.stats.permutation_test with the
+    default 'independent' permutation type: both samples are pooled and
+    randomly split in two groups again. When n_permutations is at least the
+    number of distinct splits, all of them are used (exact test), like SciPy.
+
+    With permutation_type='pairings' the null distribution is the one of the
+    'pairings' type instead: the samples are kept apart and only the pairing of
+    their values is permuted. The exact test enumerates the n! pairings, which
+    gives the same p-value as the (n!)^2 orders enumerated by SciPy.
+
+    Samples with the same length are processed together, and all the permuted
+    correlations of a block of permutations are computed as one batched
+    product. Blocks are sized so that no temporary array is larger than
+    max_memory bytes (per worker).
+
+    Every pair draws its permutations from its own seed, spawned from seed,
+    so the p-values do not depend on the number of workers or on the block sizes.
+
+    Parameters:
+        pairs (list[tuple[np.ndarray, np.ndarray]]): Paired samples (x, y) of equal length.
+        n_permutations (int): Number of random permutations.
+        seed (int): Seed of the random generator, for reproducible p-values.
+        max_memory (int): Approximate memory limit of the temporary arrays, in bytes.
+        workers (int): Number of processes (1 runs in the current process, None uses all the CPUs).
+        permutation_type (str): 'independent' (default, pooled samples) or 'pairings' (permuted pairs).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Observed correlation and p-value of each pair
+            (NaN for pairs with less than 2 values).
+    """
+    if permutation_type not in ('independent', 'pairings'):
+        raise ValueError(f"Unknown permutation type '{permutation_type}', expected 'independent' or 'pairings'")
+
+    count(tests=len(pairs), permutations=n_permutations, trials=sum(len(x) for x, _ in pairs))
+    seeds = np.random.SeedSequence(seed).spawn(len(pairs))
+    if workers == 1 or len(pairs) < 2:
+        return _permutation_correlation_cells(pairs, seeds, n_permutations, max_memory, permutation_type)
+
+    # Sort the cells by size, so that cells of the same size end up in the same task
+    order = np.argsort([len(x) for x, _ in pairs], kind='stable')
+    workers = workers or os.cpu_count()
+    tasks = [task for task in np.array_split(order, min(len(pairs), 4 * workers)) if len(task) > 0]
+
+    r = np.full(len(pairs), np.nan)
+    p = np.full(len(pairs), np.nan)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_permutation_correlation_cells, [pairs[i] for i in task], [seeds[i] for i in task], n_permutations, max_memory, permutation_type) for task in tasks]
+        for task, future in zip(tasks, futures):
+            r[task], p[task] = future.result()
+
+    return r, p
@@ -0,0 +1,274 @@
+import numpy as np
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections.abc import Callable
+
+
+_profiler:'Profiler' = None # Profiler recording the stages, None when profiling is off
+
+class _NullStage():
+    # Stage used when profiling is off: entering, leaving and counting do nothing
+    def __enter__(self) -> '_NullStage':
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def count(self, **counts):
+        pass
+
+    def count_subjects(self, subjects:list[str], **counts):
+        pass
+
+_null_stage = _NullStage()
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+
+class _Stage():
+    """
+    One timed stage of a Profiler. Counts (subjects, runs, trials, ...) can be
+    given when it starts or added with count while it runs, and the counts of
+    each subject of a stage that processes many subjects at once with count_subjects.
+    """
+
+    def __init__(self, profiler:'Profiler', name:str, category:str, counts:dict):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.counts = counts
+        self.subjects:dict[str, dict] = dict() # subject > counts
+        self.child_peak = 0 # Highest memory peak of the stages inside this one
+
+    def count(self, **counts):
+        for key, value in counts.items():
+            # Numbers add up (e.g. over the iterations of a loop), the other values replace the previous one
+            if _is_number(value):
+                self.counts[key] = self.counts.get(key, 0) + value
+            else:
+                self.counts[key] = value
+
+    def count_subjects(self, subjects:list[str], **counts):
+        # counts[key][i] of subjects[i], numbers that add up
+        for i, subject in enumerate(subjects):
+            subject_counts = self.subjects.setdefault(subject, dict())
+            for key, values in counts.items():
+                subject_counts[key] = subject_counts.get(key, 0) + values[i]
+
+    def __enter__(self) -> '_Stage':
+        self.profiler._stack.append(self)
+        if self.profiler.memory:
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, *_):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu_start
+        record = {
+            'name': self.name, 'category': self.category, 'depth': len(self.profiler._stack) - 1,
+            'start': self.start - self.profiler.start, 'wall': wall, 'cpu': cpu,
+            'pid': os.getpid(), 'tid': threading.get_ident(), 'counts': self.counts,
+        }
+        if self.subjects:
+            record['subjects'] = self.subjects
+        self.profiler._stack.pop()
+        if self.profiler.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # reset_peak in the inner stages hid their peaks from this one
+            peak = max(peak, self.child_peak)
+            record['allocated'] = peak - self.memory_start # Highest memory used on top of the start (bytes)
+            record['retained'] = current - self.memory_start # Memory still used at the end (bytes)
+            if self.profiler._stack:
+                parent = self.profiler._stack[-1]
+                parent.child_peak = max(parent.child_peak, peak)
+        self.profiler._record(record)
+        return False
+
+class Profiler():
+    """
+    Opt-in instrumentation of the analysis pipeline. While a profiler is
+    active (with profiler: ...), the instrumented stages (loading, feature
+    levels, normality tests, permutations, plots) record their wall time, CPU
+    time, item counts and, with memory, the memory they allocate
+    (tracemalloc, which slows the code down), overall and for each subject
+    (see subject_summary). When no profiler is active the stages are a shared no-op.
+
+    The stages of worker processes are not recorded, their work is part of the
+    stage that started the pool.
+
+    Parameters:
+        memory (bool): Measure the memory allocated by each stage.
+        callback (Callable[[dict], None]): Called with the record of each stage when it ends.
+    """
+
+    def __init__(self, memory:bool = False, callback:Callable[[dict], None] = None):
+        self.memory = memory
+        self.callback = callback
+        self.records:list[dict] = []
+        self.start = time.perf_counter()
+        self._stack:list[_Stage] = []
+        self._previous:'Profiler' = None
+        self._started_tracemalloc = False
+
+    def __enter__(self) -> 'Profiler':
+        global _profiler
+        self._previous, _profiler = _profiler, self
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        return self
+
+    def __exit__(self, *_):
+        global _profiler
+        _profiler = self._previous
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return False
+
+    def stage(self, name:str, category:str = '', **counts) -> _Stage:
+        return _Stage(self, name, category, counts)
+
+    def _record(self, record:dict):
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def summary(self) -> dict[str, dict]:
+        """
+        Totals of each stage name.
+
+        Returns:
+            dict[str, dict]: Name > 'calls', 'wall', 'cpu', 'allocated' (max, with memory)
+                and the sum of each numeric count.
+        """
+        summary = dict()
+        for record in self.records:
+            total = summary.setdefault(record['name'], {'category': record['category'], 'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+            total['calls'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            if 'allocated' in record:
+                total['allocated'] = max(total.get('allocated', 0), record['allocated'])
+            for key, value in record['counts'].items():
+                if _is_number(value):
+                    total[key] = total.get(key, 0) + value
+        return summary
+
+    def subject_summary(self) -> dict[str, dict[str, dict]]:
+        """
+        Totals of each stage name for each subject: the stages of one subject
+        (e.g. loading a file, plotting a run) with their time, and the counts of
+        the subject in the stages that process every subject at once (e.g. the
+        feature levels), whose time is shared and only in the summary.
+
+        Returns:
+            dict[str, dict[str, dict]]: Subject > name > 'calls', 'wall', 'cpu' (own stages),
+                'shared_calls' (stages of many subjects) and the sum of each numeric count.
+        """
+        summary = dict()
+        for record in self.records:
+            subject = record['counts'].get('subject')
+            if isinstance(subject, str):
+                total = summary.setdefault(subject, dict()).setdefault(record['name'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+                total['calls'] += 1
+                total['wall'] += record['wall']
+                total['cpu'] += record['cpu']
+                for key, value in record['counts'].items():
+                    if _is_number(value):
+                        total[key] = total.get(key, 0) + value
+            for subject, counts in record.get('subjects', dict()).items():
+                total = summary.setdefault(subject, dict()).setdefault(record['name'], {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+                total['shared_calls'] = total.get('shared_calls', 0) + 1
+                for key, value in counts.items():
+                    total[key] = total.get(key, 0) + value
+        return summary
+
+    def print_summary(self):
+        for name, total in sorted(self.summary().items(), key=lambda item: -item[1]['wall']):
+            memory = f", {total['allocated'] / 2**20:.1f} MiB" if 'allocated' in total else ''
+            print(f"{name}: {total['calls']} calls, {total['wall']:.4f} s wall, {total['cpu']:.4f} s CPU{memory}")
+
+    def save_json(self, path:str):
+        # All the stages and their totals
+        with open(path, 'w') as file:
+            json.dump({'stages': self.records, 'summary': self.summary(), 'subjects': self.subject_summary()}, file, indent=4, default=_to_json)
+
+    def save_chrome_trace(self, path:str):
+        # Trace Event Format, opened by chrome://tracing or Perfetto
+        events = []
+        for record in self.records:
+            args = dict(record['counts'], cpu_ms=record['cpu'] * 1000)
+            if 'subjects' in record:
+                args['subjects'] = record['subjects']
+            if 'allocated' in record:
+                args['allocated_bytes'] = record['allocated']
+                args['retained_bytes'] = record['retained']
+            events.append({'name': record['name'], 'cat': record['category'], 'ph': 'X', 'ts': record['start'] * 1e6,
+                           'dur': record['wall'] * 1e6, 'pid': record['pid'], 'tid': record['tid'], 'args': args})
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file, default=_to_json)
+
+def _to_json(value):
+    # NumPy scalars and arrays in the counts
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+def active() -> Profiler:
+    # Profiler recording the stages (None when profiling is off)
+    return _profiler
+
+def stage(name:str, category:str = '', **counts) -> _Stage | _NullStage:
+    """
+    Stage of the active profiler, or a shared no-op when profiling is off:
+
+        with stage('FeaturePlotter.plot_subject', 'plots', subject=subject):
+            ...
+    """
+    if _profiler is None:
+        return _null_stage
+    return _profiler.stage(name, category, **counts)
+
+def count(**counts):
+    # Add counts (subjects, runs, trials, ...) to the innermost stage running, nothing when profiling is off
+    if _profiler is not None and _profiler._stack:
+        _profiler._stack[-1].count(**counts)
+
+def count_subjects(subjects:list[str], **counts):
+    """
+    Add the counts of each subject to the innermost stage running, nothing when
+    profiling is off (check active() first if the counts are costly to get):
+
+        count_subjects(table.subjects, runs=runs_per_subject, trials=trials_per_subject)
+    """
+    if _profiler is not None and _profiler._stack:
+        _profiler._stack[-1].count_subjects(subjects, **counts)
+
+def profiled(category:str):
+    """
+    Decorator recording each call of a function as a stage named after it,
+    the function can add its counts with count. When profiling is off, the
+    only cost is one check per call.
+    """
+    def decorator(function:Callable) -> Callable:
+        name = function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _profiler.stage(name, category):
+                return function(*args, **kwargs)
+
+        return wrapper
+    return decorator
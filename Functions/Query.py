@@ -0,0 +1,318 @@
+import numpy as np
+from collections.abc import Iterable
+
+from Functions.Profiling import count, profiled
+
+
+def _ranges(start:np.ndarray, stop:np.ndarray) -> np.ndarray:
+    # Concatenation of np.arange(start[i], stop[i]) for every i, without a Python loop
+    lengths = np.maximum(np.asarray(stop) - np.asarray(start), 0)
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.intp)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(np.asarray(start) - offsets, lengths) + np.arange(total)
+
+def _bisect(values:np.ndarray, start:np.ndarray, stop:np.ndarray, bound:float, strict:bool) -> np.ndarray:
+    # First position of each sorted segment [start, stop) with a value above bound (strict) or not below it
+    low, high = np.array(start, dtype=np.intp), np.array(stop, dtype=np.intp)
+    last = max(len(values) - 1, 0)
+    while True:
+        active = low < high
+        if not active.any():
+            return low
+        middle = (low + high) // 2
+        value = values[np.minimum(middle, last)]
+        right = active & ((value <= bound) if strict else (value < bound))
+        low = np.where(right, middle + 1, low)
+        high = np.where(active & ~right, middle, high)
+
+class TrialIndex():
+    """
+    Indexes over a columnar table of trials (runs contiguous, and the runs of
+    each subject contiguous too), built once so that a query only reads the
+    trials it selects:
+
+    - run_offsets and subject_run_offsets: run i owns the trials
+      [run_offsets[i], run_offsets[i + 1]), subject s the runs
+      [subject_run_offsets[s], subject_run_offsets[s + 1]).
+    - positions: the trials ordered by test type, then run, then value (or
+      trial, without values). Each (test type, run) is a segment
+      positions[cell_offsets[c]:cell_offsets[c + 1]] with
+      c = type * n_runs + run, so the trials of a test type in consecutive
+      runs (e.g. a subject) are one slice, and a value window in a segment
+      is two binary searches in sorted_values.
+
+    The last type index (len(test_types)) holds the trials of no test type.
+    """
+
+    @profiled('query')
+    def __init__(self, runs:list[tuple[str, str]], run_offsets:np.ndarray, test_type:np.ndarray, test_types:Iterable, values:np.ndarray = None):
+        self.test_types = np.asarray(list(test_types))
+        self._set_runs(runs, run_offsets)
+
+        # One entry per trial
+        n_runs, n_types = len(self.runs), len(self.test_types)
+        self.run_index = np.repeat(np.arange(n_runs), np.diff(self.run_offsets))
+        test_type = np.asarray(test_type)
+        found = np.isin(test_type, self.test_types)
+        self.type_index = np.where(found, np.searchsorted(self.test_types, test_type), n_types) if n_types else np.zeros(len(test_type), dtype=np.intp)
+
+        self.values = values
+        cell = self.type_index * n_runs + self.run_index
+        if values is None:
+            self.positions = np.argsort(cell, kind='stable')
+            self.sorted_values = None
+        else:
+            # NaN values are sorted last in their segment, so no window contains them
+            self.positions = np.lexsort((values, cell))
+            self.sorted_values = np.asarray(values)[self.positions]
+        self.cell_offsets = np.concatenate(([0], np.cumsum(np.bincount(cell, minlength=(n_types + 1) * n_runs)))).astype(np.int64)
+        count(runs=n_runs, trials=len(cell))
+
+    def _set_runs(self, runs:list[tuple[str, str]], run_offsets:np.ndarray):
+        # Tables of the runs and subjects (one entry per run)
+        self.runs:list[tuple[str, str]] = list(runs)
+        self.run_offsets = np.asarray(run_offsets, dtype=np.int64)
+
+        self.subjects:list[str] = list(dict.fromkeys(subject for subject, _ in self.runs))
+        subject_index = {subject: i for i, subject in enumerate(self.subjects)}
+        self.run_subject = np.array([subject_index[subject] for subject, _ in self.runs], dtype=np.intp)
+        self.subject_run_offsets = np.concatenate(([0], np.cumsum(np.bincount(self.run_subject, minlength=len(self.subjects))))).astype(np.int64)
+
+    @profiled('query')
+    def splice(self, start:int, stop:int, runs:list[tuple[str, str]], run_lengths:list[int], test_type:np.ndarray, values:np.ndarray = None):
+        """
+        Replace the runs [start, stop) with new runs, without building the
+        index again: only the trials of the new runs are sorted, the segments
+        of the other runs are moved (one copy of the trial arrays). The test
+        types of the index do not change.
+
+        Parameters:
+            start (int): First replaced run.
+            stop (int): End of the replaced runs (start to insert runs).
+            runs (list[tuple[str, str]]): New runs (none to remove runs).
+            run_lengths (list[int]): Number of trials of each new run.
+            test_type (np.ndarray): Test type of every trial after the splice.
+            values (np.ndarray): Value of every trial after the splice (if the index has values).
+        """
+        n_runs, n_types = len(self.runs), len(self.test_types)
+        first, last = int(self.run_offsets[start]), int(self.run_offsets[stop])
+        run_lengths = np.asarray(run_lengths, dtype=np.int64)
+        n_new, n_added = int(run_lengths.sum()), len(runs)
+        shift = n_new - (last - first)
+        self._set_runs(self.runs[:start] + list(runs) + self.runs[stop:],
+                       np.concatenate((self.run_offsets[:start + 1], first + np.cumsum(run_lengths), self.run_offsets[stop + 1:] + shift)))
+
+        # Entries of the new trials
+        new_type = np.asarray(test_type[first:first + n_new])
+        found = np.isin(new_type, self.test_types)
+        new_type_index = np.where(found, np.searchsorted(self.test_types, new_type), n_types) if n_types else np.zeros(n_new, dtype=np.intp)
+        new_run_index = np.repeat(np.arange(n_added), run_lengths)
+        self.run_index = np.concatenate((self.run_index[:first], start + new_run_index, self.run_index[last:] + n_added - (stop - start)))
+        self.type_index = np.concatenate((self.type_index[:first], new_type_index, self.type_index[last:]))
+
+        # Segments of the new runs, sorted as in __init__, put between the (moved) segments of the other runs of each type
+        new_cell = new_type_index * n_added + new_run_index
+        if values is None:
+            new_positions = first + np.argsort(new_cell, kind='stable')
+        else:
+            new_positions = first + np.lexsort((values[first:first + n_new], new_cell))
+        new_offsets = np.concatenate(([0], np.cumsum(np.bincount(new_cell, minlength=(n_types + 1) * n_added)))).astype(np.int64)
+        positions, sorted_values = [], []
+        for j in range(n_types + 1):
+            before = slice(self.cell_offsets[j * n_runs], self.cell_offsets[j * n_runs + start])
+            after = slice(self.cell_offsets[j * n_runs + stop], self.cell_offsets[(j + 1) * n_runs])
+            new = new_positions[new_offsets[j * n_added]:new_offsets[(j + 1) * n_added]]
+            positions += [self.positions[before], new, self.positions[after] + shift]
+            if values is not None:
+                sorted_values += [self.sorted_values[before], values[new], self.sorted_values[after]]
+        cell_counts = np.diff(self.cell_offsets).reshape(n_types + 1, n_runs)
+        new_counts = np.diff(new_offsets).reshape(n_types + 1, n_added)
+        cell_counts = np.concatenate((cell_counts[:, :start], new_counts, cell_counts[:, stop:]), axis=1)
+
+        self.positions = np.concatenate(positions)
+        self.sorted_values = None if values is None else np.concatenate(sorted_values)
+        self.cell_offsets = np.concatenate(([0], np.cumsum(cell_counts))).astype(np.int64)
+        self.values = values
+        count(runs=n_added, trials=n_new)
+
+    def __len__(self) -> int:
+        return int(self.run_offsets[-1])
+
+    def run_ids(self, subjects:Iterable[str] = None, runs:Iterable[str] = None) -> np.ndarray:
+        """
+        Positions of the runs of some subjects (all by default) named as some
+        runs (all by default), from the offset tables only.
+        """
+        if subjects is None:
+            ids = np.arange(len(self.runs))
+        else:
+            subject_index = {subject: i for i, subject in enumerate(self.subjects)}
+            selected = [subject_index[subject] for subject in subjects if subject in subject_index]
+            ids = _ranges(self.subject_run_offsets[selected], self.subject_run_offsets[np.asarray(selected, dtype=np.intp) + 1]) if selected else np.zeros(0, dtype=np.intp)
+        if runs is not None:
+            names = {str(run) for run in runs}
+            ids = np.array([i for i in ids if self.runs[i][1] in names], dtype=np.intp)
+        return ids
+
+    def type_ids(self, test_types:Iterable = None) -> np.ndarray:
+        # Type indexes of some test types (all, and the trials of no test type, by default)
+        if test_types is None:
+            return np.arange(len(self.test_types) + 1)
+        test_types = np.asarray(list(test_types))
+        found = np.isin(test_types, self.test_types)
+        return np.searchsorted(self.test_types, test_types[found])
+
+    def segment(self, test_type, first_run:int = 0, last_run:int = None) -> np.ndarray:
+        # Trials of a test type in the runs [first_run, last_run), a view of positions
+        last_run = len(self.runs) if last_run is None else last_run
+        j = self.type_ids([test_type])
+        if len(j) == 0:
+            return self.positions[:0]
+        cell = int(j[0]) * len(self.runs)
+        return self.positions[self.cell_offsets[cell + first_run]:self.cell_offsets[cell + last_run]]
+
+    def query(self, subjects:Iterable[str] = None, runs:Iterable[str] = None, test_types:Iterable = None, lower:float = None, upper:float = None) -> 'TrialSelection':
+        """
+        Select the trials of some subjects, runs and test types with
+        lower < value < upper. Only the segments of the selected runs and test
+        types are read.
+
+        Parameters:
+            subjects (Iterable[str]): Subjects (all by default).
+            runs (Iterable[str]): Run names (all by default).
+            test_types (Iterable): Test types (all the trials by default).
+            lower (float): Lower limit of the values (none by default).
+            upper (float): Upper limit of the values (none by default).
+
+        Returns:
+            TrialSelection: Selected trials, in trial order.
+        """
+        run_ids = self.run_ids(subjects, runs)
+        type_ids = self.type_ids(test_types)
+        every_run = len(run_ids) == len(self.runs)
+        every_type = len(type_ids) == len(self.test_types) + 1
+        if (lower is not None or upper is not None) and self.sorted_values is None:
+            raise ValueError('The index has no values to select a window from')
+
+        # A block of whole runs is a slice of the table
+        if every_type and lower is None and upper is None and len(run_ids) and np.all(np.diff(run_ids) == 1):
+            return TrialSelection(self, slice(int(self.run_offsets[run_ids[0]]), int(self.run_offsets[run_ids[-1] + 1])))
+
+        # A window over every trial reads them all anyway, a mask is cheaper than the segments
+        if every_run and every_type:
+            with np.errstate(invalid='ignore'):
+                kept = np.ones(len(self), dtype=bool) if lower is None else self.values > lower
+                if upper is not None:
+                    kept &= self.values < upper
+            return TrialSelection(self, np.flatnonzero(kept))
+
+        cells = (type_ids[:, None] * len(self.runs) + run_ids[None, :]).ravel()
+        start, stop = self.cell_offsets[cells], self.cell_offsets[cells + 1]
+        if lower is not None:
+            start = _bisect(self.sorted_values, start, stop, lower, strict=True)
+        if upper is not None:
+            stop = np.maximum(_bisect(self.sorted_values, start, stop, upper, strict=False), start)
+        elif lower is not None:
+            # Stop before the NaN values at the end of the segments
+            stop = _bisect(self.sorted_values, start, stop, np.inf, strict=True)
+        return TrialSelection(self, np.sort(self.positions[_ranges(start, stop)]))
+
+class TrialSelection():
+    """
+    Trials selected from a TrialIndex, in trial order. The columns of the
+    table are read with take (a view when the selection is a block of runs),
+    and group_by gives the group index of each trial as used by the segment
+    reductions (e.g. _group_statistics).
+    """
+
+    def __init__(self, index:TrialIndex, positions:np.ndarray | slice):
+        self.index = index
+        self._positions = positions
+
+    def __len__(self) -> int:
+        if isinstance(self._positions, slice):
+            return self._positions.stop - self._positions.start
+        return len(self._positions)
+
+    @property
+    def positions(self) -> np.ndarray:
+        if isinstance(self._positions, slice):
+            return np.arange(self._positions.start, self._positions.stop)
+        return self._positions
+
+    def take(self, column:np.ndarray) -> np.ndarray:
+        # Values of a column of the table (one entry per trial) for the selected trials
+        return column[self._positions]
+
+    @property
+    def run_index(self) -> np.ndarray:
+        return self.take(self.index.run_index)
+
+    @property
+    def subject_index(self) -> np.ndarray:
+        return self.index.run_subject[self.run_index]
+
+    @property
+    def type_index(self) -> np.ndarray:
+        return self.take(self.index.type_index)
+
+    def select(self, **columns:np.ndarray) -> dict[str, np.ndarray]:
+        """
+        Columns of the selected trials, with their subject, run, position in
+        the run and test type.
+
+            selection.select(rt=table.rt_acc)
+
+        Returns:
+            dict[str, np.ndarray]: Column name > values.
+        """
+        index = self.index
+        run_index = self.run_index
+        n_types = len(index.test_types)
+        type_index = self.type_index
+        results = {
+            'subject': np.array(index.subjects, dtype=str)[index.run_subject[run_index]] if len(index.subjects) else np.zeros(0, dtype=str),
+            'run': np.array([run for _, run in index.runs], dtype=str)[run_index] if len(index.runs) else np.zeros(0, dtype=str),
+            'trial': self.positions - index.run_offsets[run_index],
+            'test_type': np.where(type_index < n_types, np.append(index.test_types, -1)[type_index], -1),
+        }
+        results.update({name: self.take(column) for name, column in columns.items()})
+        return results
+
+    def group_by(self, *keys:str) -> tuple[np.ndarray, int, list[tuple]]:
+        """
+        Group index of each selected trial by 'subject' or 'run', and/or by
+        'test_type' (one group without keys). Trials of no test type are in no
+        group (index n_groups) when grouping by test type.
+
+        Returns:
+            tuple[np.ndarray, int, list[tuple]]: Group of each trial, number of groups
+                and key of each group ((subject, run), (subject,) or (), then the test type).
+        """
+        unknown = set(keys) - {'subject', 'run', 'test_type'}
+        if unknown:
+            raise ValueError(f"Unknown keys {sorted(unknown)}, expected 'subject', 'run' and/or 'test_type'")
+        index = self.index
+        if 'run' in keys:
+            group, names = self.run_index, list(index.runs)
+        elif 'subject' in keys:
+            group, names = self.subject_index, [(subject,) for subject in index.subjects]
+        else:
+            group, names = np.zeros(len(self), dtype=np.intp), [()]
+
+        if 'test_type' in keys:
+            n_types = len(index.test_types)
+            type_index = self.type_index
+            n_groups = len(names) * n_types
+            group = np.where(type_index < n_types, group * n_types + type_index, n_groups)
+            names = [name + (test_type,) for name in names for test_type in index.test_types]
+        return group, len(names), names
+
+    def split(self, column:np.ndarray, *keys:str) -> list[np.ndarray]:
+        # Values of a column in each group of group_by (views over a single buffer, in trial order)
+        group, n_groups, _ = self.group_by(*keys)
+        order = np.argsort(group, kind='stable')
+        sizes = np.bincount(group, minlength=n_groups + 1)
+        return np.split(self.take(column)[order], np.cumsum(sizes)[:n_groups])[:n_groups]
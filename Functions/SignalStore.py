@@ -0,0 +1,212 @@
+import numpy as np
+from numpy.lib.format import open_memmap
+from scipy.io import loadmat, whosmat
+import glob
+import json
+import os
+import shutil
+
+from Functions.Detection import get_segmentation, sampling, trial_length
+
+
+chunk_samples = 2**18 # Samples copied at a time when writing a signal
+
+# Variables of the raw signal in the .mat files, by layout (see parameters.m)
+signal_variables:dict[str, list[str]] = {
+    'channels': ['channels', 'sampling'],
+    'data': ['data', 'sampling'],
+    'signal': ['signal', 't', 'segmentation_points', 'sampling'],
+}
+
+def _signal_layout(path:str) -> str:
+    # Layout of the raw signal of a .mat file from its variable names, without reading it (None without a signal)
+    names = {variable for variable, _, _ in whosmat(path)}
+    return next((layout for layout in signal_variables if layout in names), None)
+
+def _run_name(path:str) -> str:
+    # Name of the run of a file, without the suffix of the accelerometer files
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name[:-len('_acc')] if name.endswith('_acc') else name
+
+class StoredRun():
+    """
+    Raw signal of one run of a signal store. The signal (samples x channels)
+    is memory-mapped: trials, windows and channels are views of the file, and
+    only the pages that are actually read are loaded from the disk.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        with open(os.path.join(path, 'metadata.json')) as file:
+            self.metadata:dict = json.load(file)
+        self.signal:np.ndarray = np.load(os.path.join(path, 'signal.npy'), mmap_mode='r')
+        self.segmentation:np.ndarray = np.load(os.path.join(path, 'segmentation.npy'), mmap_mode='r') # First sample of each trial (0-based)
+        self.sampling:float = self.metadata['sampling']
+        self.channels:list[str] = self.metadata['channels']
+
+    def __len__(self) -> int:
+        return len(self.signal)
+
+    @property
+    def n_trials(self) -> int:
+        return len(self.segmentation)
+
+    def channel(self, channel:int | str) -> np.ndarray:
+        # All the samples of one channel (a strided view)
+        if isinstance(channel, str):
+            channel = self.channels.index(channel)
+        return self.signal[:, channel]
+
+    def window(self, start:int, stop:int, channels:slice = slice(None)) -> np.ndarray:
+        # Samples [start, stop) of the channels, as a view
+        return self.signal[start:stop, channels]
+
+    def trial(self, trial:int, channels:slice = slice(None)) -> np.ndarray:
+        # Samples of one trial, from its first sample to the first sample of the next one
+        stop = self.segmentation[trial + 1] if trial + 1 < self.n_trials else len(self)
+        return self.window(self.segmentation[trial], stop, channels)
+
+    def time(self, start:int = 0, stop:int = None) -> np.ndarray:
+        # Time (s) of the samples [start, stop), as get_time without building it for the whole run
+        stop = len(self) if stop is None else stop
+        return np.arange(start, stop) * (len(self) / self.sampling / max(len(self) - 1, 1))
+
+def write_run(directory:str, name:str, signal:np.ndarray | list[np.ndarray], sampling:float = sampling, segmentation:np.ndarray = None,
+              channels:list[str] = None, trial_length:float = trial_length, source:str = None) -> StoredRun:
+    """
+    Write the raw signal of a run to a signal store: '<directory>/<name>/'
+    holds signal.npy (samples x channels), segmentation.npy and metadata.json.
+
+    The signal is copied chunk by chunk, so a list of channels (e.g. the
+    cells of a .mat file) is never stacked in memory.
+
+    Parameters:
+        directory (str): Directory of the store.
+        name (str): Name of the run, e.g. 'X98504_Run2'.
+        signal (np.ndarray | list[np.ndarray]): Signal (samples x channels) or list of channels.
+        sampling (float): Sampling rate (Hz).
+        segmentation (np.ndarray): First sample of each trial (0-based), by default trials of trial_length seconds.
+        channels (list[str]): Name of each channel.
+        trial_length (float): Length of each trial (s).
+        source (str): File the signal comes from.
+
+    Returns:
+        StoredRun: The written run.
+    """
+    if isinstance(signal, np.ndarray):
+        signal = [signal[:, i] for i in range(signal.shape[1])]
+    n_samples = len(signal[0])
+    if channels is None:
+        channels = [f'Channel {i + 1}' for i in range(len(signal))]
+    if segmentation is None:
+        segmentation = get_segmentation(n_samples, sampling, trial_length)
+
+    # Write to a temporary directory first so that an interrupted conversion never leaves a broken run
+    path = os.path.join(directory, name)
+    temporary_path = path + '.tmp'
+    shutil.rmtree(temporary_path, ignore_errors=True)
+    os.makedirs(temporary_path)
+
+    stored = open_memmap(os.path.join(temporary_path, 'signal.npy'), mode='w+', dtype=np.result_type(*[channel.dtype for channel in signal]), shape=(n_samples, len(signal)))
+    for start in range(0, n_samples, chunk_samples):
+        for i, channel in enumerate(signal):
+            stored[start:start + chunk_samples, i] = channel[start:start + chunk_samples]
+    stored.flush()
+    del stored
+
+    np.save(os.path.join(temporary_path, 'segmentation.npy'), np.asarray(segmentation, dtype=np.int64).ravel())
+    with open(os.path.join(temporary_path, 'metadata.json'), 'w') as file:
+        json.dump({'sampling': sampling, 'channels': [str(channel) for channel in channels], 'n_samples': n_samples,
+                   'trial_length': trial_length, 'source': source}, file, indent=4)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temporary_path, path)
+    return StoredRun(path)
+
+def convert_mat(path:str, directory:str) -> StoredRun:
+    """
+    Convert the raw signal of a .mat file to a signal store. The layouts of
+    parameters.m are read: 'channels' (cells with 'data' and 'name') or 'data'
+    ('<filename>_acc.mat'), and 'signal' with 't' and 'segmentation_points'.
+
+    Parameters:
+        path (str): Path of the .mat file.
+        directory (str): Directory of the store.
+
+    Returns:
+        StoredRun: The converted run (None if the file has no raw signal, e.g. a box log).
+    """
+    layout = _signal_layout(path)
+    if layout is None:
+        return None
+
+    mat = loadmat(path, variable_names=signal_variables[layout], simplify_cells=True)
+    rate = float(mat.get('sampling', sampling))
+    segmentation = None
+    channels = None
+    if layout == 'channels':
+        signal = [np.asarray(channel['data'], dtype=float).ravel() for channel in mat['channels']]
+        channels = [str(channel['name']).strip() for channel in mat['channels']]
+    elif layout == 'data':
+        signal = np.asarray(mat['data'], dtype=float)
+    else:
+        signal = np.asarray(mat['signal'], dtype=float)
+        if 't' in mat and np.size(mat['t']) > 1:
+            t = np.ravel(mat['t'])
+            rate = float(round((len(t) - 1) / (t[-1] - t[0])))
+        if 'segmentation_points' in mat:
+            # As segmentation_points_index in doSegmentedDetection.m, from 0
+            segmentation = np.round(np.ravel(mat['segmentation_points']) * rate).astype(np.int64) - 1
+            segmentation[0] = 0
+
+    return write_run(directory, _run_name(path), signal, rate, segmentation, channels, source=os.path.abspath(path))
+
+def convert_directory(pattern:str = 'Data/Task*/*.mat', directory:str = 'Data/Signals') -> list[str]:
+    """
+    Convert all the .mat files matching a pattern to a signal store. Files
+    without a raw signal are skipped, and files already converted are only
+    converted again when they are newer than the store.
+
+    Parameters:
+        pattern (str): Glob pattern of the .mat files.
+        directory (str): Directory of the store.
+
+    Returns:
+        list[str]: Names of the runs in the store from the matching files.
+    """
+    names = []
+    for path in sorted(glob.glob(pattern)):
+        # The box file of a run has the same name as its accelerometer file, without a signal
+        if _signal_layout(path) is None:
+            continue
+        name = _run_name(path)
+        metadata = os.path.join(directory, name, 'metadata.json')
+        if not (os.path.exists(metadata) and os.path.getmtime(metadata) >= os.path.getmtime(path)):
+            convert_mat(path, directory)
+        if name not in names:
+            names.append(name)
+    return names
+
+class SignalStore():
+    """
+    Directory of raw signals, one memory-mapped run per subdirectory (see write_run).
+    """
+
+    def __init__(self, directory:str):
+        self.directory = directory
+
+    def names(self) -> list[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if os.path.exists(os.path.join(self.directory, name, 'metadata.json')))
+
+    def __contains__(self, name:str) -> bool:
+        return os.path.exists(os.path.join(self.directory, name, 'metadata.json'))
+
+    def __getitem__(self, name:str) -> StoredRun:
+        if name not in self:
+            raise KeyError(name)
+        return StoredRun(os.path.join(self.directory, name))
+
+    def write(self, name:str, signal:np.ndarray | list[np.ndarray], **kwargs) -> StoredRun:
+        return write_run(self.directory, name, signal, **kwargs)
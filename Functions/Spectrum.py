@@ -0,0 +1,162 @@
+import numpy as np
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from Functions.Detection import vibration_parameters
+from Functions.Profiling import count, profiled
+from Functions.SignalStore import StoredRun
+
+
+# Welch spectra of the trials, for the quality of the vibration stimulus (as plot_PS.m, for every run at once)
+welch_window_ms = 500 # Length of the Welch segments (ms), 2 Hz resolution
+chunk_trials = 64 # Trials of a run whose spectra are computed at a time
+vibration_band = (vibration_parameters['cutoff_low'], vibration_parameters['cutoff_high']) # Hz, band of the vibration stimulus
+noise_band = (50, 240) # Hz, the noise floor is the median power density in this band, out of the vibration band and its guard
+band_guard = 10 # Hz on both sides of the vibration band that are not part of the noise floor
+peak_range = (20, 400) # Hz, the peak frequency is searched above the movements (as the limits of plot_PS.m)
+peak_tolerance = 5 # Hz, trials peaking further from the vibration band are off band
+min_snr_db = 10 # Runs whose median trial SNR is lower are bad stimuli
+max_off_band_fraction = 0.2 # Runs with more trials off band are bad stimuli
+
+# One row per run, the features of each trial are from its stimulated channel (the one with the highest SNR)
+vibration_quality_dtype = np.dtype([
+    ('n_trials', np.int64), ('n_channels', np.int64),
+    ('peak_frequency', np.float64), ('band_power', np.float64), ('snr_db', np.float64),
+    ('off_band_fraction', np.float64), ('low_snr_fraction', np.float64), ('bad_stimulus', np.bool_),
+])
+
+def _window_length(run:StoredRun) -> int:
+    # Samples of the window of every trial: the shortest trial, so that a chunk of trials is one array
+    if run.n_trials == 0:
+        return 0
+    stops = np.append(run.segmentation[1:], len(run))
+    return max(int(np.min(stops - run.segmentation)), 0)
+
+def iterate_spectra(run:StoredRun, channels:slice = slice(None), window_ms:float = welch_window_ms) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Welch power spectral density of every trial and channel of a run,
+    chunk_trials trials at a time: each chunk is read from the memory-mapped
+    signal as one array and all its spectra are computed by a single call.
+
+    Parameters:
+        run (StoredRun): Run of a signal store.
+        channels (slice): Channels.
+        window_ms (float): Length of the Welch segments (ms), the trials when they are shorter.
+
+    Yields:
+        tuple[np.ndarray, np.ndarray]: Frequencies (Hz) and PSD (trials x frequencies x channels) of each chunk.
+    """
+    from scipy.signal import welch
+
+    length = _window_length(run)
+    if length < 2:
+        return
+    segment = min(int(round(window_ms * run.sampling / 1000)), length)
+    offsets = np.arange(length)
+    for start in range(0, run.n_trials, chunk_trials):
+        first = np.asarray(run.segmentation[start:start + chunk_trials], dtype=np.intp)
+        trials = np.asarray(run.signal[first[:, None] + offsets][..., channels], dtype=float)
+        yield welch(trials, fs=run.sampling, nperseg=segment, axis=1)
+
+def trial_spectra(run:StoredRun, channels:slice = slice(None), window_ms:float = welch_window_ms) -> tuple[np.ndarray, np.ndarray]:
+    # Welch PSD of all the trials of a run at once (trials x frequencies x channels), e.g. to plot them
+    chunks = list(iterate_spectra(run, channels, window_ms))
+    if not chunks:
+        return np.zeros(0), np.zeros((0, 0, 0))
+    return chunks[0][0], np.concatenate([psd for _, psd in chunks])
+
+def spectrum_features(frequencies:np.ndarray, psd:np.ndarray) -> dict[str, np.ndarray]:
+    """
+    Vibration features of many spectra at once: power in the vibration band,
+    its signal-to-noise ratio (mean density in the band over the median
+    density of the noise band) and the frequency of the highest peak in
+    peak_range.
+
+    Parameters:
+        frequencies (np.ndarray): Frequencies (Hz).
+        psd (np.ndarray): Power spectral densities (... x frequencies x channels).
+
+    Returns:
+        dict[str, np.ndarray]: 'peak_frequency' (Hz), 'band_power' and 'snr_db' of each spectrum and channel.
+    """
+    in_band = (frequencies >= vibration_band[0]) & (frequencies <= vibration_band[1])
+    noise = (frequencies >= noise_band[0]) & (frequencies <= noise_band[1]) \
+        & ((frequencies < vibration_band[0] - band_guard) | (frequencies > vibration_band[1] + band_guard))
+    searched = (frequencies >= peak_range[0]) & (frequencies <= peak_range[1])
+    if not in_band.any() or not noise.any() or not searched.any():
+        raise ValueError(f'The spectra ({frequencies[1] - frequencies[0]:.3g} Hz resolution up to {frequencies[-1]:.3g} Hz) do not resolve the vibration and noise bands')
+
+    band = psd[..., in_band, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        snr_db = 10 * np.log10(band.mean(axis=-2) / np.median(psd[..., noise, :], axis=-2))
+    return {
+        'peak_frequency': frequencies[searched][np.argmax(psd[..., searched, :], axis=-2)],
+        'band_power': band.sum(axis=-2) * (frequencies[1] - frequencies[0]),
+        'snr_db': snr_db,
+    }
+
+def _run_quality(path:str) -> np.ndarray:
+    # Quality row of one run, from the features of the stimulated channel of each trial
+    run = StoredRun(path)
+    trials = {feature: [] for feature in ('peak_frequency', 'band_power', 'snr_db')}
+    for frequencies, psd in iterate_spectra(run):
+        features = spectrum_features(frequencies, psd)
+        stimulated = np.argmax(np.nan_to_num(features['snr_db'], nan=-np.inf), axis=1)
+        for feature, values in features.items():
+            trials[feature].append(values[np.arange(len(values)), stimulated])
+    trials = {feature: np.concatenate(values) if values else np.zeros(0) for feature, values in trials.items()}
+
+    row = np.zeros(1, dtype=vibration_quality_dtype)
+    row['n_trials'] = len(trials['snr_db'])
+    row['n_channels'] = len(run.channels)
+    if len(trials['snr_db']) == 0:
+        for feature in ('peak_frequency', 'band_power', 'snr_db', 'off_band_fraction', 'low_snr_fraction'):
+            row[feature] = np.nan
+        return row
+
+    off_band = (trials['peak_frequency'] < vibration_band[0] - peak_tolerance) | (trials['peak_frequency'] > vibration_band[1] + peak_tolerance)
+    for feature, values in trials.items():
+        row[feature] = np.median(values)
+    row['off_band_fraction'] = np.mean(off_band)
+    row['low_snr_fraction'] = np.mean(~(trials['snr_db'] >= min_snr_db))
+    row['bad_stimulus'] = ~(row['snr_db'] >= min_snr_db) | (row['off_band_fraction'] > max_off_band_fraction)
+    return row
+
+def _quality_chunk(paths:list[str]) -> np.ndarray:
+    return np.concatenate([_run_quality(path) for path in paths]) if paths else np.zeros(0, dtype=vibration_quality_dtype)
+
+@profiled('spectrum')
+def vibration_quality(runs:list[StoredRun | str], workers:int = 1) -> np.ndarray:
+    """
+    Quality of the vibration stimulus of many runs from the Welch spectra of
+    all their trials and channels (see iterate_spectra). The runs are split
+    over a pool of processes, each one reading its runs from the signal store.
+
+    A run is a bad stimulus when the median SNR of its trials is below
+    min_snr_db, or when more than max_off_band_fraction of its trials peak
+    out of the vibration band.
+
+    Parameters:
+        runs (list[StoredRun | str]): Runs of a signal store, or their directories.
+        workers (int): Number of processes (1 runs in this process, None uses every CPU).
+
+    Returns:
+        np.ndarray: One row per run (vibration_quality_dtype), NaN features for runs without trials.
+    """
+    paths = [run.path if isinstance(run, StoredRun) else run for run in runs]
+    count(runs=len(paths))
+    if workers != 1 and len(paths) > 1:
+        n_workers = workers if workers is not None else os.cpu_count()
+        n_chunks = min(len(paths), 4 * n_workers)
+        chunks = [paths[start::n_chunks] for start in range(n_chunks)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            computed = list(executor.map(_quality_chunk, chunks))
+        # Undo the round-robin split
+        results = np.zeros(len(paths), dtype=vibration_quality_dtype)
+        for start, chunk in enumerate(computed):
+            results[start::n_chunks] = chunk
+    else:
+        results = _quality_chunk(paths)
+    count(trials=int(results['n_trials'].sum()), bad_stimuli=int(np.count_nonzero(results['bad_stimulus'])))
+    return results
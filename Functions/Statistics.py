@@ -0,0 +1,296 @@
+import numpy as np
+
+
+class QuantileSketch():
+    """
+    Mergeable quantile sketch with logarithmic buckets (as DDSketch), within
+    relative_accuracy of every quantile. Values <= 0 are counted as 0.
+    """
+
+    def __init__(self, relative_accuracy:float = 0.001):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.keys = np.zeros(0, dtype=np.int64) # Bucket keys, sorted
+        self.counts = np.zeros(0, dtype=np.int64) # Number of values in each bucket
+        self.zero_count = 0
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum()) + self.zero_count
+
+    def key(self, values:np.ndarray) -> np.ndarray:
+        # Bucket of each positive value: gamma^(key - 1) < value <= gamma^key
+        return np.ceil(np.log(values) / np.log(self.gamma)).astype(np.int64)
+
+    def value(self, keys:np.ndarray) -> np.ndarray:
+        # Representative value of each bucket, within relative_accuracy of all its values
+        return 2 * self.gamma**keys / (self.gamma + 1)
+
+    def _combine(self, keys:np.ndarray, counts:np.ndarray):
+        keys, index = np.unique(np.concatenate((self.keys, keys)), return_inverse=True)
+        counts = np.bincount(index, weights=np.concatenate((self.counts, counts)), minlength=len(keys)).astype(np.int64)
+        self.keys = keys[counts != 0]
+        self.counts = counts[counts != 0]
+
+    def add(self, values:np.ndarray) -> 'QuantileSketch':
+        values = np.ravel(values)
+        values = values[~np.isnan(values)]
+        positive = values > 0
+        self.zero_count += len(values) - np.count_nonzero(positive)
+        keys, counts = np.unique(self.key(values[positive]), return_counts=True)
+        self._combine(keys, counts)
+        return self
+
+    def merge(self, other:'QuantileSketch') -> 'QuantileSketch':
+        self._combine(other.keys, other.counts)
+        self.zero_count += other.zero_count
+        return self
+
+    def subtract(self, other:'QuantileSketch') -> 'QuantileSketch':
+        # other must have been merged into this sketch before
+        self._combine(other.keys, -other.counts)
+        self.zero_count -= other.zero_count
+        return self
+
+    def copy(self) -> 'QuantileSketch':
+        sketch = QuantileSketch(self.relative_accuracy)
+        sketch.keys = self.keys.copy()
+        sketch.counts = self.counts.copy()
+        sketch.zero_count = self.zero_count
+        return sketch
+
+    def _rank_value(self, rank:int) -> float:
+        # Estimate of the rank-th smallest value (from 0)
+        if rank < self.zero_count:
+            return 0.0
+        bucket = np.searchsorted(np.cumsum(self.counts), rank - self.zero_count, side='right')
+        return float(self.value(self.keys[bucket]))
+
+    def quantile(self, q:float) -> float:
+        # q-th quantile interpolated between ranks as np.quantile, NaN if the sketch is empty
+        count = self.count
+        if count == 0:
+            return np.nan
+        rank = q * (count - 1)
+        lower, upper = int(np.floor(rank)), int(np.ceil(rank))
+        fraction = rank - lower
+        return (1 - fraction) * self._rank_value(lower) + fraction * self._rank_value(upper)
+
+    def median(self) -> float:
+        return self.quantile(0.5)
+
+class GroupStatistics():
+    """
+    Mergeable statistics of a group of RTs (count, Welford mean and std, min,
+    max and a quantile sketch for the median) in a fixed memory.
+    """
+
+    def __init__(self, relative_accuracy:float = 0.001):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # Sum of the squared deviations from the mean
+        self.min = np.inf
+        self.max = -np.inf
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    @property
+    def sum(self) -> float:
+        return self.mean * self.count
+
+    @classmethod
+    def from_values(cls, values:np.ndarray, relative_accuracy:float = 0.001) -> 'GroupStatistics':
+        values = np.ravel(values)
+        values = values[~np.isnan(values)]
+        statistics = cls(relative_accuracy)
+        if len(values) > 0:
+            statistics.count = len(values)
+            statistics.mean = float(np.mean(values))
+            statistics.m2 = float(np.sum((values - statistics.mean)**2))
+            statistics.min = float(np.min(values))
+            statistics.max = float(np.max(values))
+            statistics.sketch.add(values)
+        return statistics
+
+    def add(self, values:np.ndarray) -> 'GroupStatistics':
+        # Welford update by a whole batch of values
+        return self.merge(GroupStatistics.from_values(values, self.sketch.relative_accuracy))
+
+    def merge(self, other:'GroupStatistics') -> 'GroupStatistics':
+        count = self.count + other.count
+        if other.count > 0:
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def subtract(self, other:'GroupStatistics') -> 'GroupStatistics':
+        # Remove a group merged before, the min and max are kept unless empty (the caller recomputes them)
+        count = self.count - other.count
+        self.sketch.subtract(other.sketch)
+        if count == 0:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            self.min, self.max = np.inf, -np.inf
+            return self
+
+        if other.count > 0:
+            # Inverse of the merge
+            mean = (self.count * self.mean - other.count * other.mean) / count
+            delta = other.mean - mean
+            self.m2 = max(self.m2 - other.m2 - delta**2 * count * other.count / self.count, 0.0)
+            self.mean = mean
+        self.count = count
+        return self
+
+    def copy(self) -> 'GroupStatistics':
+        statistics = GroupStatistics(self.sketch.relative_accuracy)
+        statistics.count, statistics.mean, statistics.m2 = self.count, self.mean, self.m2
+        statistics.min, statistics.max = self.min, self.max
+        statistics.sketch = self.sketch.copy()
+        return statistics
+
+    def features(self) -> dict[str, float]:
+        # Same features as the Features class (NaN for an empty group)
+        if self.count == 0:
+            return {'mean': np.nan, 'median': np.nan, 'std': np.nan, 'min': np.nan, 'max': np.nan}
+
+        return {
+            'mean': self.mean,
+            'median': self.sketch.median(),
+            'std': np.sqrt(self.m2 / self.count),
+            'min': self.min,
+            'max': self.max,
+        }
+
+def group_statistics(group:np.ndarray, values:np.ndarray, n_groups:int, relative_accuracy:float = 0.001) -> list[GroupStatistics]:
+    """
+    Build the statistics of many groups at once with vectorized reductions.
+
+    Parameters:
+        group (np.ndarray): Group index of each value, in [0, n_groups].
+            Values with index n_groups are ignored.
+        values (np.ndarray): Input data array.
+        n_groups (int): Number of groups.
+        relative_accuracy (float): Relative accuracy of the quantile sketches.
+
+    Returns:
+        list[GroupStatistics]: Statistics of each group.
+    """
+    keep = ~np.isnan(values)
+    group = group[keep]
+    values = values[keep]
+
+    count = np.bincount(group, minlength=n_groups + 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(group, weights=values, minlength=n_groups + 1) / count
+    m2 = np.bincount(group, weights=(values - mean[group])**2, minlength=n_groups + 1)
+    minimum = np.full(n_groups + 1, np.inf)
+    np.minimum.at(minimum, group, values)
+    maximum = np.full(n_groups + 1, -np.inf)
+    np.maximum.at(maximum, group, values)
+
+    # Bucket counts of every (group, key) pair, in one sort
+    sketch = QuantileSketch(relative_accuracy)
+    positive = values > 0
+    zero_count = np.bincount(group[~positive], minlength=n_groups + 1)[:n_groups]
+    keys = sketch.key(values[positive])
+    # Each (group, key) pair as one integer, a 1-D sort is much faster than np.unique(axis=1)
+    low = keys.min() if len(keys) else 0
+    span = keys.max() - low + 1 if len(keys) else 1
+    pairs, pair_count = np.unique(group[positive] * span + (keys - low), return_counts=True)
+    pair_group, pair_key = pairs // span, pairs % span + low
+    boundaries = np.searchsorted(pair_group, np.arange(n_groups + 1))
+
+    statistics = []
+    for i in range(n_groups):
+        group_statistics = GroupStatistics(relative_accuracy)
+        if count[i] > 0:
+            group_statistics.count = int(count[i])
+            group_statistics.mean = float(mean[i])
+            group_statistics.m2 = float(m2[i])
+            group_statistics.min = float(minimum[i])
+            group_statistics.max = float(maximum[i])
+            group_statistics.sketch.keys = pair_key[boundaries[i]:boundaries[i + 1]]
+            group_statistics.sketch.counts = pair_count[boundaries[i]:boundaries[i + 1]].astype(np.int64)
+            group_statistics.sketch.zero_count = int(zero_count[i])
+        statistics.append(group_statistics)
+
+    return statistics
+
+class SortedGroups():
+    """
+    Values of many groups sorted once with prefix sums, so that the
+    statistics in a window cost two binary searches per group.
+    """
+
+    def __init__(self, group:np.ndarray, values:np.ndarray, n_groups:int):
+        # Values with group index n_groups (or NaN) are ignored
+        keep = (group < n_groups) & ~np.isnan(values)
+        group = group[keep]
+        values = np.asarray(values[keep], dtype=float)
+
+        self.n_groups = n_groups
+        self.values = values[np.lexsort((values, group))]
+        self.count = np.bincount(group, minlength=n_groups)
+        self.stop = np.cumsum(self.count)
+        self.start = self.stop - self.count
+
+        # Prefix sums of the values centred on their group mean, so the variance does not lose precision
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.shift = np.where(self.count > 0, np.bincount(group, weights=values, minlength=n_groups) / self.count, 0.0)
+        centred = self.values - np.repeat(self.shift, self.count)
+        self.sum = np.concatenate(([0.0], np.cumsum(centred)))
+        self.sum2 = np.concatenate(([0.0], np.cumsum(centred**2)))
+
+    def _bisect(self, bound:np.ndarray, strict:bool) -> np.ndarray:
+        # First position of each group with a value above bound (strict) or not below it, for every bound (rows) at once
+        low = np.broadcast_to(self.start, (len(bound), self.n_groups)).copy()
+        high = np.broadcast_to(self.stop, (len(bound), self.n_groups)).copy()
+        last = max(len(self.values) - 1, 0)
+        while True:
+            active = low < high
+            if not active.any():
+                return low
+            middle = (low + high) // 2
+            value = self.values[np.minimum(middle, last)] if len(self.values) else np.zeros(middle.shape)
+            right = active & ((value <= bound) if strict else (value < bound))
+            low = np.where(right, middle + 1, low)
+            high = np.where(active & ~right, middle, high)
+
+    def window(self, lower:np.ndarray, upper:np.ndarray) -> dict[str, np.ndarray]:
+        """
+        Statistics of the values of each group with lower < value < upper, for many windows at once.
+
+        Parameters:
+            lower (np.ndarray): Lower limit of each window.
+            upper (np.ndarray): Upper limit of each window.
+
+        Returns:
+            dict[str, np.ndarray]: 'count', 'sum', 'mean', 'median', 'std', 'min' and 'max'
+                of every window (rows) and group (columns), NaN for empty groups.
+        """
+        # A grid of windows shares its bounds, each distinct bound is searched once
+        lower, lower_index = np.unique(np.asarray(lower, dtype=float), return_inverse=True)
+        upper, upper_index = np.unique(np.asarray(upper, dtype=float), return_inverse=True)
+        left = self._bisect(lower[:, None], strict=True)[lower_index.ravel()]
+        right = np.maximum(self._bisect(upper[:, None], strict=False)[upper_index.ravel()], left)
+        count = right - left
+
+        def at(index:np.ndarray) -> np.ndarray:
+            return np.where(count > 0, self.values[np.clip(index, 0, max(len(self.values) - 1, 0))] if len(self.values) else np.nan, np.nan)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            centred_mean = (self.sum[right] - self.sum[left]) / count
+            variance = np.maximum((self.sum2[right] - self.sum2[left]) / count - centred_mean**2, 0.0)
+            return {
+                'count': count,
+                'sum': np.where(count > 0, self.sum[right] - self.sum[left] + count * self.shift, 0.0),
+                'mean': centred_mean + self.shift,
+                'median': (at(left + (count - 1) // 2) + at(left + count // 2)) / 2,
+                'std': np.sqrt(variance),
+                'min': at(left),
+                'max': at(right - 1),
+            }
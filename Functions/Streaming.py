@@ -0,0 +1,481 @@
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfreqz
+from collections.abc import Iterable, Iterator
+import queue
+import threading
+import time
+
+from Functions.Detection import (sampling, trial_length, tkeo_window_size, no_onset_period_ms, vibration_time_ms,
+                                 movement_parameters, vibration_parameters, get_unique_onsets, get_test_type)
+
+
+calibration_ms = 6 * trial_length * 1000 # Signal received before the first decisions, for the running thresholds (ms)
+
+
+class _RingBuffer():
+    # Last samples of a multi-channel stream in a fixed array, addressed by their sample index in the stream
+
+    def __init__(self, capacity:int, n_channels:int):
+        self.data = np.zeros((capacity, n_channels))
+        self.end = 0 # Index of the next sample
+
+    @property
+    def start(self) -> int:
+        # Index of the oldest sample still in the buffer
+        return max(0, self.end - len(self.data))
+
+    def append(self, block:np.ndarray):
+        # Only the last capacity samples of a long block are kept
+        capacity = len(self.data)
+        kept = block[-capacity:]
+        position = (self.end + len(block) - len(kept)) % capacity
+        first = min(len(kept), capacity - position)
+        self.data[position:position + first] = kept[:first]
+        self.data[:len(kept) - first] = kept[first:]
+        self.end += len(block)
+
+    def get(self, start:int, stop:int) -> np.ndarray:
+        # Samples [start, stop) of the stream, they must still be in the buffer
+        if start < self.start or stop > self.end:
+            raise IndexError(f'Samples {start} to {stop} are not in the buffer ({self.start} to {self.end})')
+        return self.data[np.arange(start, stop) % len(self.data)]
+
+class _EnvelopeStage():
+    # Causal filter (twice, as filtfilt), TKEO and moving average of a stream, as getSegmentedFeatures.m, kept between blocks
+
+    def __init__(self, n_channels:int, filter_order:int, cutoff_low:float, cutoff_high:float, sampling:int = sampling, window_size:int = tkeo_window_size, **_):
+        # Filtered twice, as filtfilt, for the same attenuation outside the band
+        sos = butter(filter_order, [cutoff_low, cutoff_high], btype='bandpass', fs=sampling, output='sos')
+        self.sos = np.vstack((sos, sos))
+        self.zi = np.zeros((len(self.sos), 2, n_channels))
+        self.window_size = window_size
+
+        self.filtered_tail = np.zeros((0, n_channels)) # Last 2 filtered samples
+        self.energy_tail = np.zeros((window_size, n_channels)) # Last window_size |TKEO| values (0 before the stream, as the padding of conv)
+        self.n_energy = 0 # Index of the next TKEO value
+        self.n_envelope = 0 # Index of the next envelope sample
+
+        # The filter is causal: the onsets are late by its group delay at the centre of the band
+        centre = np.sqrt(cutoff_low * cutoff_high)
+        frequencies = centre * np.array([0.999, 1.001])
+        _, response = sosfreqz(self.sos, worN=frequencies, fs=sampling)
+        phase = np.unwrap(np.angle(response))
+        self.delay = -(phase[1] - phase[0]) / (2 * np.pi * (frequencies[1] - frequencies[0])) * sampling # Samples
+
+    def process(self, block:np.ndarray) -> np.ndarray:
+        # Envelope of the samples that are complete after this block, in order
+        filtered, self.zi = sosfilt(self.sos, block, axis=0, zi=self.zi)
+        samples = np.concatenate((self.filtered_tail, filtered))
+        energy = samples[1:-1]**2 - samples[:-2] * samples[2:]
+        if self.n_energy == 0 and len(samples) > 0:
+            energy = np.concatenate((np.zeros((1, samples.shape[1])), energy)) # As tkeo, 0 on the first sample
+        self.filtered_tail = samples[-2:]
+        return self._average(np.abs(energy))
+
+    def flush(self) -> np.ndarray:
+        # Envelope of the last samples, with a TKEO of 0 on the last one and zero padding as conv
+        n_channels = self.energy_tail.shape[1]
+        end = np.zeros((1 if len(self.filtered_tail) > 0 else 0, n_channels))
+        return self._average(np.concatenate((end, np.zeros((self.window_size // 2, n_channels)))))
+
+    def _average(self, energy:np.ndarray) -> np.ndarray:
+        # Centred moving average (as moving_average): each new TKEO value completes the window of the sample window_size / 2 before it
+        energies = np.concatenate((self.energy_tail, energy))
+        cumulative = np.concatenate((np.zeros((1, energies.shape[1])), np.cumsum(energies, axis=0)))
+        envelope = (cumulative[self.window_size + 1:] - cumulative[1:len(energy) + 1]) / self.window_size
+
+        # There is no sample before the start of the stream
+        first = self.n_energy - self.window_size // 2
+        envelope = envelope[max(0, -first):]
+        self.n_energy += len(energy)
+        self.n_envelope += len(envelope)
+        self.energy_tail = energies[len(energies) - self.window_size:]
+        return envelope
+
+class _OnsetStage():
+    # Onsets of an envelope stream as getSegmentedSignalOnset.m, with the threshold and baseline from its running statistics
+
+    def __init__(self, n_channels:int, alpha:float, no_onset_period:int, vibration_window:int, capacity:int, reference:bool = False):
+        self.n_channels = n_channels
+        self.alpha = alpha
+        self.no_onset_period = no_onset_period
+        self.vibration_window = vibration_window
+        self.reference = reference
+        # Envelope, then reference
+        self.buffer = _RingBuffer(capacity, 2 * n_channels if reference else n_channels)
+
+        # Running mean and co-moments of the envelope and the reference
+        self.count = 0
+        self.mean = np.zeros(self.buffer.data.shape[1])
+        self.m2 = np.zeros(self.buffer.data.shape[1])
+        self.cross = np.zeros(n_channels)
+
+        self.decided = 0 # Index of the next sample to decide on
+        self.last_at_baseline = np.zeros(n_channels, dtype=np.int64)
+        self.ignored_until = np.full(n_channels, -1, dtype=np.int64)
+
+    @property
+    def lookahead(self) -> int:
+        return 0 if self.vibration_window is None else self.vibration_window
+
+    def append(self, envelope:np.ndarray, reference:np.ndarray = None):
+        self.buffer.append(envelope if reference is None else np.hstack((envelope, reference)))
+
+    def _update(self, samples:np.ndarray):
+        # Batch Welford update of the running statistics
+        if len(samples) == 0:
+            return
+        count = self.count + len(samples)
+        mean = samples.mean(axis=0)
+        delta = mean - self.mean
+        centred = samples - mean
+        weight = self.count * len(samples) / count
+        self.m2 += (centred**2).sum(axis=0) + delta**2 * weight
+        if self.reference:
+            n = self.n_channels
+            self.cross += (centred[:, :n] * centred[:, n:]).sum(axis=0) + delta[:n] * delta[n:] * weight
+        self.mean += delta * len(samples) / count
+        self.count = count
+
+    def decide(self, until:int) -> list[tuple[int, int, int]]:
+        # (channel, crossing, onset) of the onsets found in the samples up to until (excluded), in order
+        if until <= self.decided:
+            return []
+        self._update(self.buffer.get(self.count, until))
+        n = self.n_channels
+        variance = self.m2 / max(self.count - 1, 1)
+        threshold = self.mean[:n] + self.alpha * np.sqrt(variance[:n])
+        if self.reference:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ratio = np.nan_to_num(self.mean[:n] / self.mean[n:])
+            # The envelope without the reference has a mean of 0
+            residual = (self.m2[:n] - 2 * ratio * self.cross + ratio**2 * self.m2[n:]) / max(self.count - 1, 1)
+            baseline = 0.1 * np.sqrt(np.maximum(residual, 0))
+        else:
+            baseline = self.mean[:n] + 0.1 * np.sqrt(variance[:n])
+
+        start = self.decided
+        x = self.buffer.get(start, min(until + self.lookahead, self.buffer.end))
+        if self.reference:
+            x = x[:, :n] - x[:, n:] * ratio
+        index = np.arange(start, start + len(x))
+        onsets = []
+        for i in range(n):
+            crossings = np.flatnonzero(x[:until - start, i] > threshold[i]) + start
+            last_at_baseline = np.maximum.accumulate(np.where(x[:, i] <= baseline[i], index, self.last_at_baseline[i]))
+            if self.vibration_window is not None:
+                next_negative = np.minimum.accumulate(np.where(x[:, i] < 0, index, np.iinfo(np.int64).max)[::-1])[::-1]
+
+            for z in crossings:
+                if z <= self.ignored_until[i]:
+                    continue
+                if self.vibration_window is not None and next_negative[z - start] <= z + self.vibration_window:
+                    self.ignored_until[i] = max(self.ignored_until[i], z + self.vibration_window)
+                    continue
+                k = last_at_baseline[z - start]
+                onsets.append((i, z, k))
+                self.ignored_until[i] = max(self.ignored_until[i], k + self.no_onset_period)
+
+            self.last_at_baseline[i] = last_at_baseline[until - start - 1]
+
+        self.decided = until
+        return sorted(onsets, key=lambda onset: onset[1])
+
+class _FeatureUpdater():
+    # Applies the latest finished trials to Features in a thread, so that the blocks never wait for Features.add_run
+
+    def __init__(self, features, subject:str, run:str, run_data):
+        self.features = features
+        self.subject = subject
+        self.run = run
+        self.run_data = run_data # Variables of the first n finished trials
+        self.pending = None # Finished trials to apply, -1 stops the thread
+        self.applied = 0
+        self.error = None
+        self.durations:list[float] = [] # Time of each Features update (s)
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def submit(self, n_trials:int):
+        with self.condition:
+            self.pending = n_trials
+            self.condition.notify_all()
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                n_trials, self.pending = self.pending, None
+            if n_trials < 0:
+                return
+            start = time.perf_counter()
+            try:
+                self.features.add_run(self.subject, self.run, self.run_data(n_trials))
+            except Exception as error:
+                self.error = error
+            with self.condition:
+                self.durations.append(time.perf_counter() - start)
+                self.applied = max(self.applied, n_trials)
+                self.condition.notify_all()
+
+    def wait(self, n_trials:int):
+        # Until the first n_trials are in the features, the errors of the thread are raised here
+        with self.condition:
+            while self.applied < n_trials and self.error is None:
+                self.condition.wait()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def stop(self):
+        self.submit(-1)
+        self.thread.join()
+
+class StreamingDetector():
+    """
+    Online version of doSegmentedDetection.m for live sessions: blocks of
+    samples go in as they are acquired, the onsets and the results of each
+    finished trial come out, with a state of fixed size.
+
+    Differences with the offline detection:
+        - The filters are causal, the onsets are moved back by their group delay
+          (the movement removed from the vibrations is delayed to stay aligned).
+        - The thresholds are from the running statistics of the envelopes,
+          nothing is decided before calibration_ms of signal.
+        - The RT is the number of samples between the onsets over the sampling rate.
+
+    With features, the finished trials update the run (Features.add_run) in a
+    background thread, call sync_features before reading them.
+    """
+
+    def __init__(self, n_channels:int, triallist:np.ndarray = None, features = None, subject:str = None, run:str = None,
+                 sampling:int = sampling, trial_length:float = trial_length, calibration_ms:float = calibration_ms):
+        self.n_channels = n_channels
+        self.sampling = sampling
+        self.trial_samples = trial_length * sampling
+        self.triallist = None if triallist is None else np.ravel(triallist)
+        self.features = features
+        self.subject = subject
+        self.run = run
+
+        self.calibration = int(round(calibration_ms * sampling / 1000))
+        self.decision_step = sampling // 10
+        no_onset_period = int(round(no_onset_period_ms * sampling / 1000))
+        vibration_window = int(round(vibration_time_ms * sampling / 1000))
+        # History needed by the decisions: the calibration, a trial and the lookahead of the vibrations
+        capacity = self.calibration + int(np.ceil(self.trial_samples)) + vibration_window + 1
+
+        self.movement = _EnvelopeStage(n_channels, sampling=sampling, **movement_parameters)
+        self.vibration = _EnvelopeStage(n_channels, sampling=sampling, **vibration_parameters)
+        self.movement_onsets = _OnsetStage(n_channels, movement_parameters['alpha'], no_onset_period, None, capacity)
+        self.vibration_onsets = _OnsetStage(n_channels, vibration_parameters['alpha'], no_onset_period, vibration_window, capacity, reference=True)
+        # The vibration filter is slower: the movement removed from its envelope is delayed as much, as both are aligned with filtfilt
+        self.reference_tail = np.zeros((max(int(round(self.vibration.delay - self.movement.delay)), 0), n_channels))
+
+        self.n_samples = 0
+        self.trial_onsets:dict[int, np.ndarray] = dict() # trial > onset of each channel (vibrations then movements, -1 if none)
+        self.n_closed = 0 # Number of finished trials
+        self.trials:list[dict] = [] # Results of the finished trials
+        self.latencies:list[float] = [] # Processing time of each block (s)
+        self.block_lengths:list[int] = []
+        self.updater = _FeatureUpdater(features, subject, run, self._run_data) if features is not None else None
+
+    def _trial_start(self, trial:int) -> int:
+        # First sample of a trial, as get_segmentation
+        return 0 if trial == 0 else int(round(trial * self.trial_samples)) - 1
+
+    def _trial_of(self, sample:int) -> int:
+        trial = int((sample + 1) // self.trial_samples)
+        if self._trial_start(trial + 1) <= sample:
+            trial += 1
+        elif self._trial_start(trial) > sample:
+            trial -= 1
+        return trial
+
+    def _onsets(self, onsets:list[tuple[int, int, int]], kind:str, delay:float) -> list[dict]:
+        # Keep the last onset of each trial and channel, as the offline loop does
+        events = []
+        column = 0 if kind == 'vibration' else self.n_channels
+        for channel, crossing, onset in onsets:
+            onset = max(0, int(round(onset - delay)))
+            trial = self._trial_of(crossing)
+            if trial < self.n_closed:
+                continue
+            if trial not in self.trial_onsets:
+                self.trial_onsets[trial] = np.full(2 * self.n_channels, -1, dtype=np.int64)
+            self.trial_onsets[trial][column + channel] = onset
+            events.append({'kind': kind, 'trial': trial, 'channel': channel, 'sample': onset, 'time': onset / self.sampling})
+        return events
+
+    def _close_trial(self, trial:int) -> dict:
+        # Test type and RT of a finished trial, as get_test_type and compare_with_box
+        onsets = self.trial_onsets.pop(trial, np.full(2 * self.n_channels, -1, dtype=np.int64))[None, :]
+        test_type, vb_index, mv_index = get_test_type(get_unique_onsets(onsets[:, :self.n_channels]), get_unique_onsets(onsets[:, self.n_channels:]))
+        result = {'trial': trial, 'test_type': int(test_type[0]), 'vb_index': vb_index[0], 'mv_index': mv_index[0], 'correct': None}
+        if self.triallist is not None:
+            result['correct'] = bool(result['test_type'] == self.triallist[trial])
+            if not result['correct']:
+                result['test_type'], result['vb_index'], result['mv_index'] = 0, -1, -1
+
+        # As t(round(|mv - vb|)) in MATLAB
+        found = result['vb_index'] != -1 and result['mv_index'] != -1
+        result['rt_acc'] = (np.floor(abs(result['mv_index'] - result['vb_index']) + 0.5) - 1) / self.sampling * 1000 if found else np.nan
+        # 1-based samples, as in the .mat files
+        for index in ['vb_index', 'mv_index']:
+            result[index] = result[index] + 1 if result[index] != -1 else -1
+        return result
+
+    def _decide(self, final:bool = False) -> tuple[list[dict], list[dict]]:
+        # Decide on the samples with enough signal after them, calibration first then decision_step samples at a time
+        available = self.movement_onsets.buffer.end
+        if not final:
+            available -= self.vibration_onsets.lookahead
+        events = []
+        while True:
+            decided = self.movement_onsets.decided
+            until = self.calibration if decided == 0 else decided + self.decision_step
+            if until > available:
+                if not final or decided >= available:
+                    break
+                until = available
+            # Both stages decide on the same samples
+            events += self._onsets(self.vibration_onsets.decide(until), 'vibration', self.vibration.delay)
+            events += self._onsets(self.movement_onsets.decide(until), 'movement', self.movement.delay)
+        until = self.movement_onsets.decided
+
+        trials = []
+        # As get_segmentation, the end of the run is a trial only if it is complete
+        n_trials = len(self.triallist) if self.triallist is not None else np.inf
+        if final:
+            n_trials = min(n_trials, int(np.floor(self.n_samples / self.trial_samples + 1e-9)))
+        while self.n_closed < n_trials and (self._trial_start(self.n_closed + 1) <= until or final):
+            trials.append(self._close_trial(self.n_closed))
+            self.n_closed += 1
+        self.trials += trials
+        if trials and self.updater is not None:
+            self.updater.submit(len(self.trials))
+        return events, trials
+
+    def _append(self, movement:np.ndarray, vibration:np.ndarray):
+        # The movement is removed from the vibration envelope when deciding
+        self.movement_onsets.append(movement)
+        reference = np.concatenate((self.reference_tail, movement))
+        self.reference_tail = reference[len(movement):]
+        self.vibration_onsets.append(vibration, reference[:len(movement)])
+
+    def process(self, block:np.ndarray) -> tuple[list[dict], list[dict]]:
+        """
+        Process a block of samples.
+
+        Parameters:
+            block (np.ndarray): Samples (samples x channels), the first half of the channels is FDI and the second half ADM.
+
+        Returns:
+            tuple[list[dict], list[dict]]: Onsets found ('kind', 'trial', 'channel', 'sample' and 'time')
+                and results of the trials finished ('trial', 'test_type', 'vb_index', 'mv_index', 'rt_acc', 'correct').
+        """
+        start = time.perf_counter()
+        block = np.asarray(block, dtype=float).reshape(-1, self.n_channels)
+        events, trials = [], []
+        # Long blocks (e.g. a whole file) are split so that the history fits in the buffers
+        for first in range(0, len(block), int(self.trial_samples)):
+            part = block[first:first + int(self.trial_samples)]
+            self.n_samples += len(part)
+            self._append(self.movement.process(part), self.vibration.process(part))
+            part_events, part_trials = self._decide()
+            events += part_events
+            trials += part_trials
+
+        self.latencies.append(time.perf_counter() - start)
+        self.block_lengths.append(len(block))
+        return events, trials
+
+    def finish(self) -> tuple[list[dict], list[dict]]:
+        # End of the run: decide on the last samples, close the last trial and apply it to the features
+        self._append(self.movement.flush(), self.vibration.flush())
+        events, trials = self._decide(final=True)
+        if self.updater is not None:
+            self.sync_features()
+            self.updater.stop()
+        return events, trials
+
+    def sync_features(self):
+        # Wait until every finished trial is in the features
+        if self.updater is not None:
+            self.updater.wait(len(self.trials))
+
+    def run_blocks(self, blocks:Iterable[np.ndarray]) -> list[dict]:
+        # Process all the blocks of a source, then finish the run
+        for block in blocks:
+            self.process(block)
+        self.finish()
+        return self.trials
+
+    def get_run_data(self) -> dict[str, np.ndarray]:
+        """
+        Variables of the finished trials of the run, as in the .mat files loaded for Features.
+        """
+        return self._run_data(len(self.trials))
+
+    def _run_data(self, n_trials:int) -> dict[str, np.ndarray]:
+        # The first n_trials only, the trials finished meanwhile are left to the next update
+        trials = self.trials[:n_trials]
+        test_type = np.array([trial['test_type'] for trial in trials], dtype=np.int64)
+        rt_acc = np.array([trial['rt_acc'] for trial in trials])
+        found = ~np.isnan(rt_acc) & (test_type > 0)
+        correct = np.array([trial['correct'] is not False for trial in trials], dtype=bool)
+        return {
+            'rt_acc': rt_acc[found],
+            'acc_test_type': test_type[found],
+            'test_type': np.where(test_type == 0, -1, test_type), # Incorrect guesses are not found, as Loader does
+            'vb_index': np.array([trial['vb_index'] for trial in trials], dtype=np.int64),
+            'mv_index': np.array([trial['mv_index'] for trial in trials], dtype=np.int64),
+            't': np.arange(int(np.ceil(2 * self.trial_samples))) / self.sampling, # Only used for the RTs, shorter than two trials
+            'correct_nbr': np.count_nonzero(correct),
+            'incorrect_nbr': np.count_nonzero(~correct),
+        }
+
+    def latency(self) -> dict[str, float]:
+        """
+        Processing time of the blocks, compared with their duration.
+
+        Returns:
+            dict[str, float]: Mean, 95th percentile and max processing time (ms), mean block duration (ms),
+                max fraction of the block duration used and, with features, the updates and their mean and max time (ms).
+        """
+        if len(self.latencies) == 0:
+            result = {'mean_ms': np.nan, 'p95_ms': np.nan, 'max_ms': np.nan, 'block_ms': np.nan, 'max_load': np.nan}
+        else:
+            latencies = np.array(self.latencies) * 1000
+            durations = np.array(self.block_lengths) / self.sampling * 1000
+            result = {
+                'mean_ms': latencies.mean(),
+                'p95_ms': np.percentile(latencies, 95),
+                'max_ms': latencies.max(),
+                'block_ms': durations.mean(),
+                'max_load': np.max(latencies / durations),
+            }
+        if self.updater is not None:
+            updates = np.array(self.updater.durations) * 1000
+            result['feature_updates'] = len(updates)
+            result['feature_mean_ms'] = updates.mean() if len(updates) else np.nan
+            result['feature_max_ms'] = updates.max() if len(updates) else np.nan
+        return result
+
+def replay_blocks(signal:np.ndarray, block_size:int = 100, realtime:bool = False, sampling:int = sampling) -> Iterator[np.ndarray]:
+    # Blocks of a recorded signal (an array or the signal of a StoredRun), paced at the sampling rate if realtime
+    start = time.perf_counter()
+    for first in range(0, len(signal), block_size):
+        if realtime:
+            time.sleep(max(0, start + (first + block_size) / sampling - time.perf_counter()))
+        yield np.asarray(signal[first:first + block_size])
+
+def queue_blocks(source:queue.Queue, timeout:float = None) -> Iterator[np.ndarray]:
+    # Blocks put in a queue by an acquisition thread (a stand-in for a socket), until None is put
+    while True:
+        block = source.get(timeout=timeout)
+        if block is None:
+            return
+        yield block
@@ -0,0 +1,82 @@
+import numpy as np
+
+from Functions.Detection import sampling, trial_length
+from Functions.Loader import _prepare_acc, _prepare_box, box_null_value
+
+
+def _subject_code(subject:int) -> str:
+    # Same format as the codes of the .mat files (X + 5 digits)
+    return f'X{subject:05d}'
+
+def make_cohort(n_subjects:int, n_runs:int = 2, n_trials:int = 200, acc_missing:float = 0.05, box_missing:float = 0.02,
+                incorrect:float = 0.03, seed:int = None, sampling:int = sampling, trial_length:float = trial_length) -> tuple[dict[str, dict], dict[str, dict]]:
+    """
+    Synthetic accelerometer and box datasets with the shape of load_dataset
+    (subject > run > variables, (1, n) arrays as loadmat), for benchmarks and
+    checks without the .mat files.
+
+    The RTs follow an ex-Gaussian distribution with a subject offset and
+    slower heterotopic trials; the box RTs are the accelerometer RTs plus a
+    delay. The time vector t only depends on the number of trials, so every
+    run shares the same read-only array.
+
+    Parameters:
+        n_subjects (int): Number of subjects.
+        n_runs (int): Runs per subject.
+        n_trials (int): Trials per run.
+        acc_missing (float): Fraction of trials without a vibration or movement onset.
+        box_missing (float): Fraction of trials without a press (box_null_value).
+        incorrect (float): Fraction of trials with a wrong test type guess (test_type 0 before loading).
+        seed (int): Seed of the random generator.
+        sampling (int): Sampling rate of the signals (Hz).
+        trial_length (float): Length of each trial (s).
+
+    Returns:
+        tuple[dict[str, dict], dict[str, dict]]: Accelerometer dataset and box dataset.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (n_subjects, n_runs, n_trials)
+    trial_samples = int(round(trial_length * sampling)) + 1
+
+    test_type = rng.integers(1, 5, shape)
+    rt = 150 + rng.normal(250, 40, shape) + rng.exponential(80, shape) # ms
+    rt += rng.normal(0, 30, (n_subjects, 1, 1)) + 25 * np.isin(test_type, (1, 2))
+
+    # Onsets in samples (1-based, as the .mat files), -1 for the missing trials
+    vb_index = np.arange(n_trials) * trial_samples + rng.integers(500, 900, shape) + 1.0
+    mv_index = vb_index + rt * sampling / 1000
+    missing = rng.random(shape) < acc_missing
+    wrong = ~missing & (rng.random(shape) < incorrect)
+    vb_index[missing | wrong] = -1
+    mv_index[missing | wrong] = -1
+    acc_test_type = np.where(missing, -1, np.where(wrong, 0, test_type))
+
+    t = np.arange(n_trials * trial_samples)[None, :] / sampling
+    t.flags.writeable = False
+
+    presstime = (rt + rng.normal(40, 15, shape)) / 1000 # s
+    presstime[rng.random(shape) < box_missing] = box_null_value
+
+    acc, box = dict(), dict()
+    for subject in range(n_subjects):
+        code = _subject_code(subject)
+        acc[code], box[code] = dict(), dict()
+        for run in range(n_runs):
+            found = acc_test_type[subject, run] > 0
+            vb, mv = vb_index[subject, run], mv_index[subject, run]
+            acc[code][str(run + 1)] = _prepare_acc({
+                # As in MATLAB, t(round(|mv - vb|)) in ms
+                'rt_acc': t[:, np.round(np.abs(mv[found] - vb[found])).astype(np.intp) - 1] * 1000,
+                'acc_test_type': acc_test_type[subject, run][found][None, :].astype(float),
+                'test_type': acc_test_type[subject, run][None, :].astype(float),
+                'vb_index': vb[None, :],
+                'mv_index': mv[None, :],
+                't': t,
+                'correct_nbr': np.array([[np.count_nonzero(found)]]),
+                'incorrect_nbr': np.array([[np.count_nonzero(wrong[subject, run])]]),
+            })
+            box[code][str(run + 1)] = _prepare_box({
+                'presstime': presstime[subject, run][None, :],
+                'triallist': test_type[subject, run][None, :].astype(np.uint8),
+            })
+    return acc, box
@@ -0,0 +1,246 @@
+import numpy as np
+from collections.abc import Iterable
+
+from Functions.Profiling import count, profiled
+
+
+# One record per trial with a reaction time (rt_acc and acc_test_type of the dataset)
+trial_dtype = np.dtype([('rt', np.float32), ('test_type', np.int8)])
+
+# One record per trial of the full trial list of a run (test_type of the dataset)
+full_trial_dtype = np.dtype([
+    ('rt', np.float32), ('test_type', np.int8),
+    ('vb_index', np.float32), ('mv_index', np.float32), ('valid', np.bool_),
+])
+
+def get_full_rt(vb_index:np.ndarray, mv_index:np.ndarray, t:np.ndarray) -> np.ndarray:
+    # RT of every trial as one gather from t, NaN where the vibration or movement onset is missing
+    vb_index = np.ravel(vb_index)
+    mv_index = np.ravel(mv_index)
+    found = (vb_index != -1) & (mv_index != -1)
+
+    rt = np.full(len(vb_index), np.nan)
+    # ravel does not copy a contiguous (or memory-mapped) t, only the gathered samples are read
+    rt[found] = np.ravel(t)[np.abs(np.round(mv_index[found] - vb_index[found])).astype(np.intp)]
+    return rt
+
+def _run_records(data:dict) -> tuple[np.ndarray, np.ndarray, str]:
+    """
+    Records of one run of a dataset (variables as load_dataset).
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, str]: Trials with an RT, full trial list
+            and kind of the run ('acc' or 'box').
+    """
+    rt_acc = np.ravel(data['rt_acc'])
+    trials = np.empty(len(rt_acc), dtype=trial_dtype)
+    trials['rt'] = rt_acc
+    trials['test_type'] = np.ravel(data['acc_test_type'])
+
+    test_type = np.ravel(data['test_type'])
+    full = np.empty(len(test_type), dtype=full_trial_dtype)
+    full['test_type'] = test_type
+    if 'all_rt_box' in data:
+        kind = 'box'
+        # Missing presses may still be marked with -1
+        rt = np.asarray(data['all_rt_box'], dtype=float).ravel()
+        rt = np.where(rt == -1, np.nan, rt)
+        full['vb_index'] = np.nan
+        full['mv_index'] = np.nan
+    else:
+        kind = 'acc'
+        # t is only read at the onsets and is not kept
+        rt = get_full_rt(data['vb_index'], data['mv_index'], data['t'])
+        full['vb_index'] = np.ravel(data['vb_index'])
+        full['mv_index'] = np.ravel(data['mv_index'])
+    full['rt'] = rt
+    full['valid'] = ~np.isnan(rt)
+    return trials, full, kind
+
+def _offsets(lengths:Iterable[int]) -> np.ndarray:
+    return np.concatenate(([0], np.cumsum(np.fromiter(lengths, dtype=np.int64)))).astype(np.int64)
+
+def _splice_records(buffer:np.ndarray, length:int, start:int, stop:int, records:np.ndarray) -> np.ndarray:
+    # buffer[:length] with the records [start, stop) replaced. Records appended after all the others are written in the
+    # spare room of the buffer, which was never read, else they are copied once to a new buffer with room to grow:
+    # the views of the records given out before are never changed
+    new_length = length + len(records) - (stop - start)
+    if start == stop == length and new_length <= len(buffer):
+        buffer[length:new_length] = records
+        return buffer
+    spliced = np.empty(new_length + new_length // 2, dtype=buffer.dtype)
+    spliced[:start] = buffer[:start]
+    spliced[start:start + len(records)] = records
+    spliced[start + len(records):new_length] = buffer[stop:length]
+    return spliced
+
+class TrialStore():
+    """
+    Compact store of the trials of a cohort, that can be given to Features
+    instead of a dataset (subject > run > variables).
+
+    All the trials are held in two structured arrays with float32 and int8
+    fields: trials (one record per trial with an RT, in ms) and full (one
+    record per trial of the full trial lists, RT in s). The runs are
+    contiguous, run i owns trials[run_offsets[i]:run_offsets[i + 1]] and
+    full[full_offsets[i]:full_offsets[i + 1]], and the runs of each subject
+    are contiguous too (subject_run_offsets). The time vectors t are not
+    kept, the full RTs are read from them once when the store is built.
+
+    Reading a subject (store[subject][run]) gives views of its variables, so
+    the store can be used where a dataset is expected.
+    """
+
+    def __init__(self, trials:np.ndarray, full:np.ndarray, runs:list[tuple[str, str]], run_offsets:np.ndarray, full_offsets:np.ndarray, kind:str):
+        self.trials = trials
+        self.full = full
+        # trials and full are the first records of these buffers, that may have room for more runs (see _splice_records)
+        self._trial_buffer = trials
+        self._full_buffer = full
+        self.kind = kind # 'acc' (full RTs from the accelerometer) or 'box'
+        self._set_runs(runs, run_offsets, full_offsets)
+
+    def _set_runs(self, runs:list[tuple[str, str]], run_offsets:np.ndarray, full_offsets:np.ndarray):
+        self.runs:list[tuple[str, str]] = [(str(subject), str(run)) for subject, run in runs]
+        self.run_offsets = np.asarray(run_offsets, dtype=np.int64)
+        self.full_offsets = np.asarray(full_offsets, dtype=np.int64)
+        self._positions:dict[tuple[str, str], int] = {key: i for i, key in enumerate(self.runs)}
+
+        self.subjects:list[str] = list(dict.fromkeys(subject for subject, _ in self.runs))
+        subject_index = {subject: i for i, subject in enumerate(self.subjects)}
+        self.run_subject = np.array([subject_index[subject] for subject, _ in self.runs], dtype=np.intp)
+        if np.any(np.diff(self.run_subject) < 0):
+            raise ValueError('The runs of each subject must be contiguous')
+        self.subject_run_offsets = _offsets(np.bincount(self.run_subject, minlength=len(self.subjects)))
+
+    @classmethod
+    @profiled('load')
+    def from_runs(cls, runs:Iterable[tuple[str, str, dict]]) -> 'TrialStore':
+        """
+        Build a store from a stream of runs (e.g. iterate_dataset), only the
+        records of each run are kept.
+
+        Parameters:
+            runs (Iterable[tuple[str, str, dict]]): (subject, run, variables of the run).
+
+        Returns:
+            TrialStore: Store of all the runs, grouped by subject in order of appearance.
+        """
+        records:dict[str, dict[str, tuple]] = dict() # subject > run > (trials, full)
+        kinds = set()
+        for subject, run, data in runs:
+            trials, full, kind = _run_records(data)
+            kinds.add(kind)
+            records.setdefault(str(subject), dict())[str(run)] = (trials, full)
+        if len(kinds) > 1:
+            raise ValueError('Cannot store accelerometer and box runs together')
+
+        keys = [(subject, run) for subject in records for run in records[subject]]
+        parts = [records[subject][run] for subject, run in keys]
+        trials = np.concatenate([part[0] for part in parts]) if parts else np.empty(0, dtype=trial_dtype)
+        full = np.concatenate([part[1] for part in parts]) if parts else np.empty(0, dtype=full_trial_dtype)
+        count(subjects=len(records), runs=len(keys), trials=len(trials))
+        return cls(trials, full, keys, _offsets(len(part[0]) for part in parts), _offsets(len(part[1]) for part in parts), kinds.pop() if kinds else 'acc')
+
+    @classmethod
+    def from_dataset(cls, dataset:dict[str, dict]) -> 'TrialStore':
+        # Store of a dataset (subject > run > variables), e.g. from load_dataset
+        return cls.from_runs((subject, run, dataset[subject][run]) for subject in dataset for run in dataset[subject])
+
+    @property
+    def nbytes(self) -> int:
+        return self.trials.nbytes + self.full.nbytes + self.run_offsets.nbytes + self.full_offsets.nbytes
+
+    def run_slice(self, subject:str, run:str) -> tuple[slice, slice]:
+        # Records of one run in trials and in full
+        i = self._positions[(subject, run)]
+        return slice(self.run_offsets[i], self.run_offsets[i + 1]), slice(self.full_offsets[i], self.full_offsets[i + 1])
+
+    def run(self, subject:str, run:str) -> dict[str, np.ndarray]:
+        # Variables of one run as in a dataset, as views of the store (the time vector t is not kept)
+        trials, full = self.run_slice(subject, run)
+        data = {
+            'rt_acc': self.trials['rt'][trials],
+            'acc_test_type': self.trials['test_type'][trials],
+            'test_type': self.full['test_type'][full],
+        }
+        if self.kind == 'box':
+            data['all_rt_box'] = self.full['rt'][full]
+        else:
+            data['vb_index'] = self.full['vb_index'][full]
+            data['mv_index'] = self.full['mv_index'][full]
+        return data
+
+    # Read-only mapping of subject > run > variables, as a dataset
+    def keys(self) -> list[str]:
+        return list(self.subjects)
+
+    def __iter__(self):
+        return iter(self.subjects)
+
+    def __len__(self) -> int:
+        return len(self.subjects)
+
+    def __contains__(self, subject:str) -> bool:
+        return subject in self.subjects
+
+    def __getitem__(self, subject:str) -> dict[str, dict]:
+        if subject not in self.subjects:
+            raise KeyError(subject)
+        i = self.subjects.index(subject)
+        return {run: self.run(subject, run) for _, run in self.runs[self.subject_run_offsets[i]:self.subject_run_offsets[i + 1]]}
+
+    def _splice(self, start:int, stop:int, keys:list[tuple[str, str]], trials:np.ndarray, full:np.ndarray):
+        # Replace the runs [start, stop) with new runs: appending runs is amortized O(run), other splices copy the records once
+        trial_lengths = np.diff(self.run_offsets)
+        full_lengths = np.diff(self.full_offsets)
+        self._trial_buffer = _splice_records(self._trial_buffer, len(self.trials), self.run_offsets[start], self.run_offsets[stop], trials)
+        self._full_buffer = _splice_records(self._full_buffer, len(self.full), self.full_offsets[start], self.full_offsets[stop], full)
+        self.trials = self._trial_buffer[:len(self.trials) + len(trials) - (self.run_offsets[stop] - self.run_offsets[start])]
+        self.full = self._full_buffer[:len(self.full) + len(full) - (self.full_offsets[stop] - self.full_offsets[start])]
+        new_lengths = [] if len(keys) == 0 else [len(trials)]
+        new_full_lengths = [] if len(keys) == 0 else [len(full)]
+        self._set_runs(self.runs[:start] + keys + self.runs[stop:],
+                       _offsets(np.concatenate((trial_lengths[:start], new_lengths, trial_lengths[stop:]))),
+                       _offsets(np.concatenate((full_lengths[:start], new_full_lengths, full_lengths[stop:]))))
+
+    def set_run(self, subject:str, run:str, data:dict):
+        """
+        Add a run (or replace it), after the other runs of its subject. A run
+        appended after all the others (of the last subject or of a new one) is
+        written in place, in amortized O(run), other runs move the records
+        after them (one copy of the store).
+
+        Parameters:
+            subject (str): Subject code.
+            run (str): Run.
+            data (dict): Variables of the run, as in a dataset.
+        """
+        trials, full, kind = _run_records(data)
+        if kind != self.kind and len(self.runs) > 0:
+            raise ValueError(f"Cannot add a '{kind}' run to a '{self.kind}' store")
+        self.kind = kind
+
+        if (subject, run) in self._positions:
+            i = self._positions[(subject, run)]
+            self._splice(i, i + 1, [(subject, run)], trials, full)
+        elif subject in self.subjects:
+            end = self.subject_run_offsets[self.subjects.index(subject) + 1]
+            self._splice(end, end, [(subject, run)], trials, full)
+        else:
+            self._splice(len(self.runs), len(self.runs), [(subject, run)], trials, full)
+
+    def remove_run(self, subject:str, run:str):
+        # Remove a run, and its subject with its last run
+        i = self._positions[(subject, run)]
+        self._splice(i, i + 1, [], self.trials[:0], self.full[:0])
+
+    def save(self, path:str):
+        # Single .npz file, read back with TrialStore.load
+        np.savez(path, trials=self.trials, full=self.full, runs=np.array(self.runs, dtype=str).reshape(len(self.runs), 2),
+                 run_offsets=self.run_offsets, full_offsets=self.full_offsets, kind=np.array(self.kind))
+
+    @classmethod
+    def load(cls, path:str) -> 'TrialStore':
+        with np.load(path) as stored:
+            return cls(stored['trials'], stored['full'], [tuple(key) for key in stored['runs']], stored['run_offsets'], stored['full_offsets'], str(stored['kind']))
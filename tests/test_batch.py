@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.io import savemat
+
+from Functions.Batch import run_pipeline
+from Functions.Features import Features
+from Functions.Loader import load_store, variables
+from Functions.Synthetic import make_cohort
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture(scope='module')
+def directories(tmp_path_factory) -> tuple[str, str]:
+    # The synthetic cohort written as the .mat files of the recordings
+    folder = tmp_path_factory.mktemp('mat')
+    acc, box = make_cohort(3, n_runs=2, n_trials=60, seed=18)
+    for kind, dataset in (('acc', acc), ('box', box)):
+        os.makedirs(folder / kind)
+        for subject in dataset:
+            for run, data in dataset[subject].items():
+                savemat(folder / kind / f'{subject}_Run{run}.mat', {key: data[key] for key in variables[kind]})
+    return str(folder / 'acc'), str(folder / 'box')
+
+def test_pipeline(directories, tmp_path):
+    acc_dir, box_dir = directories
+    folders = run_pipeline(acc_dir, box_dir, str(tmp_path), only_physiological=True, workers=1, output_formats=('parquet', 'csv'), n_permutations=100, seed=0, use_cache=False)
+    assert set(folders) == {'Accelerometer', 'Box', 'Comparison'}
+    for name in ('Accelerometer', 'Box'):
+        for table in ('single_run_features', 'subject_features_by_type', 'overall_hetero_homo_ratio', 'overall_sequential_effects', 'run_distributions'):
+            for format in ('parquet', 'csv'):
+                assert os.path.exists(os.path.join(folders[name], f'{table}.{format}')), (name, table, format)
+    for table in ('run_paired_differences', 'subject_paired_differences', 'subject_permutations', 'run_permutations'):
+        assert os.path.exists(os.path.join(folders['Comparison'], f'{table}.parquet')), table
+
+    # The exported features are those of the loaded runs
+    for name, kind in (('Accelerometer', 'acc'), ('Box', 'box')):
+        features = Features(load_store(directories[kind == 'box'], kind, workers=1, use_cache=False), True, accelerometer=kind == 'acc')
+        exported = pd.read_parquet(os.path.join(folders[name], 'subject_features.parquet'))
+        assert list(exported['subject']) == list(features.subject_features)
+        np.testing.assert_allclose(exported['median'], [group['median'] for group in features.subject_features.values()], rtol=1e-12)
+        ratio = pd.read_parquet(os.path.join(folders[name], 'overall_hetero_homo_ratio.parquet'))
+        np.testing.assert_allclose(ratio['hetero_homo_ratio'], [features.overall_hetero_homo_ratio], rtol=1e-12)
+    permutations = pd.read_parquet(os.path.join(folders['Comparison'], 'subject_permutations.parquet'))
+    assert len(permutations) == 3 * 4 and permutations['p'].between(0, 1).all()
+
+def test_unknown_format(directories, tmp_path):
+    with pytest.raises(ValueError):
+        run_pipeline(*directories, str(tmp_path), output_formats=('xlsx',))
+
+def test_cli(directories, tmp_path):
+    # Importing the runner does not import the plotting and table libraries
+    modules = subprocess.run([sys.executable, '-c', 'import sys, Functions.Batch; print(sorted(m for m in ("matplotlib", "pandas", "seaborn") if m in sys.modules))'],
+                             capture_output=True, text=True, check=True, cwd=root)
+    assert modules.stdout.strip() == '[]'
+
+    subprocess.run([sys.executable, '-m', 'Functions.Batch', *directories, '--output', str(tmp_path), '--workers', '1', '--formats', 'csv',
+                    '--permutations', '0', '--no-cache', '--profile', str(tmp_path / 'profile.json')], capture_output=True, text=True, check=True, cwd=root)
+    assert os.path.exists(tmp_path / 'Accelerometer' / 'overall_features_by_type.csv')
+    assert os.path.exists(tmp_path / 'Comparison' / 'run_paired_differences.csv')
+    assert not os.path.exists(tmp_path / 'Comparison' / 'run_permutations.csv')
+    assert os.path.exists(tmp_path / 'profile.json')
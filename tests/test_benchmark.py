@@ -0,0 +1,41 @@
+from Functions.Benchmark import compare_results, load_results, run_benchmarks, save_results
+
+
+def _results() -> dict:
+    return run_benchmarks([2, 3], n_runs=1, n_trials=30, n_permutations=10, memory=False,
+                          targets=['calculate_subject_features'], verbose=False)
+
+def test_schema(tmp_path):
+    results = _results()
+    assert set(results) == {'environment', 'parameters', 'results'}
+    assert set(results['environment']) == {'version', 'date', 'python', 'numpy', 'machine', 'system'}
+    assert results['parameters']['sizes'] == [2, 3]
+    targets = {'Features.calculate_subject_features', 'Features.calculate_subject_features_by_type'}
+    assert [(row['subjects'], row['target']) for row in results['results']] == [(size, target) for size in (2, 3) for target in sorted(targets)]
+    for row in results['results']:
+        assert set(row) == {'subjects', 'runs', 'trials', 'target', 'seconds', 'cpu_seconds', 'peak_bytes'}
+        assert row['trials'] == row['subjects'] * 30
+        assert row['seconds'] >= 0 and row['peak_bytes'] is None
+
+    path = tmp_path / 'benchmark.json'
+    save_results(results, path)
+    assert load_results(path) == results
+
+def test_compare():
+    baseline = {'results': [{'subjects': 10, 'target': 'a', 'seconds': 1.0}, {'subjects': 10, 'target': 'b', 'seconds': 1.0},
+                            {'subjects': 10, 'target': 'c', 'seconds': 1.0}]}
+    current = {'results': [{'subjects': 10, 'target': 'a', 'seconds': 2.0}, {'subjects': 10, 'target': 'b', 'seconds': 0.5},
+                           {'subjects': 10, 'target': 'c', 'seconds': 1.1}, {'subjects': 100, 'target': 'a', 'seconds': 1.0}]}
+    comparison = compare_results(baseline, current)
+    assert [row['target'] for row in comparison] == ['a', 'b', 'c']
+    assert [row['status'] for row in comparison] == ['regression', 'improvement', 'unchanged']
+    assert comparison[0]['ratio'] == 2.0
+
+def test_default_targets():
+    # Every discovered method runs on a tiny cohort
+    results = run_benchmarks([2], n_runs=1, n_trials=20, n_permutations=5, memory=False, verbose=False)
+    targets = [row['target'] for row in results['results']]
+    assert 'Features.calculate_all_features' in targets and 'Features.save_all' in targets
+    assert 'FeatureComparator.run_permutations' in targets
+    assert 'Features.calculate_vibration_quality' not in targets
+    assert all(row['seconds'] >= 0 for row in results['results'])
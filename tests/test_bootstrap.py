@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from scipy.stats import bootstrap
+
+from Functions.Bootstrap import bootstrap_ratio
+from Functions.Features import Features
+from Functions.Synthetic import make_cohort
+
+
+def _groups(sizes:list[tuple[int, int]], seed:int = 2) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Values, numerator mask and group (one stratum each) of groups of (numerator, denominator) trials
+    rng = np.random.default_rng(seed)
+    values, numerator, group = [], [], []
+    for i, (n_numerator, n_denominator) in enumerate(sizes):
+        values += [1.1 * rng.lognormal(6, 0.3, n_numerator), rng.lognormal(6, 0.3, n_denominator)]
+        numerator += [np.ones(n_numerator, dtype=bool), np.zeros(n_denominator, dtype=bool)]
+        group.append(np.full(n_numerator + n_denominator, i))
+    return np.concatenate(values), np.concatenate(numerator), np.concatenate(group)
+
+@pytest.mark.parametrize('method', ['percentile', 'bca'])
+def test_scipy(method):
+    # The resamples differ from SciPy's, the bounds only agree within the Monte Carlo error
+    sizes = [(40, 35), (60, 70), (25, 30)]
+    values, numerator, group = _groups(sizes)
+    intervals = bootstrap_ratio(values, numerator, group, [(group, len(sizes))], 20000, method=method, seed=0)[0]
+    for statistic, function in (('mean', np.mean), ('median', np.median)):
+        for i in range(len(sizes)):
+            x, y = values[(group == i) & numerator], values[(group == i) & ~numerator]
+            expected = bootstrap((x, y), lambda x, y, axis: function(x, axis=axis) / function(y, axis=axis), vectorized=True, n_resamples=20000,
+                                 method='BCa' if method == 'bca' else 'percentile', rng=0)
+            low, high = expected.confidence_interval
+            assert intervals[statistic]['ratio'][i] == pytest.approx(function(x) / function(y), rel=1e-12)
+            assert abs(intervals[statistic]['low'][i] - low) < 0.05 * (high - low)
+            assert abs(intervals[statistic]['high'][i] - high) < 0.05 * (high - low)
+
+def test_empty_condition():
+    values, numerator, group = _groups([(30, 30), (20, 0)])
+    intervals = bootstrap_ratio(values, numerator, group, [(group, 3)], 500, seed=0)[0]
+    for statistic in ('mean', 'median'):
+        assert not np.isnan(intervals[statistic]['low'][0])
+        assert np.isnan([intervals[statistic][column][1:] for column in ('ratio', 'low', 'high')]).all()
+
+def test_seed():
+    values, numerator, group = _groups([(30, 30), (20, 25)])
+    first = bootstrap_ratio(values, numerator, group, [(group, 2)], 1000, seed=4, max_memory=2**30)
+    blocked = bootstrap_ratio(values, numerator, group, [(group, 2)], 1000, seed=4, max_memory=1)
+    for statistic in ('mean', 'median'):
+        for column in ('ratio', 'low', 'high'):
+            np.testing.assert_allclose(blocked[0][statistic][column], first[0][statistic][column], rtol=1e-12)
+
+def test_unknown_method():
+    values, numerator, group = _groups([(5, 5)])
+    with pytest.raises(ValueError):
+        bootstrap_ratio(values, numerator, group, [(group, 1)], 10, method='basic')
+
+def test_features():
+    # The estimates of every level are the hetero/homo ratios of the features
+    acc, _ = make_cohort(3, n_runs=2, n_trials=80, seed=6)
+    features = Features(acc, True, accelerometer=True)
+    results = features.bootstrap_hetero_homo_ratio(200, seed=0)
+    mean = results['run'][results['run']['statistic'] == 'mean']
+    np.testing.assert_allclose(mean['ratio'], [features.run_hetero_homo_ratio[row['subject']][row['run']] for row in mean], rtol=1e-12)
+    mean = results['subject'][results['subject']['statistic'] == 'mean']
+    np.testing.assert_allclose(mean['ratio'], [features.subject_hetero_homo_ratio[row['subject']] for row in mean], rtol=1e-12)
+    overall = results['overall'][results['overall']['statistic'] == 'mean']
+    np.testing.assert_allclose(overall['ratio'], [features.overall_hetero_homo_ratio], rtol=1e-12)
+    assert np.all((mean['low'] <= mean['ratio']) & (mean['ratio'] <= mean['high']))
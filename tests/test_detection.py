@@ -0,0 +1,84 @@
+import numpy as np
+
+from Functions.Detection import detect_run, get_segmented_onsets, get_test_type, get_unique_onsets, sampling
+
+
+def _envelope(n:int, bumps:list[tuple[int, int, float]]) -> np.ndarray:
+    # One channel at 0 with a value on [start, stop) for each bump
+    envelope = np.zeros((n, 1))
+    for start, stop, value in bumps:
+        envelope[start:stop, 0] = value
+    return envelope
+
+def test_segmented_onsets():
+    segmentation = np.array([0, 4000, 8000])
+    envelope = _envelope(12000, [(1000, 1100, 1), (3000, 3100, 1), (9000, 9100, 1)])
+    onsets = get_segmented_onsets(envelope, np.array([0.5]), segmentation)
+    # The onset is the last sample at the baseline, the second bump is within the no onset period
+    np.testing.assert_array_equal(onsets[:, 0], [999, -1, 8999])
+
+def test_no_onset_period():
+    segmentation = np.array([0, 4000, 8000])
+    # The no onset period (3600 samples) of the first onset covers the start of the second trial
+    envelope = _envelope(12000, [(1000, 1100, 1), (4200, 4300, 1), (9000, 9100, 1)])
+    onsets = get_segmented_onsets(envelope, np.array([0.5]), segmentation)
+    np.testing.assert_array_equal(onsets[:, 0], [999, -1, 8999])
+    onsets = get_segmented_onsets(envelope, np.array([0.5]), segmentation, no_onset_period_ms=1000)
+    np.testing.assert_array_equal(onsets[:, 0], [999, 4199, 8999])
+
+def test_vibration_reset():
+    segmentation = np.array([0, 4000])
+    # A crossing followed by a negative envelope within the vibration (360 samples) is a movement,
+    # the crossings until the end of its vibration window are ignored
+    envelope = _envelope(8000, [(1000, 1100, 1), (1150, 1200, -1), (1300, 1320, 1), (2000, 2100, 1), (6000, 6100, 1)])
+    onsets = get_segmented_onsets(envelope, np.array([0.5]), segmentation, vibration_time_ms=180)
+    np.testing.assert_array_equal(onsets[:, 0], [1999, 5999])
+    # Without the vibration check, the movement is the onset
+    onsets = get_segmented_onsets(envelope, np.array([0.5]), segmentation)
+    np.testing.assert_array_equal(onsets[:, 0], [999, 5999])
+
+def test_unique_onsets():
+    # FDI channels first, then ADM
+    onsets = np.array([
+        [100, 110, 120, -1], # More FDI channels
+        [-1, 200, 210, 230], # More ADM channels
+        [300, -1, 320, -1], # Tie
+        [-1, -1, -1, -1], # Not found
+    ])
+    np.testing.assert_array_equal(get_unique_onsets(onsets), [[105, -1], [-1, 220], [300, 320], [-1, -1]])
+
+def test_test_type():
+    unique_vb = np.array([[10, -1], [-1, 20], [30, -1], [-1, 40], [50, 55], [-1, -1]])
+    unique_mv = np.array([[-1, 11], [21, -1], [31, -1], [-1, 41], [51, 56], [61, -1]])
+    test_type, vb_index, mv_index = get_test_type(unique_vb, unique_mv)
+    # Both fingers vibrating and moving is type 4, as the last if of the MATLAB function
+    np.testing.assert_array_equal(test_type, [1, 2, 3, 4, 4, -1])
+    np.testing.assert_array_equal(vb_index, [10, 20, 30, 40, 55, -1])
+    np.testing.assert_array_equal(mv_index, [11, 21, 31, 41, 56, -1])
+
+def detection_signal(types:np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # FDI and ADM channel: a 125 Hz burst on the vibrated finger, then a slow movement of the other or same finger
+    rng = np.random.default_rng(0)
+    signal = rng.normal(0, 0.01, (len(types) * 2 * sampling + 1, 2))
+    vb = np.arange(len(types)) * 2 * sampling + 800
+    mv = vb + 600
+    for j, test_type in enumerate(types):
+        signal[vb[j]:vb[j] + 360, 0 if test_type in (1, 3) else 1] += np.sin(2 * np.pi * 125 * np.arange(360) / sampling)
+        signal[mv[j]:mv[j] + 400, 0 if test_type in (2, 3) else 1] += 5 * np.sin(np.pi * np.arange(400) / 400)**2
+    return signal, vb, mv
+
+def test_detect_run():
+    types = np.array([1, 2, 3, 4, 1, 3, 2, 4])
+    signal, vb, mv = detection_signal(types)
+
+    detected = detect_run(signal, triallist=types)
+    np.testing.assert_array_equal(detected['test_type'], types)
+    assert detected['correct_nbr'] == len(types) and detected['incorrect_nbr'] == 0
+    # The onsets are the start of the envelopes, at most 50 ms (the TKEO window) early
+    assert np.all(np.abs(detected['vb_index'] - 1 - vb) <= 100)
+    assert np.all(np.abs(detected['mv_index'] - 1 - mv) <= 100)
+    assert np.all(np.abs(detected['rt_acc'] - 300) <= 50)
+
+    detected = detect_run(signal, triallist=np.roll(types, 1))
+    assert detected['correct_nbr'] == np.count_nonzero(types == np.roll(types, 1))
+    assert len(detected['rt_acc']) == detected['correct_nbr']
@@ -0,0 +1,52 @@
+import numpy as np
+from scipy.stats import exponnorm, skew
+
+from Functions.Distribution import describe_groups, fit_exgaussian
+
+
+# (mu, sigma, tau) in ms, as typical RTs
+parameters = np.array([[400, 40, 80], [300, 20, 150], [500, 60, 40]])
+
+def _exgaussian(n:int, seed:int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    group = np.repeat(np.arange(len(parameters)), n)
+    values = rng.normal(parameters[group, 0], parameters[group, 1]) + rng.exponential(parameters[group, 2])
+    order = rng.permutation(len(values))
+    return group[order], values[order]
+
+def test_recovery():
+    group, values = _exgaussian(20000, seed=0)
+    fit = fit_exgaussian(group, values, len(parameters))
+    assert np.all(fit['converged'])
+    estimated = np.stack([fit['mu'], fit['sigma'], fit['tau']], axis=1)
+    np.testing.assert_allclose(estimated, parameters, rtol=0.08)
+
+def test_scipy_likelihood():
+    group, values = _exgaussian(500, seed=1)
+    fit = fit_exgaussian(group, values, len(parameters))
+    for i in range(len(parameters)):
+        # exponnorm with K = tau / sigma, the maximum is not beaten by the scipy fit
+        log_likelihood = exponnorm.logpdf(values[group == i], fit['tau'][i] / fit['sigma'][i], fit['mu'][i], fit['sigma'][i]).sum()
+        np.testing.assert_allclose(fit['log_likelihood'][i], log_likelihood, rtol=1e-9)
+        K, loc, scale = exponnorm.fit(values[group == i])
+        assert exponnorm.logpdf(values[group == i], K, loc, scale).sum() <= log_likelihood + 1e-6
+
+def test_small_groups():
+    group, values = _exgaussian(9, seed=2)
+    # Group 3 is empty, values with index n_groups and NaN are ignored
+    group = np.append(group, [4, 0])
+    values = np.append(values, [1000, np.nan])
+    fit = fit_exgaussian(group, values, 4)
+    assert np.all(np.isnan(fit['mu'])) and not np.any(fit['converged'])
+
+def test_describe():
+    group, values = _exgaussian(200, seed=3)
+    description = describe_groups(np.append(group, 4), np.append(values, 1.0), 4)
+    for i in range(len(parameters)):
+        selected = values[group == i]
+        assert description['n'][i] == 200
+        np.testing.assert_allclose(description['mean'][i], selected.mean())
+        np.testing.assert_allclose(description['std'][i], selected.std())
+        np.testing.assert_allclose(description['skewness'][i], skew(selected))
+        np.testing.assert_allclose([description[f'q{q}'][i] for q in (10, 25, 50, 75, 90)], np.quantile(selected, [0.1, 0.25, 0.5, 0.75, 0.9]))
+    assert description['n'][3] == 0 and np.isnan(description['mean'][3]) and np.isnan(description['q50'][3])
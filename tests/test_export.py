@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Functions.Features import Features
+from Functions.Synthetic import make_cohort
+
+
+statistics = ['mean', 'median', 'std', 'min', 'max']
+
+# Columns and dtypes of every table, before the statistics and the sequential effects
+schema = {
+    'single_run_features': {'subject': 'string', 'run': 'string'},
+    'single_run_features_by_type': {'subject': 'string', 'run': 'string', 'test_type': 'int64'},
+    'run_hetero_homo_ratio': {'subject': 'string', 'run': 'string', 'hetero_homo_ratio': 'float64'},
+    'subject_features': {'subject': 'string'},
+    'subject_features_by_type': {'subject': 'string', 'test_type': 'int64'},
+    'subject_hetero_homo_ratio': {'subject': 'string', 'hetero_homo_ratio': 'float64'},
+    'overall_features': {},
+    'overall_features_by_type': {'test_type': 'int64'},
+    'overall_hetero_homo_ratio': {'hetero_homo_ratio': 'float64'},
+}
+sequential_schema = {'transition': 'category', 'previous_type': 'Int64', 'current_type': 'Int64', 'count': 'int64', **{s: 'float64' for s in statistics}}
+
+def _expected_schema(name:str) -> dict:
+    columns = dict(schema[name])
+    if 'hetero_homo_ratio' not in columns:
+        columns.update({s: 'float64' for s in statistics})
+    if name.endswith('_by_type'):
+        columns['normality'] = 'category'
+    return columns
+
+@pytest.fixture(scope='module')
+def features() -> Features:
+    acc, _ = make_cohort(4, n_runs=2, n_trials=60, seed=4)
+    return Features(acc, True, accelerometer=True)
+
+def test_schema(features):
+    tables = features.get_tables(trials=True)
+    assert set(tables) == set(schema) | {'run_sequential_effects', 'subject_sequential_effects', 'overall_sequential_effects', 'trials'}
+    for name in schema:
+        assert {column: str(dtype) for column, dtype in tables[name].dtypes.items()} == _expected_schema(name), name
+    for name, keys in [('run_sequential_effects', {'subject': 'string', 'run': 'string'}), ('subject_sequential_effects', {'subject': 'string'}), ('overall_sequential_effects', {})]:
+        assert {column: str(dtype) for column, dtype in tables[name].dtypes.items()} == {**keys, **sequential_schema}, name
+    assert {column: str(dtype) for column, dtype in tables['trials'].dtypes.items()} == {'subject': 'string', 'run': 'string', 'trial': 'int64', 'test_type': 'int64', 'rt_s': 'float64'}
+
+def test_values(features):
+    # Every row is the feature it was built from, and every group has its row
+    tables = features.get_tables(trials=True)
+    by_type = tables['single_run_features_by_type']
+    expected = [(subject, run, t) for subject in features.single_run_features_by_type for run in features.single_run_features_by_type[subject]
+                for t in features.single_run_features_by_type[subject][run] if t not in ('RT', 'test_type')]
+    assert list(zip(by_type['subject'], by_type['run'], by_type['test_type'])) == expected
+    for row in by_type.itertuples(index=False):
+        group = features.single_run_features_by_type[row.subject][row.run][row.test_type]
+        np.testing.assert_allclose([getattr(row, s) for s in statistics], [group[s] for s in statistics], rtol=0)
+        assert row.normality == group['normality']
+
+    for row in tables['subject_hetero_homo_ratio'].itertuples(index=False):
+        np.testing.assert_allclose(row.hetero_homo_ratio, features.subject_hetero_homo_ratio[row.subject], rtol=0)
+    np.testing.assert_allclose(tables['overall_features'].loc[0, statistics].to_numpy(float), [features.overall_features[s] for s in statistics], rtol=0)
+
+    trials = tables['trials']
+    for subject in features.single_run_features_by_type:
+        for run, groups in features.single_run_features_by_type[subject].items():
+            rows = trials[(trials['subject'] == subject) & (trials['run'] == run)]
+            np.testing.assert_array_equal(rows['rt_s'], np.ravel(groups['RT']))
+            np.testing.assert_array_equal(rows['test_type'], np.ravel(groups['test_type']))
+            np.testing.assert_array_equal(rows['trial'], np.arange(len(rows)))
+
+def test_trials_not_kept():
+    # A stream only keeps the trials with keep_rt
+    acc, _ = make_cohort(2, n_runs=1, n_trials=40, seed=4)
+    features = Features.from_stream([(subject, run, acc[subject][run]) for subject in acc for run in acc[subject]], accelerometer=True)
+    with pytest.raises(ValueError):
+        features.get_tables(trials=True)
+
+@pytest.mark.parametrize('format', ['parquet', 'arrow', 'csv'])
+def test_round_trip(features, format, tmp_path):
+    features.save_all(str(tmp_path), format, trials=True)
+    tables = features.get_tables(trials=True)
+    assert sorted(os.listdir(tmp_path)) == sorted(f'{name}.{format}' for name in tables)
+    for name, table in tables.items():
+        path = os.path.join(tmp_path, f'{name}.{format}')
+        if format == 'parquet':
+            # The binary formats keep the dtypes
+            pd.testing.assert_frame_equal(pd.read_parquet(path), table, obj=name)
+        elif format == 'arrow':
+            pd.testing.assert_frame_equal(pd.read_feather(path), table, obj=name)
+        else:
+            pd.testing.assert_frame_equal(pd.read_csv(path, dtype={column: str(dtype) for column, dtype in table.dtypes.items()}), table, obj=name, check_exact=False, rtol=1e-15)
+
+def test_unknown_format(features, tmp_path):
+    with pytest.raises(ValueError):
+        features.save_all(str(tmp_path), 'xlsx')
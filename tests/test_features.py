@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from Functions.Features import Features
+from Functions.Synthetic import make_cohort
+
+
+statistics = ['mean', 'median', 'std', 'min', 'max']
+
+def _features(rt:np.ndarray) -> dict:
+    # Features of a group as the per-run loops computed them, NaN for an empty group
+    rt = np.array([np.nan]) if len(rt) == 0 else rt
+    with np.errstate(invalid='ignore'):
+        return {'mean': np.mean(rt), 'median': np.median(rt), 'std': np.std(rt), 'min': np.min(rt), 'max': np.max(rt), 'rt_acc': rt}
+
+def _ratio(rt:np.ndarray, test_type:np.ndarray) -> float:
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hetero, homo = rt[np.isin(test_type, Features.hetero_types)], rt[np.isin(test_type, Features.homo_types)]
+        return (np.sum(hetero) / len(hetero)) / (np.sum(homo) / len(homo))
+
+def _reference(dataset:dict, only_physiological:bool) -> dict:
+    # Every level from a loop over the runs, as before the trial table
+    levels = {name: dict() for name in ['single_run_features', 'single_run_features_by_type', 'run_hetero_homo_ratio', 'subject_features',
+                                        'subject_features_by_type', 'subject_hetero_homo_ratio']}
+    all_rt, all_types, all_test_types = [], [], []
+    for subject in dataset:
+        subject_rt, subject_types, subject_test_types = [], [], []
+        for run in dataset[subject]:
+            rt = np.ravel(dataset[subject][run]['rt_acc']).astype(float)
+            types = np.ravel(dataset[subject][run]['acc_test_type'])
+            if only_physiological:
+                kept = (rt > Features.lower_limit) & (rt < Features.upper_limit)
+                rt, types = rt[kept], types[kept]
+            test_types = np.unique(dataset[subject][run]['test_type'])
+            test_types = test_types[test_types > 0]
+
+            levels['single_run_features'].setdefault(subject, dict())[run] = _features(rt)
+            levels['single_run_features_by_type'].setdefault(subject, dict())[run] = {t: _features(rt[types == t]) for t in test_types}
+            levels['run_hetero_homo_ratio'].setdefault(subject, dict())[run] = _ratio(rt, types)
+            subject_rt.append(rt)
+            subject_types.append(types)
+            subject_test_types.append(test_types)
+
+        rt, types, test_types = np.concatenate(subject_rt), np.concatenate(subject_types), np.unique(np.concatenate(subject_test_types))
+        levels['subject_features'][subject] = _features(rt)
+        levels['subject_features_by_type'][subject] = {t: _features(rt[types == t]) for t in test_types}
+        levels['subject_hetero_homo_ratio'][subject] = _ratio(rt, types)
+        all_rt.append(rt)
+        all_types.append(types)
+        all_test_types.append(test_types)
+
+    rt, types, test_types = np.concatenate(all_rt), np.concatenate(all_types), np.unique(np.concatenate(all_test_types))
+    levels['overall_features'] = _features(rt)
+    levels['overall_features_by_type'] = {t: _features(rt[types == t]) for t in test_types}
+    levels['overall_hetero_homo_ratio'] = _ratio(rt, types)
+    return levels
+
+def _assert_same_features(features:dict, expected:dict, path:str):
+    for statistic in statistics:
+        np.testing.assert_allclose(features[statistic], expected[statistic], rtol=1e-12, err_msg=f'{path}/{statistic}')
+    np.testing.assert_allclose(features['rt_acc'], expected['rt_acc'], rtol=0, err_msg=f'{path}/rt_acc')
+
+@pytest.mark.parametrize('only_physiological', [False, True])
+def test_levels(only_physiological):
+    # Missing trials, incorrect answers and RTs out of the limits, and a run without any valid RT
+    acc, _ = make_cohort(6, n_runs=3, n_trials=80, acc_missing=0.1, incorrect=0.05, seed=11)
+    acc['X00001']['2']['rt_acc'] = acc['X00001']['2']['rt_acc'] + 1000.0
+    features = Features(acc, only_physiological, accelerometer=True)
+    expected = _reference(acc, only_physiological)
+
+    for subject in acc:
+        for run in acc[subject]:
+            _assert_same_features(features.single_run_features[subject][run], expected['single_run_features'][subject][run], f'{subject}/{run}')
+            by_type = features.single_run_features_by_type[subject][run]
+            assert set(by_type) - {'RT', 'test_type'} == set(expected['single_run_features_by_type'][subject][run])
+            for t, reference in expected['single_run_features_by_type'][subject][run].items():
+                _assert_same_features(by_type[t], reference, f'{subject}/{run}/{t}')
+            np.testing.assert_allclose(features.run_hetero_homo_ratio[subject][run], expected['run_hetero_homo_ratio'][subject][run], rtol=1e-12)
+
+        _assert_same_features(features.subject_features[subject], expected['subject_features'][subject], subject)
+        by_type = features.subject_features_by_type[subject]
+        assert set(by_type) - {'RT', 'test_type'} == set(expected['subject_features_by_type'][subject])
+        for t, reference in expected['subject_features_by_type'][subject].items():
+            _assert_same_features(by_type[t], reference, f'{subject}/{t}')
+        np.testing.assert_allclose(features.subject_hetero_homo_ratio[subject], expected['subject_hetero_homo_ratio'][subject], rtol=1e-12)
+
+    _assert_same_features(features.overall_features, expected['overall_features'], 'overall')
+    assert set(features.overall_features_by_type) - {'RT', 'test_type'} == set(expected['overall_features_by_type'])
+    for t, reference in expected['overall_features_by_type'].items():
+        _assert_same_features(features.overall_features_by_type[t], reference, f'overall/{t}')
+    np.testing.assert_allclose(features.overall_hetero_homo_ratio, expected['overall_hetero_homo_ratio'], rtol=1e-12)
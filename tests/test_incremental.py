@@ -0,0 +1,141 @@
+import copy
+
+import numpy as np
+import pytest
+
+from Functions.Features import Features, TrialTable
+from Functions.Synthetic import make_cohort
+from Functions.TrialStore import TrialStore
+
+
+levels = ['single_run_features', 'single_run_features_by_type', 'subject_features', 'subject_features_by_type', 'overall_features',
+          'overall_features_by_type', 'run_hetero_homo_ratio', 'subject_hetero_homo_ratio', 'overall_hetero_homo_ratio']
+
+def _assert_same(a, b, path:str = ''):
+    if isinstance(b, dict):
+        assert set(a) == set(b), path
+        for key in b:
+            _assert_same(a[key], b[key], f'{path}/{key}')
+    elif isinstance(b, str):
+        assert a == b, path
+    else:
+        np.testing.assert_allclose(np.asarray(a, dtype=float), np.asarray(b, dtype=float), rtol=1e-9, err_msg=path)
+
+def _assert_same_table(table:TrialTable, expected:TrialTable):
+    assert table.runs == expected.runs and table.subjects == expected.subjects
+    np.testing.assert_array_equal(table.run_has_type, expected.run_has_type)
+    np.testing.assert_array_equal(table.rt_acc, expected.rt_acc)
+    for name in ['run_offsets', 'subject_run_offsets', 'run_index', 'type_index', 'positions', 'cell_offsets']:
+        np.testing.assert_array_equal(getattr(table.index, name), getattr(expected.index, name), err_msg=name)
+    np.testing.assert_array_equal(table.valid_trials.positions, expected.valid_trials.positions)
+
+def _operations(acc:dict) -> list[tuple]:
+    # New runs of a subject and new subjects, a replaced run, removed runs and a removed subject
+    subjects = list(acc)
+    operations = [('add', subject, run, acc[subject][run]) for subject in subjects[8:11] for run in acc[subject]]
+    operations += [('add', subjects[0], '2', acc[subjects[11]]['1']), ('remove', subjects[1], '3', None)]
+    operations += [('remove', subjects[2], run, None) for run in ['1', '2', '3']]
+    return operations
+
+@pytest.mark.parametrize('only_physiological', [False, True])
+@pytest.mark.parametrize('use_store', [False, True])
+def test_add_remove(only_physiological, use_store):
+    acc, _ = make_cohort(12, n_runs=3, n_trials=60, seed=3)
+    subjects = list(acc)
+    final = {subject: dict(acc[subject]) for subject in subjects[:8]}
+    dataset = TrialStore.from_dataset(final) if use_store else copy.deepcopy(final)
+    features = Features(dataset, only_physiological, accelerometer=True)
+    features.calculate_all_features()
+    table = features.trials
+
+    for i, (operation, subject, run, data) in enumerate(_operations(acc)):
+        if operation == 'add':
+            features.add_run(subject, run, data)
+            final.setdefault(subject, dict())[run] = data
+        else:
+            features.remove_run(subject, run)
+            del final[subject][run]
+            if len(final[subject]) == 0:
+                del final[subject]
+        if i % 2 == 0:
+            # Read the levels in between, so that the overall RTs are spliced by the next operations
+            features.overall_features_by_type
+
+    expected = Features(TrialStore.from_dataset(final) if use_store else copy.deepcopy(final), only_physiological, accelerometer=True)
+    for level in levels:
+        _assert_same(getattr(features, level), getattr(expected, level), level)
+    # The trial table was spliced, not built again, and so were the full trials of the other levels
+    assert features.trials is table
+    _assert_same_table(features.trials, expected.trials)
+    _assert_same(features.overall_sequential_effects, expected.overall_sequential_effects)
+
+def test_new_test_type():
+    # A run with a test type the table does not have builds the table again
+    acc, _ = make_cohort(3, n_runs=1, n_trials=40, seed=5)
+    features = Features({subject: dict(acc[subject]) for subject in ['X00000', 'X00001']}, accelerometer=True)
+    features.calculate_all_features()
+    data = copy.deepcopy(acc['X00002']['1'])
+    data['test_type'] = np.where(data['test_type'] == 4, 5, data['test_type'])
+    data['acc_test_type'] = np.where(data['acc_test_type'] == 4, 5, data['acc_test_type'])
+    features.add_run('X00002', '1', data)
+
+    expected = Features({'X00000': acc['X00000'], 'X00001': acc['X00001'], 'X00002': {'1': data}}, accelerometer=True)
+    for level in levels:
+        _assert_same(getattr(features, level), getattr(expected, level), level)
+    _assert_same_table(features.trials, expected.trials)
+
+def test_stream():
+    acc, _ = make_cohort(12, n_runs=3, n_trials=60, seed=3)
+    subjects = list(acc)
+    final = {subject: dict(acc[subject]) for subject in subjects[:8]}
+    features = Features.from_stream([(subject, run, final[subject][run]) for subject in final for run in final[subject]], accelerometer=True, keep_rt=True)
+    for operation, subject, run, data in _operations(acc):
+        if operation == 'add':
+            features.add_run(subject, run, data)
+            final.setdefault(subject, dict())[run] = data
+        else:
+            features.remove_run(subject, run)
+            del final[subject][run]
+            if len(final[subject]) == 0:
+                del final[subject]
+        features.overall_features
+
+    expected = Features(copy.deepcopy(final), accelerometer=True)
+    for level in levels:
+        _assert_same(getattr(features, level), getattr(expected, level), level)
+
+@pytest.mark.parametrize('only_physiological', [False, True])
+def test_from_stream(only_physiological):
+    acc, _ = make_cohort(6, n_runs=3, n_trials=120, seed=8)
+    runs = ((subject, run, acc[subject][run]) for subject in acc for run in acc[subject])
+    features = Features.from_stream(runs, only_physiological, accelerometer=True)
+    expected = Features(acc, only_physiological, accelerometer=True)
+    assert len(features.dataset) == 0
+    with pytest.raises(RuntimeError):
+        features.trials
+
+    # The runs are exact, the medians above them are estimated within 0.1%, and no raw RTs are kept
+    _assert_same(features.run_hetero_homo_ratio, expected.run_hetero_homo_ratio)
+    for subject in acc:
+        for run in acc[subject]:
+            reference = {key: value for key, value in expected.single_run_features[subject][run].items() if key != 'rt_acc'}
+            _assert_same(features.single_run_features[subject][run], reference)
+    groups = [(features.overall_features, expected.overall_features)]
+    groups += [(features.overall_features_by_type[t], expected.overall_features_by_type[t]) for t in expected.trials.test_types]
+    for subject in acc:
+        groups.append((features.subject_features[subject], expected.subject_features[subject]))
+        groups += [(features.subject_features_by_type[subject][t], expected.subject_features_by_type[subject][t]) for t in expected.trials.test_types]
+    for streamed, reference in groups:
+        assert 'rt_acc' not in streamed
+        for statistic in ['mean', 'std', 'min', 'max']:
+            np.testing.assert_allclose(streamed[statistic], reference[statistic], rtol=1e-9)
+        assert abs(streamed['median'] - reference['median']) <= 1e-3 * abs(reference['median'])
+    assert features.overall_features_by_type[1]['normality'] == 'Not tested'
+    _assert_same(features.overall_hetero_homo_ratio, expected.overall_hetero_homo_ratio)
+
+def test_from_stream_keep_rt():
+    acc, _ = make_cohort(6, n_runs=3, n_trials=120, seed=8)
+    features = Features.from_stream([(subject, run, acc[subject][run]) for subject in acc for run in acc[subject]], True, accelerometer=True, keep_rt=True)
+    expected = Features(acc, True, accelerometer=True)
+    for level in levels:
+        _assert_same(getattr(features, level), getattr(expected, level), level)
@@ -0,0 +1,87 @@
+import copy
+
+import numpy as np
+import pytest
+
+from Functions.Features import FeatureComparator, Features, TrialJoin
+from Functions.Synthetic import make_cohort
+from tests.test_trial_store import _full_rt
+
+
+test_types = [1, 2, 3, 4]
+
+def _cohorts() -> tuple[dict, dict]:
+    # A run and a subject only in one dataset, and a box run shorter than its accelerometer run
+    acc, box = make_cohort(4, n_runs=2, n_trials=80, acc_missing=0.1, box_missing=0.1, seed=16)
+    acc, box = copy.deepcopy(acc), copy.deepcopy(box)
+    subjects = list(acc)
+    del box[subjects[0]]['2']
+    del box[subjects[3]]
+    short = box[subjects[1]]['1']
+    short['all_rt_box'] = short['all_rt_box'][..., :70]
+    short['test_type'] = short['test_type'][..., :70]
+    return acc, box
+
+def _naive_join(acc:dict, box:dict) -> list[tuple]:
+    # (subject, run, trial, test type, acc RT, box RT) of every trial of the runs of both datasets, matched by position
+    rows = []
+    for subject in acc:
+        for run in acc[subject]:
+            if subject not in box or run not in box[subject]:
+                continue
+            rt_acc = _full_rt(acc[subject][run]['vb_index'], acc[subject][run]['mv_index'], acc[subject][run]['t'])
+            rt_box = [np.nan if rt == -1 else rt for rt in np.ravel(box[subject][run]['all_rt_box'])]
+            test_type = np.ravel(acc[subject][run]['test_type'])
+            for trial in range(min(len(rt_acc), len(rt_box))):
+                rows.append((subject, run, trial, int(test_type[trial]), rt_acc[trial], rt_box[trial]))
+    return rows
+
+def test_join():
+    acc, box = _cohorts()
+    join = TrialJoin(Features(acc, accelerometer=True), Features(box), test_types)
+    rows = _naive_join(acc, box)
+    assert [(join.runs[i][0], join.runs[i][1], int(trial)) for i, trial in zip(join.run_index, join.trial)] == [row[:3] for row in rows]
+    np.testing.assert_array_equal(join.test_type, [row[3] for row in rows])
+    np.testing.assert_array_equal(join.rt_acc, [row[4] for row in rows])
+    np.testing.assert_array_equal(join.rt_box, [row[5] for row in rows])
+    np.testing.assert_array_equal(join.paired, [not np.isnan(row[4]) and not np.isnan(row[5]) for row in rows])
+
+    # The rows of a test type in some runs are the matching trials, in order
+    for i, (subject, run) in enumerate(join.runs):
+        for test_type in test_types:
+            expected = [k for k, row in enumerate(rows) if row[:2] == (subject, run) and row[3] == test_type]
+            np.testing.assert_array_equal(join.run_rows(i, test_type), expected)
+    for i, subject in enumerate(join.subjects):
+        expected = [k for k, row in enumerate(rows) if row[0] == subject and row[3] == 2]
+        np.testing.assert_array_equal(join.subject_rows(i, 2), expected)
+
+@pytest.mark.parametrize('level', ['run', 'subject'])
+def test_paired_differences(level):
+    acc, box = _cohorts()
+    comparator = FeatureComparator(Features(acc, accelerometer=True), Features(box))
+    results = comparator.calculate_paired_differences(level)
+
+    # One row per group and test type, in the order of the trials, also without any paired trial
+    groups = dict()
+    for subject, run, _, test_type, rt_acc, rt_box in _naive_join(acc, box):
+        group = groups.setdefault((subject, run if level == 'run' else ''), {t: [] for t in test_types})
+        if not np.isnan(rt_acc) and not np.isnan(rt_box):
+            group[test_type].append((rt_box - rt_acc) * 1000)
+    assert [(row['subject'], row['run'], row['test_type']) for row in results] == [key + (t,) for key in groups for t in test_types]
+    for row in results:
+        differences = groups[(row['subject'], row['run'])][row['test_type']]
+        assert row['n'] == len(differences)
+        if len(differences):
+            np.testing.assert_allclose([row['mean'], row['median'], row['std']], [np.mean(differences), np.median(differences), np.std(differences)], rtol=1e-9)
+        else:
+            assert np.isnan([row['mean'], row['median'], row['std']]).all()
+
+def test_correlation():
+    acc, box = _cohorts()
+    comparator = FeatureComparator(Features(acc, accelerometer=True), Features(box))
+    rows = _naive_join(acc, box)
+    for i, (subject, run) in enumerate(comparator.join.runs):
+        for test_type in test_types:
+            pairs = np.array([row[4:] for row in rows if row[:2] == (subject, run) and row[3] == test_type and not np.isnan(row[4]) and not np.isnan(row[5])])
+            correlation = comparator._calculate_correlation(comparator.join.run_rows(i, test_type))
+            np.testing.assert_allclose(correlation, np.corrcoef(pairs[:, 0], pairs[:, 1])[0, 1], rtol=1e-12)
@@ -0,0 +1,101 @@
+import copy
+
+import pytest
+
+from Functions.Features import Features
+from Functions.Synthetic import make_cohort
+from tests.test_incremental import _assert_same, levels
+
+
+calculators = ['calculate_single_run_features', 'calculate_single_run_features_by_type', 'calculate_subject_features', 'calculate_subject_features_by_type',
+               'calculate_overall_features', 'calculate_overall_features_by_type', 'calculate_sequential_effects']
+
+@pytest.fixture
+def calls(monkeypatch) -> list[str]:
+    # Names of the calculate_* methods run, in order
+    calls = []
+    for name in calculators:
+        def calculate(self, *args, _name=name, _calculate=getattr(Features, name), **kwargs):
+            calls.append(_name)
+            return _calculate(self, *args, **kwargs)
+        monkeypatch.setattr(Features, name, calculate)
+    return calls
+
+@pytest.fixture
+def cohort() -> dict:
+    acc, _ = make_cohort(5, n_runs=2, n_trials=80, seed=9)
+    return acc
+
+def test_only_what_is_read(cohort, calls):
+    features = Features(cohort, accelerometer=True)
+    assert calls == []
+    features.subject_features_by_type
+    assert calls == ['calculate_subject_features_by_type']
+    # Memoized, and so is the ratio computed with it
+    first = features.subject_features_by_type
+    features.subject_hetero_homo_ratio
+    assert features.subject_features_by_type is first
+    assert calls == ['calculate_subject_features_by_type']
+
+def test_comparator_without_calculate(cohort):
+    # The comparator reads the overall test types of features nobody calculated
+    from Functions.Features import FeatureComparator
+    _, box = make_cohort(5, n_runs=2, n_trials=80, seed=9)
+    comparator = FeatureComparator(Features(cohort, accelerometer=True), Features(box))
+    assert comparator.test_types == [1, 2, 3, 4]
+
+@pytest.mark.parametrize('setting, value', [('only_physiological', True), ('lower_limit', 300), ('upper_limit', 500)])
+def test_settings(cohort, calls, setting, value):
+    # The limits only matter with only_physiological
+    features = Features(cohort, setting != 'only_physiological', accelerometer=True)
+    expected = Features(cohort, True, accelerometer=True)
+    setattr(expected, setting, value)
+    expected = {level: getattr(expected, level) for level in levels}
+    for level in levels:
+        getattr(features, level)
+    calls.clear()
+
+    setattr(features, setting, value)
+    for level in levels:
+        _assert_same(getattr(features, level), expected[level], level)
+    # Each level read computed again, once
+    assert sorted(calls) == sorted(calculators[:-1])
+
+def test_same_settings(cohort, calls):
+    features = Features(cohort, True, accelerometer=True)
+    features.overall_features
+    features.only_physiological = True
+    features.lower_limit = Features.lower_limit
+    features.overall_features
+    assert calls == ['calculate_overall_features']
+
+def test_accelerometer(cohort, calls):
+    # Only the levels by type use the full trials of one device
+    _, box = make_cohort(5, n_runs=2, n_trials=80, seed=9)
+    both = {subject: {run: {**box[subject][run], **cohort[subject][run]} for run in cohort[subject]} for subject in cohort}
+    features = Features(both, accelerometer=True)
+    features.overall_features
+    features.overall_features_by_type
+    calls.clear()
+    features.accelerometer = False
+    features.overall_features
+    features.overall_features_by_type
+    assert calls == ['calculate_overall_features_by_type']
+
+def test_dataset(cohort, calls):
+    smaller = {subject: dict(cohort[subject]) for subject in list(cohort)[:3]}
+    expected = Features(smaller, accelerometer=True).overall_features
+    features = Features(copy.deepcopy(cohort), accelerometer=True)
+    features.overall_features
+    calls.clear()
+    features.dataset = smaller
+    _assert_same(features.overall_features, expected)
+    assert calls == ['calculate_overall_features']
+
+    # Changed in place, then invalidated
+    smaller[list(smaller)[0]]['1'] = cohort[list(cohort)[4]]['1']
+    expected = Features(copy.deepcopy(smaller), accelerometer=True).overall_features
+    calls.clear()
+    features.invalidate()
+    _assert_same(features.overall_features, expected)
+    assert calls == ['calculate_overall_features']
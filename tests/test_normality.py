@@ -0,0 +1,78 @@
+import numpy as np
+from scipy.stats import shapiro
+
+from Functions import Normality
+from Functions.Normality import NormalityCache, shapiro_groups
+
+
+def _groups() -> list[np.ndarray]:
+    rng = np.random.default_rng(0)
+    return [rng.normal(size=30), rng.exponential(size=50), np.array([1.0, 2.0]), rng.normal(size=20)]
+
+def test_results():
+    groups = _groups()
+    results = shapiro_groups(groups, cache=None)
+    np.testing.assert_array_equal(results['n'], [30, 50, 2, 20])
+    for i in (0, 1, 3):
+        assert (results['W'][i], results['p'][i]) == tuple(float(value) for value in shapiro(groups[i]))
+    assert np.isnan(results['p'][2]) and results['verdict'][2] == 'Not enough data'
+    assert results['verdict'][1] == 'No'
+
+def test_cache_hit(monkeypatch):
+    groups = _groups()
+    cache = NormalityCache()
+    first = shapiro_groups(groups, cache=cache)
+    assert len(cache) == 3
+
+    # The groups are only tested once, the hits give the same (W, p) for any alpha
+    def untested(groups):
+        assert len(groups) == 0, 'A cached group was tested again'
+        return []
+    monkeypatch.setattr(Normality, '_shapiro_chunk', untested)
+    second = shapiro_groups([group.copy() for group in groups], alpha=0.01, cache=cache)
+    np.testing.assert_array_equal(second['W'], first['W'])
+    np.testing.assert_array_equal(second['p'], first['p'])
+    np.testing.assert_array_equal(second['verdict'][[0, 2, 3]], first['verdict'][[0, 2, 3]])
+
+def test_duplicates():
+    group = np.random.default_rng(1).normal(size=25)
+    cache = NormalityCache()
+    results = shapiro_groups([group, group.copy(), group[::-1]], cache=cache)
+    # The same values in another order are another group
+    assert len(cache) == 2
+    assert results['W'][0] == results['W'][1]
+
+def test_eviction_and_save(tmp_path):
+    groups = _groups()
+    cache = NormalityCache(max_size=2)
+    shapiro_groups(groups, cache=cache)
+    # The least recently used result is dropped
+    assert len(cache) == 2
+    assert cache.get(Normality._digest(groups[0])) is None
+    assert cache.get(Normality._digest(groups[3])) is not None
+
+    cache.save(tmp_path / 'cache.npz')
+    loaded = NormalityCache()
+    loaded.load(tmp_path / 'cache.npz')
+    assert len(loaded) == 2
+    assert loaded.get(Normality._digest(groups[1])) == cache.get(Normality._digest(groups[1]))
+    loaded.load(tmp_path / 'missing.npz')
+    assert len(loaded) == 2
+
+def test_pool(monkeypatch):
+    groups = _groups()
+    serial = shapiro_groups(groups, cache=None)
+    # Below min_pool_work the groups are tested in this process
+    monkeypatch.setattr(Normality, '_get_executor', None)
+    np.testing.assert_array_equal(shapiro_groups(groups, workers=2, cache=None)['W'], serial['W'])
+    monkeypatch.undo()
+
+    monkeypatch.setattr(Normality, 'min_pool_work', 0)
+    first = shapiro_groups(groups, workers=2, cache=None)
+    executor = Normality._executor
+    second = shapiro_groups(groups, workers=2, cache=None)
+    # One pool for all the calls with the same workers
+    assert Normality._executor is executor
+    for results in (first, second):
+        for field in ('n', 'W', 'p', 'verdict'):
+            np.testing.assert_array_equal(results[field], serial[field])
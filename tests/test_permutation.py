@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from scipy.stats import permutation_test
+
+from Functions.Permutation import permutation_correlation
+
+
+def _pairs(n:int, n_pairs:int = 4, seed:int = 0) -> list[tuple[np.ndarray, np.ndarray]]:
+    rng = np.random.default_rng(seed)
+    pairs = [(rng.normal(size=n), rng.normal(size=n)) for _ in range(n_pairs - 1)]
+    # One strongly correlated pair, for a small p-value
+    x = rng.normal(size=n)
+    return pairs + [(x, x + 0.2 * rng.normal(size=n))]
+
+def _correlation(x, y, axis=-1):
+    x = x - x.mean(axis=axis, keepdims=True)
+    y = y - y.mean(axis=axis, keepdims=True)
+    return (x * y).sum(axis=axis) / np.sqrt((x * x).sum(axis=axis) * (y * y).sum(axis=axis))
+
+def _scipy(pairs:list, n_permutations:int, permutation_type:str) -> tuple[np.ndarray, np.ndarray]:
+    results = [permutation_test(pair, _correlation, permutation_type=permutation_type, n_resamples=n_permutations,
+                                vectorized=True, alternative='two-sided', rng=0) for pair in pairs]
+    return np.array([result.statistic for result in results]), np.array([result.pvalue for result in results])
+
+@pytest.mark.parametrize('permutation_type', ['pairings', 'independent'])
+def test_exact(permutation_type):
+    # 5 values: 120 pairings, (5!)^2 = 14400 orders for SciPy, or 252 splits, so both tests are exact
+    pairs = _pairs(5)
+    r, p = permutation_correlation(pairs, 20000, seed=0, permutation_type=permutation_type)
+    expected_r, expected_p = _scipy(pairs, 20000, permutation_type)
+    np.testing.assert_allclose(r, expected_r, rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(p, expected_p, rtol=1e-12)
+
+@pytest.mark.parametrize('permutation_type', ['pairings', 'independent'])
+def test_sampled(permutation_type):
+    # The random permutations differ from SciPy's, the p-values only agree within the Monte Carlo error
+    pairs = _pairs(30)
+    r, p = permutation_correlation(pairs, 20000, seed=0, permutation_type=permutation_type)
+    expected_r, expected_p = _scipy(pairs, 20000, permutation_type)
+    np.testing.assert_allclose(r, expected_r, rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(p, expected_p, atol=0.03)
+    # No permuted correlation is as large, the smallest two-sided p-value
+    assert p[-1] == pytest.approx(2 / 20001)
+
+def test_short_pairs():
+    r, p = permutation_correlation([(np.array([1.0]), np.array([2.0])), (np.array([]), np.array([]))], 100, seed=0)
+    assert np.isnan(r).all() and np.isnan(p).all()
+
+def test_unknown_type():
+    with pytest.raises(ValueError):
+        permutation_correlation(_pairs(5), 100, permutation_type='samples')
+
+def _mixed_pairs() -> list[tuple[np.ndarray, np.ndarray]]:
+    # Several lengths, so that the cells are grouped by size and split across the tasks
+    return _pairs(5, 3, seed=1) + _pairs(12, 5, seed=2) + _pairs(40, 4, seed=3) + [(np.array([1.0]), np.array([2.0]))]
+
+@pytest.mark.parametrize('permutation_type', ['pairings', 'independent'])
+def test_workers(permutation_type):
+    pairs = _mixed_pairs()
+    r, p = permutation_correlation(pairs, 2000, seed=7, permutation_type=permutation_type)
+    parallel_r, parallel_p = permutation_correlation(pairs, 2000, seed=7, workers=2, permutation_type=permutation_type)
+    np.testing.assert_array_equal(parallel_r, r)
+    np.testing.assert_array_equal(parallel_p, p)
+
+@pytest.mark.parametrize('max_memory', [1, 2**12, 2**16, 2**30])
+@pytest.mark.parametrize('permutation_type', ['pairings', 'independent'])
+def test_block_sizes(max_memory, permutation_type):
+    # From one permutation of one cell per block to a single block
+    pairs = _mixed_pairs()
+    r, p = permutation_correlation(pairs, 2000, seed=7, permutation_type=permutation_type)
+    blocked_r, blocked_p = permutation_correlation(pairs, 2000, seed=7, max_memory=max_memory, permutation_type=permutation_type)
+    np.testing.assert_array_equal(blocked_r, r)
+    np.testing.assert_array_equal(blocked_p, p)
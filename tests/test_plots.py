@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from Functions.Features import FeaturePlotter, Features, _decimate, _regressions, _render_figures
+from Functions.Synthetic import make_cohort
+
+
+@pytest.fixture(scope='module')
+def plotter() -> FeaturePlotter:
+    acc, _ = make_cohort(2, n_runs=2, n_trials=60, seed=12)
+    return FeaturePlotter(Features(acc, True, accelerometer=True))
+
+def test_regressions():
+    rng = np.random.default_rng(0)
+    panels = [rng.normal(400, 50, n) for n in (30, 2, 7)] + [np.array([500.0])]
+    slope, intercept, mean = _regressions(panels)
+    for k, rt in enumerate(panels[:-1]):
+        expected_slope, expected_intercept = np.polyfit(np.arange(len(rt)), rt, 1)
+        assert slope[k] == pytest.approx(expected_slope, rel=1e-9, abs=1e-9)
+        assert intercept[k] == pytest.approx(expected_intercept, rel=1e-9)
+        assert mean[k] == pytest.approx(np.mean(rt), rel=1e-12)
+    # No line through a single point
+    assert np.isnan(slope[-1]) and np.isnan(intercept[-1]) and mean[-1] == 500
+
+def test_decimate():
+    x, rt = _decimate(np.arange(1000), np.arange(1000.0), 100)
+    assert len(rt) == 100 and rt[0] == 0 and rt[-1] == 999
+    x, rt = _decimate(np.arange(50), np.arange(50.0), 100)
+    assert len(rt) == 50
+
+@pytest.mark.parametrize('level', ['run', 'subject', 'overall'])
+def test_panels(plotter, level):
+    # The RTs of every panel are those of the features of the same level
+    features = plotter.features
+    groups = {'run': lambda name: features.single_run_features_by_type[name[0]][name[1]], 'subject': lambda name: features.subject_features_by_type[name[0]],
+              'overall': lambda name: features.overall_features_by_type}[level]
+    panels = plotter._get_panels(level)
+    assert len(panels) == {'run': 4, 'subject': 2, 'overall': 1}[level]
+    for name, figure in panels:
+        assert set(figure) == {t for t in groups(name) if t in (1, 2, 3, 4)}
+        for test_type, (rt, slope, intercept, mean) in figure.items():
+            np.testing.assert_array_equal(rt, groups(name)[test_type]['rt_acc'])
+            assert mean == pytest.approx(groups(name)[test_type]['mean'], rel=1e-12)
+
+def test_unknown_level(plotter):
+    with pytest.raises(ValueError):
+        plotter._get_panels('trial')
+
+def test_render_all(plotter, tmp_path):
+    paths = plotter.render_all(str(tmp_path), formats=('png', 'svg'), workers=1, dpi=50)
+    expected = [os.path.join(tmp_path, FeaturePlotter.level_folders['run'], f'{subject}_Run{run}') for subject, run in plotter.features.trials.runs]
+    expected += [os.path.join(tmp_path, FeaturePlotter.level_folders['subject'], subject) for subject in plotter.features.trials.subjects]
+    expected += [os.path.join(tmp_path, FeaturePlotter.level_folders['overall'], 'overall')]
+    assert paths == [f'{path}.{format}' for path in expected for format in ('png', 'svg')]
+    assert all(os.path.getsize(path) > 0 for path in paths)
+
+def test_reused_figure(plotter, tmp_path):
+    # A figure drawn after others is the same as a figure drawn on its own
+    panels = [panels for _, panels in plotter._get_panels('subject')]
+    _render_figures([(os.path.join(tmp_path, 'first'), panels[0]), (os.path.join(tmp_path, 'second'), panels[1])], ('png',), 50, None)
+    _render_figures([(os.path.join(tmp_path, 'alone'), panels[1])], ('png',), 50, None)
+    with open(os.path.join(tmp_path, 'second.png'), 'rb') as second, open(os.path.join(tmp_path, 'alone.png'), 'rb') as alone:
+        assert second.read() == alone.read()
+
+def test_workers(plotter, tmp_path):
+    paths = plotter.render_all(str(tmp_path / 'serial'), levels=('run',), workers=1, dpi=50)
+    parallel = plotter.render_all(str(tmp_path / 'parallel'), levels=('run',), workers=2, dpi=50)
+    assert [os.path.basename(path) for path in parallel] == [os.path.basename(path) for path in paths]
+    for path, other in zip(paths, parallel):
+        with open(path, 'rb') as file, open(other, 'rb') as other_file:
+            assert file.read() == other_file.read()
@@ -0,0 +1,80 @@
+import json
+
+from Functions import Profiling
+from Functions.Features import FeatureComparator, Features
+from Functions.Profiling import Profiler, active, count, profiled, stage
+from Functions.Synthetic import make_cohort
+
+
+@profiled('tests')
+def _work(n:int) -> int:
+    count(items=n)
+    with stage('inner', 'tests', kind='sum'):
+        return sum(range(n))
+
+def test_off_records_nothing():
+    with Profiler() as profiler:
+        _work(10)
+    assert active() is None and len(profiler.records) == 2
+    # Stages and counts once the profiler is left are no-ops
+    assert _work(10) == 45
+    assert stage('outer') is Profiling._null_stage
+    with stage('outer') as outer:
+        outer.count(items=1)
+    count(items=1)
+    acc, _ = make_cohort(2, n_trials=20, seed=0)
+    Features(acc, accelerometer=True).calculate_all_features()
+    assert len(profiler.records) == 2 and active() is None
+
+def test_on_records_stages(tmp_path):
+    records = []
+    with Profiler(memory=True, callback=records.append) as profiler:
+        assert active() is profiler
+        _work(10)
+        _work(20)
+    assert active() is None
+    assert [record['name'] for record in profiler.records] == ['inner', '_work', 'inner', '_work']
+    assert records == profiler.records
+    assert [record['depth'] for record in profiler.records] == [1, 0, 1, 0]
+    assert all('allocated' in record for record in profiler.records)
+
+    summary = profiler.summary()
+    assert summary['_work']['calls'] == 2 and summary['_work']['items'] == 30
+    # Only the numeric counts add up
+    assert 'kind' not in summary['inner'] and profiler.records[0]['counts'] == {'kind': 'sum'}
+
+    profiler.save_json(tmp_path / 'profile.json')
+    with open(tmp_path / 'profile.json') as file:
+        assert json.load(file)['summary']['_work']['items'] == 30
+    profiler.save_chrome_trace(tmp_path / 'trace.json')
+    with open(tmp_path / 'trace.json') as file:
+        assert len(json.load(file)['traceEvents']) == 4
+
+def test_nested_profilers():
+    with Profiler() as outer:
+        with Profiler() as inner:
+            _work(5)
+        _work(5)
+    assert len(inner.records) == 2 and len(outer.records) == 2
+
+def test_subjects(tmp_path):
+    acc, box = make_cohort(3, n_runs=2, n_trials=40, seed=1)
+    features = Features(acc, accelerometer=True)
+    with Profiler() as profiler:
+        features.subject_features_by_type
+        with stage('plot', 'tests', subject='X00001'):
+            pass
+        FeatureComparator(features, Features(box)).subject_permuations(50, seed=0, verbose=False)
+
+    subjects = profiler.subject_summary()
+    assert list(subjects) == list(acc)
+    # The levels of every subject at once share their time, only their counts are split
+    level = subjects['X00001']['Features.calculate_subject_features_by_type']
+    assert level['calls'] == 0 and level['shared_calls'] == 1 and level['runs'] == 2
+    assert sum(subjects[subject]['Features.calculate_subject_features_by_type']['trials'] for subject in acc) == len(features.trials.rt_acc)
+    assert subjects['X00001']['plot']['calls'] == 1
+    assert sum(subjects[subject]['FeatureComparator.subject_permuations']['tests'] for subject in acc) == 12
+
+    profiler.save_json(tmp_path / 'profile.json')
+    with open(tmp_path / 'profile.json') as file:
+        assert json.load(file)['subjects']['X00002']['Features.calculate_subject_features_by_type']['runs'] == 2
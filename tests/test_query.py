@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+from Functions.Query import TrialIndex, _bisect, _ranges
+
+
+def _table(seed:int = 0) -> tuple[list[tuple[str, str]], np.ndarray, np.ndarray, np.ndarray]:
+    # 3 subjects with 1 to 3 runs, an empty run, test types 1 to 4 and -1, rounded values for ties and NaN
+    rng = np.random.default_rng(seed)
+    runs = [('A', '1'), ('A', '2'), ('B', '1'), ('C', '1'), ('C', '2'), ('C', '3')]
+    lengths = np.array([20, 15, 0, 30, 10, 25])
+    test_type = rng.choice([1, 2, 3, 4, -1], lengths.sum())
+    values = np.round(rng.normal(400, 80, lengths.sum()), -1)
+    values[rng.random(lengths.sum()) < 0.1] = np.nan
+    return runs, np.concatenate(([0], np.cumsum(lengths))), test_type, values
+
+def test_ranges():
+    np.testing.assert_array_equal(_ranges(np.array([2, 5, 7, 9]), np.array([4, 5, 10, 8])), [2, 3, 7, 8, 9])
+    assert len(_ranges(np.array([3]), np.array([3]))) == 0
+
+def test_bisect():
+    values = np.array([1, 2, 2, 2, 5, 0, 3, 3, 9])
+    start, stop = np.array([0, 5, 5, 9]), np.array([5, 9, 5, 9])
+    # First value above the bound (strict) or not below it, in each segment
+    np.testing.assert_array_equal(_bisect(values, start, stop, 2, strict=True), [4, 6, 5, 9])
+    np.testing.assert_array_equal(_bisect(values, start, stop, 2, strict=False), [1, 6, 5, 9])
+    np.testing.assert_array_equal(_bisect(values, start, stop, 10, strict=False), stop)
+    np.testing.assert_array_equal(_bisect(values, start, stop, -1, strict=True), start)
+
+def test_offsets():
+    runs, run_offsets, test_type, values = _table()
+    index = TrialIndex(runs, run_offsets, test_type, [1, 2, 3, 4], values)
+    assert index.subjects == ['A', 'B', 'C'] and len(index) == 100
+    np.testing.assert_array_equal(index.subject_run_offsets, [0, 2, 3, 6])
+    np.testing.assert_array_equal(index.run_ids(['C', 'A']), [3, 4, 5, 0, 1])
+    np.testing.assert_array_equal(index.run_ids(runs=['2']), [1, 4])
+    for j, name in enumerate([1, 2, 3, 4, -1]):
+        for i in range(len(runs)):
+            # Each cell holds the trials of one test type and run, sorted by value
+            cell = j * len(runs) + i
+            positions = index.positions[index.cell_offsets[cell]:index.cell_offsets[cell + 1]]
+            in_run = np.arange(run_offsets[i], run_offsets[i + 1])
+            np.testing.assert_array_equal(np.sort(positions), in_run[test_type[in_run] == name])
+            assert not np.any(np.diff(values[positions]) < 0)
+    np.testing.assert_array_equal(np.sort(index.segment(2, 3, 6)), np.flatnonzero((test_type == 2) & (np.arange(100) >= 35)))
+
+@pytest.mark.parametrize('subjects, runs, test_types, lower, upper', [
+    (None, None, None, None, None),
+    (['A'], None, None, None, None),
+    (['C'], ['1', '3'], [2, 4], None, None),
+    (None, None, [1], 350, 450),
+    (['A', 'C'], None, None, 400, None),
+    (None, None, None, None, 400),
+    (['B'], None, [3], 0, 1000),
+    (None, None, [5], None, None),
+])
+def test_query(subjects, runs, test_types, lower, upper):
+    table_runs, run_offsets, test_type, values = _table()
+    index = TrialIndex(table_runs, run_offsets, test_type, [1, 2, 3, 4], values)
+    selection = index.query(subjects, runs, test_types, lower, upper)
+
+    run_index = np.repeat(np.arange(len(table_runs)), np.diff(run_offsets))
+    expected = np.ones(len(values), dtype=bool)
+    if subjects is not None:
+        expected &= np.isin([table_runs[i][0] for i in run_index], subjects)
+    if runs is not None:
+        expected &= np.isin([table_runs[i][1] for i in run_index], runs)
+    if test_types is not None:
+        expected &= np.isin(test_type, test_types)
+    with np.errstate(invalid='ignore'):
+        # The bounds are excluded, NaN is never in a window
+        if lower is not None:
+            expected &= values > lower
+        if upper is not None:
+            expected &= values < upper
+    np.testing.assert_array_equal(selection.positions, np.flatnonzero(expected))
+
+    selected = selection.select(value=values)
+    np.testing.assert_array_equal(selected['test_type'], test_type[expected])
+    np.testing.assert_array_equal(selected['trial'], np.flatnonzero(expected) - run_offsets[run_index[expected]])
+
+def test_block_of_runs():
+    runs, run_offsets, test_type, values = _table()
+    index = TrialIndex(runs, run_offsets, test_type, [1, 2, 3, 4], values)
+    # Consecutive whole runs are a slice, their columns are views
+    selection = index.query(['C'])
+    assert isinstance(selection._positions, slice)
+    assert np.shares_memory(selection.take(values), values)
+
+def test_group_by():
+    runs, run_offsets, test_type, values = _table()
+    index = TrialIndex(runs, run_offsets, test_type, [1, 2, 3, 4])
+    with pytest.raises(ValueError):
+        index.query(lower=0)
+    selection = index.query()
+    group, n_groups, names = selection.group_by('subject', 'test_type')
+    assert n_groups == 12 and names[5] == ('B', 2)
+    # The trials of no test type are in no group
+    np.testing.assert_array_equal(group == n_groups, test_type == -1)
+    split = selection.split(values, 'subject', 'test_type')
+    # Subject C owns the trials from 35 on
+    np.testing.assert_array_equal(split[8], values[35:][test_type[35:] == 1])
+    with pytest.raises(ValueError):
+        selection.group_by('trial')
+
+def _assert_same_index(index:TrialIndex, expected:TrialIndex):
+    assert index.runs == expected.runs and index.subjects == expected.subjects
+    for name in ['run_offsets', 'run_subject', 'subject_run_offsets', 'run_index', 'type_index', 'positions', 'cell_offsets']:
+        np.testing.assert_array_equal(getattr(index, name), getattr(expected, name), err_msg=name)
+    if expected.sorted_values is None:
+        assert index.sorted_values is None
+    else:
+        np.testing.assert_array_equal(index.sorted_values, expected.sorted_values)
+
+@pytest.mark.parametrize('with_values', [True, False])
+@pytest.mark.parametrize('start, stop, new_runs, new_lengths', [
+    (2, 2, [('B', '2')], [12]), # Insert a run in the middle
+    (6, 6, [('D', '1')], [8]), # Append a subject
+    (1, 2, [('A', '2')], [40]), # Replace a run
+    (2, 3, [], []), # Remove the only run of a subject
+    (0, 1, [], []), # Remove the first run
+    (3, 3, [('B', '2'), ('B', '3')], [5, 0]), # Several runs, one of them empty
+])
+def test_splice(start, stop, new_runs, new_lengths, with_values):
+    runs, run_offsets, old_test_type, old_values = _table()
+    index = TrialIndex(runs, run_offsets, old_test_type, [1, 2, 3, 4], old_values if with_values else None)
+    rng = np.random.default_rng(1)
+    first, last = run_offsets[start], run_offsets[stop]
+    test_type = np.concatenate((old_test_type[:first], rng.choice([1, 2, 3, 4, -1], sum(new_lengths)), old_test_type[last:]))
+    values = np.concatenate((old_values[:first], np.round(rng.normal(400, 80, sum(new_lengths)), -1), old_values[last:]))
+
+    # The index is spliced from the columns after the splice, and equals an index built from them
+    lengths = list(np.diff(run_offsets))
+    lengths = lengths[:start] + new_lengths + lengths[stop:]
+    runs = runs[:start] + new_runs + runs[stop:]
+    index.splice(start, stop, new_runs, new_lengths, test_type, values if with_values else None)
+    expected = TrialIndex(runs, np.concatenate(([0], np.cumsum(lengths))), test_type, [1, 2, 3, 4], values if with_values else None)
+    _assert_same_index(index, expected)
+    if with_values:
+        np.testing.assert_array_equal(index.query(['C'], None, [2], 350, 450).positions, expected.query(['C'], None, [2], 350, 450).positions)
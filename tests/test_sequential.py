@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from Functions.Features import Features
+from Functions.Synthetic import make_cohort
+from tests.test_trial_store import _full_rt
+
+
+features_names = ['count', 'mean', 'median', 'std', 'min', 'max']
+
+def _statistics(rt:list) -> dict:
+    rt = np.array(rt, dtype=float)
+    if len(rt) == 0:
+        return {'count': 0, **{feature: np.nan for feature in features_names[1:]}}
+    return {'count': len(rt), 'mean': np.mean(rt), 'median': np.median(rt), 'std': np.std(rt), 'min': np.min(rt), 'max': np.max(rt)}
+
+def _effects(transitions:list[tuple[int, int, float]], test_types:list[int]) -> dict:
+    # Features of each transition from the (previous type, current type, RT) of the counted trials
+    effects = {'repeat': _statistics([rt for previous, current, rt in transitions if previous == current]),
+               'switch': _statistics([rt for previous, current, rt in transitions if previous != current])}
+    for p in test_types:
+        for c in test_types:
+            effects[(p, c)] = _statistics([rt for previous, current, rt in transitions if (previous, current) == (p, c)])
+    effects['switch_cost'] = effects['switch']['mean'] - effects['repeat']['mean']
+    return effects
+
+def _reference(dataset:dict, accelerometer:bool, only_physiological:bool) -> tuple[dict, dict, dict]:
+    # Loop over the trials of every run: the previous trial of the same run, both of a test type, and a valid current RT
+    test_types = sorted({int(t) for subject in dataset for run in dataset[subject] for t in np.ravel(dataset[subject][run]['test_type']) if t > 0})
+    runs, subjects, overall = dict(), dict(), []
+    for subject in dataset:
+        for run, data in dataset[subject].items():
+            if accelerometer:
+                rt = _full_rt(data['vb_index'], data['mv_index'], data['t']) * 1000
+            else:
+                rt = np.array([np.nan if value == -1 else value * 1000 for value in np.ravel(data['all_rt_box'])])
+            test_type = np.ravel(data['test_type'])
+            transitions = []
+            for i in range(1, len(test_type)):
+                if test_type[i - 1] in test_types and test_type[i] in test_types and not np.isnan(rt[i]):
+                    if not only_physiological or Features.lower_limit < rt[i] < Features.upper_limit:
+                        transitions.append((int(test_type[i - 1]), int(test_type[i]), rt[i]))
+            runs.setdefault(subject, dict())[run] = _effects(transitions, test_types)
+            subjects.setdefault(subject, []).extend(transitions)
+            overall.extend(transitions)
+    return runs, {subject: _effects(transitions, test_types) for subject, transitions in subjects.items()}, _effects(overall, test_types)
+
+def _assert_same_effects(effects:dict, expected:dict, path:str):
+    assert set(effects) == set(expected), path
+    for key, features in expected.items():
+        if key == 'switch_cost':
+            np.testing.assert_allclose(effects[key], features, rtol=1e-9, err_msg=path)
+            continue
+        assert effects[key]['count'] == features['count'], f'{path}/{key}'
+        np.testing.assert_allclose([effects[key][f] for f in features_names[1:]], [features[f] for f in features_names[1:]], rtol=1e-9, err_msg=f'{path}/{key}')
+
+@pytest.mark.parametrize('only_physiological', [False, True])
+@pytest.mark.parametrize('accelerometer', [True, False])
+def test_levels(accelerometer, only_physiological):
+    acc, box = make_cohort(4, n_runs=3, n_trials=100, acc_missing=0.1, box_missing=0.1, seed=14)
+    dataset = acc if accelerometer else box
+    features = Features(dataset, only_physiological, accelerometer=accelerometer)
+    runs, subjects, overall = _reference(dataset, accelerometer, only_physiological)
+    for subject in runs:
+        for run in runs[subject]:
+            _assert_same_effects(features.run_sequential_effects[subject][run], runs[subject][run], f'{subject}/{run}')
+        _assert_same_effects(features.subject_sequential_effects[subject], subjects[subject], subject)
+    _assert_same_effects(features.overall_sequential_effects, overall, 'overall')
+
+def test_transition_matrix():
+    acc, _ = make_cohort(3, n_runs=2, n_trials=80, seed=15)
+    features = Features(acc, True, accelerometer=True)
+    test_types, matrix = features.get_transition_matrix('count')
+    np.testing.assert_array_equal(test_types, [1, 2, 3, 4])
+    effects = features.overall_sequential_effects
+    assert matrix.sum() == effects['repeat']['count'] + effects['switch']['count']
+    assert np.trace(matrix) == effects['repeat']['count']
+    subject = list(acc)[1]
+    _, matrix = features.get_transition_matrix('mean', subject, '2')
+    assert matrix[2, 0] == features.run_sequential_effects[subject]['2'][(3, 1)]['mean']
@@ -0,0 +1,62 @@
+import numpy as np
+import os
+from scipy.io import savemat
+
+from Functions.Detection import get_segmentation, sampling
+from Functions.SignalStore import SignalStore, convert_directory, convert_mat, write_run
+
+
+def _signal(n_samples:int = 5 * sampling + 1, n_channels:int = 4) -> np.ndarray:
+    return np.random.default_rng(0).normal(size=(n_samples, n_channels))
+
+def test_data_layout(tmp_path):
+    signal = _signal()
+    savemat(tmp_path / 'X00001_Run1_acc.mat', {'data': signal, 'sampling': sampling})
+    run = convert_mat(str(tmp_path / 'X00001_Run1_acc.mat'), str(tmp_path / 'store'))
+    assert os.path.basename(run.path) == 'X00001_Run1'
+    np.testing.assert_array_equal(run.signal, signal)
+    np.testing.assert_array_equal(run.segmentation, get_segmentation(len(signal)))
+    assert run.sampling == sampling and run.channels == [f'Channel {i + 1}' for i in range(4)]
+    np.testing.assert_array_equal(run.trial(0), signal[:run.segmentation[1]])
+    np.testing.assert_array_equal(run.trial(1), signal[run.segmentation[1]:])
+    np.testing.assert_array_equal(run.channel('Channel 3'), signal[:, 2])
+
+def test_channels_layout(tmp_path):
+    signal = _signal(n_channels=2)
+    channels = np.empty((1, 2), dtype=object)
+    channels[0, 0] = {'data': signal[:, 0], 'name': 'FDI'}
+    channels[0, 1] = {'data': signal[:, 1], 'name': 'ADM'}
+    savemat(tmp_path / 'X00002_Run1.mat', {'channels': channels, 'sampling': 1000})
+    run = convert_mat(str(tmp_path / 'X00002_Run1.mat'), str(tmp_path / 'store'))
+    np.testing.assert_array_equal(run.signal, signal)
+    assert run.channels == ['FDI', 'ADM'] and run.sampling == 1000
+
+def test_signal_layout(tmp_path):
+    signal = _signal()
+    t = np.arange(len(signal)) / sampling
+    segmentation_points = np.array([0, 1.5, 3.5])
+    savemat(tmp_path / 'X00003_Run2.mat', {'signal': signal, 't': t, 'segmentation_points': segmentation_points})
+    run = convert_mat(str(tmp_path / 'X00003_Run2.mat'), str(tmp_path / 'store'))
+    np.testing.assert_array_equal(run.signal, signal)
+    # From 0, as segmentation_points_index - 1
+    np.testing.assert_array_equal(run.segmentation, [0, 2999, 6999])
+    assert run.sampling == sampling
+
+def test_directory(tmp_path):
+    savemat(tmp_path / 'X00001_Run1_acc.mat', {'data': _signal(), 'sampling': sampling})
+    savemat(tmp_path / 'X00001_Run1.mat', {'presstime': np.zeros((1, 10)), 'triallist': np.ones((1, 10))})
+    store = SignalStore(str(tmp_path / 'store'))
+    assert store.names() == []
+    assert convert_directory(str(tmp_path / '*.mat'), store.directory) == ['X00001_Run1']
+    assert store.names() == ['X00001_Run1'] and 'X00001_Run1' in store
+    # Files older than the store are not converted again
+    modified = os.path.getmtime(tmp_path / 'store' / 'X00001_Run1' / 'metadata.json')
+    assert convert_directory(str(tmp_path / '*.mat'), store.directory) == ['X00001_Run1']
+    assert os.path.getmtime(tmp_path / 'store' / 'X00001_Run1' / 'metadata.json') == modified
+
+def test_write_channels(tmp_path):
+    signal = _signal()
+    run = write_run(str(tmp_path), 'run', [signal[:, i] for i in range(signal.shape[1])], segmentation=[0, 100])
+    np.testing.assert_array_equal(run.signal, signal)
+    assert run.n_trials == 2 and len(run.trial(1)) == len(signal) - 100
+    np.testing.assert_allclose(run.time(0, 3), np.linspace(0, len(signal) / sampling, len(signal))[:3])
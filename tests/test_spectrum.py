@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from Functions.Detection import sampling
+from Functions.SignalStore import write_run
+from Functions.Spectrum import spectrum_features, trial_spectra, vibration_quality
+
+
+def _run(directory, name:str, frequency:float, n_trials:int = 6, amplitude:float = 1.0, seed:int = 0):
+    # 2 s trials, a burst of a pure sine on channel 1 and noise on both channels
+    rng = np.random.default_rng(seed)
+    signal = rng.normal(0, 0.01, (n_trials * 2 * sampling, 2))
+    t = np.arange(2 * sampling) / sampling
+    for trial in range(n_trials):
+        signal[trial * 2 * sampling:(trial + 1) * 2 * sampling, 1] += amplitude * np.sin(2 * np.pi * frequency * t)
+    return write_run(str(directory), name, signal, segmentation=np.arange(n_trials) * 2 * sampling)
+
+def test_peak_frequency(tmp_path):
+    run = _run(tmp_path, 'sine', 126)
+    frequencies, psd = trial_spectra(run)
+    assert psd.shape == (6, len(frequencies), 2)
+    features = spectrum_features(frequencies, psd)
+    # 2 Hz resolution, the peak is the closest frequency
+    np.testing.assert_array_equal(features['peak_frequency'][:, 1], 126)
+    assert np.all(features['snr_db'][:, 1] > 30)
+    assert np.all(features['band_power'][:, 1] > 100 * features['band_power'][:, 0])
+    # Power of a sine of amplitude 1, in the vibration band
+    np.testing.assert_allclose(features['band_power'][:, 1], 0.5, rtol=0.05)
+
+def test_peak_frequency_out_of_band(tmp_path):
+    run = _run(tmp_path, 'sine', 200)
+    features = spectrum_features(*trial_spectra(run))
+    np.testing.assert_array_equal(features['peak_frequency'][:, 1], 200)
+
+def test_resolution():
+    frequencies = np.linspace(0, 1000, 11)
+    with pytest.raises(ValueError):
+        spectrum_features(frequencies, np.ones((1, 11, 1)))
+
+def test_vibration_quality(tmp_path):
+    runs = [_run(tmp_path, 'good', 125), _run(tmp_path, 'off', 200, seed=1), _run(tmp_path, 'weak', 125, amplitude=0.001, seed=2),
+            write_run(str(tmp_path), 'empty', np.zeros((10, 2)), segmentation=np.zeros(0))]
+    quality = vibration_quality(runs)
+    assert quality['n_trials'].tolist() == [6, 6, 6, 0]
+    assert abs(quality['peak_frequency'][0] - 125) <= 1
+    assert quality['off_band_fraction'].tolist()[:2] == [0, 1]
+    assert quality['bad_stimulus'].tolist()[:3] == [False, True, True]
+    assert np.isnan(quality['snr_db'][3])
+    # The pool gives the same rows in the same order
+    pooled = vibration_quality([run.path for run in runs], workers=2)
+    for field in quality.dtype.names:
+        np.testing.assert_array_equal(pooled[field], quality[field])
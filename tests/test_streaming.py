@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from Functions.Detection import detect_run
+from Functions.Streaming import StreamingDetector, replay_blocks
+from tests.test_detection import detection_signal
+
+
+# Every test type and both fingers, longer than the calibration of the thresholds
+types = np.tile([1, 2, 3, 4, 1, 3, 2, 4], 3)
+
+def _stream(signal:np.ndarray, block_size:int, triallist:np.ndarray = types) -> dict[str, np.ndarray]:
+    detector = StreamingDetector(signal.shape[1], triallist=triallist)
+    detector.run_blocks(replay_blocks(signal, block_size))
+    return detector.get_run_data()
+
+def test_same_as_offline():
+    signal, _, _ = detection_signal(types)
+    offline = detect_run(signal, triallist=types)
+    streamed = _stream(signal, 100)
+    np.testing.assert_array_equal(streamed['test_type'], offline['test_type'])
+    np.testing.assert_array_equal(streamed['acc_test_type'], offline['acc_test_type'])
+    assert streamed['correct_nbr'] == offline['correct_nbr'] == len(types)
+    # The causal filters move the onsets by a few samples
+    assert np.all(np.abs(streamed['vb_index'] - offline['vb_index']) <= 30)
+    assert np.all(np.abs(streamed['mv_index'] - offline['mv_index']) <= 30)
+    np.testing.assert_allclose(streamed['rt_acc'], offline['rt_acc'], atol=25)
+
+def test_same_finger():
+    # The vibration of a finger is not taken for its movement, 300 ms later
+    same = np.tile([3, 4], 12)
+    signal, _, _ = detection_signal(same)
+    streamed = _stream(signal, 100, same)
+    np.testing.assert_array_equal(streamed['test_type'], same)
+    assert not np.any(np.isnan(streamed['rt_acc']))
+
+@pytest.mark.parametrize('block_size', [37, 1000, 4001, None])
+def test_block_size(block_size):
+    signal, _, _ = detection_signal(types)
+    reference = _stream(signal, 100)
+    streamed = _stream(signal, len(signal) if block_size is None else block_size)
+    for variable in ('test_type', 'vb_index', 'mv_index', 'acc_test_type'):
+        np.testing.assert_array_equal(streamed[variable], reference[variable])
+    np.testing.assert_array_equal(streamed['rt_acc'], reference['rt_acc'])
+
+def test_without_triallist():
+    signal, _, _ = detection_signal(types)
+    detector = StreamingDetector(2)
+    events = []
+    for block in replay_blocks(signal, 500):
+        events += detector.process(block)[0]
+    detector.finish()
+    assert [trial['test_type'] for trial in detector.trials] == types.tolist()
+    assert all(trial['correct'] is None for trial in detector.trials)
+    # One vibration and one movement onset per trial
+    assert sorted((event['trial'], event['kind']) for event in events) == [(trial, kind) for trial in range(len(types)) for kind in ('movement', 'vibration')]
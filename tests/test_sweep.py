@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from Functions.Features import Features
+from Functions.Synthetic import make_cohort
+
+
+windows = [(200, 700), (300, 500), (250, 260)]
+
+def _level(features:Features, level:str) -> dict:
+    # (subject, run) > test type (0: all the trials) > features, and the ratio of each group of a level
+    if level == 'run':
+        pooled = {(subject, run): group for subject in features.single_run_features for run, group in features.single_run_features[subject].items()}
+        by_type = {(subject, run): group for subject in features.single_run_features_by_type for run, group in features.single_run_features_by_type[subject].items()}
+        ratio = {(subject, run): value for subject in features.run_hetero_homo_ratio for run, value in features.run_hetero_homo_ratio[subject].items()}
+    elif level == 'subject':
+        pooled = {(subject, ''): group for subject, group in features.subject_features.items()}
+        by_type = {(subject, ''): group for subject, group in features.subject_features_by_type.items()}
+        ratio = {(subject, ''): value for subject, value in features.subject_hetero_homo_ratio.items()}
+    else:
+        pooled, by_type, ratio = {('', ''): features.overall_features}, {('', ''): features.overall_features_by_type}, {('', ''): features.overall_hetero_homo_ratio}
+    return {name: {0: pooled[name], **{t: group for t, group in by_type[name].items() if t not in ('RT', 'test_type')}} for name in pooled}, ratio
+
+@pytest.mark.parametrize('level', ['run', 'subject', 'overall'])
+def test_levels(level):
+    # Each window gives the features computed with it as the limits
+    acc, _ = make_cohort(4, n_runs=2, n_trials=80, acc_missing=0.1, seed=17)
+    sweep = Features(acc, accelerometer=True).sweep_limits(windows, level)
+    for lower, upper in windows:
+        features = Features(acc, True, accelerometer=True)
+        features.lower_limit, features.upper_limit = lower, upper
+        groups, ratio = _level(features, level)
+        rows = sweep[(sweep['lower'] == lower) & (sweep['upper'] == upper)]
+        assert {(row['subject'], row['run']) for row in rows} == set(groups)
+        for row in rows:
+            name = (row['subject'], row['run'])
+            np.testing.assert_allclose(row['hetero_homo_ratio'], ratio[name], rtol=1e-9)
+            group = groups[name].get(int(row['test_type']))
+            if group is None or not np.any(np.isfinite(group['rt_acc'])):
+                # A test type without any RT in the window
+                assert row['count'] == 0 and np.isnan(row['mean'])
+                continue
+            assert row['count'] == len(group['rt_acc'])
+            for feature in ['mean', 'median', 'min', 'max']:
+                np.testing.assert_allclose(row[feature], group[feature], rtol=1e-12, err_msg=f'{name}/{row["test_type"]}/{feature}')
+            np.testing.assert_allclose(row['std'], group['std'], rtol=1e-9, atol=1e-9)
+
+def test_unknown_level():
+    acc, _ = make_cohort(2, n_runs=1, n_trials=40, seed=17)
+    with pytest.raises(ValueError):
+        Features(acc, accelerometer=True).sweep_limits(windows, 'trial')
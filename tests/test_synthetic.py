@@ -0,0 +1,41 @@
+import numpy as np
+
+from Functions.Loader import box_null_value
+from Functions.Synthetic import make_cohort
+
+
+def test_cohort_shape():
+    acc, box = make_cohort(3, n_runs=2, n_trials=50, seed=0)
+    assert list(acc) == list(box) == ['X00000', 'X00001', 'X00002']
+    for subject in acc:
+        assert list(acc[subject]) == list(box[subject]) == ['1', '2']
+        for run in acc[subject]:
+            data = acc[subject][run]
+            for variable in ('test_type', 'vb_index', 'mv_index'):
+                assert data[variable].shape == (1, 50)
+            assert data['rt_acc'].shape == data['acc_test_type'].shape
+            assert data['correct_nbr'][0, 0] == data['rt_acc'].shape[1]
+            assert box[subject][run]['presstime'].shape == (1, 50)
+            assert len(box[subject][run]['all_rt_box']) == 50
+
+def test_cohort_seed():
+    first, _ = make_cohort(2, n_trials=20, seed=1)
+    second, _ = make_cohort(2, n_trials=20, seed=1)
+    np.testing.assert_array_equal(first['X00001']['2']['rt_acc'], second['X00001']['2']['rt_acc'])
+
+def test_missing_rates():
+    acc, box = make_cohort(20, n_runs=2, n_trials=250, acc_missing=0.1, box_missing=0.2, incorrect=0, seed=2)
+    test_type = np.concatenate([run['test_type'][0] for subject in acc.values() for run in subject.values()])
+    presstime = np.concatenate([run['presstime'][0] for subject in box.values() for run in subject.values()])
+    # 10000 trials, the rates are within 3 standard deviations
+    assert abs(np.mean(test_type == -1) - 0.1) < 3 * np.sqrt(0.1 * 0.9 / 10000)
+    assert abs(np.mean(presstime == box_null_value) - 0.2) < 3 * np.sqrt(0.2 * 0.8 / 10000)
+    assert not np.any(test_type == 0)
+
+def test_no_missing():
+    acc, box = make_cohort(2, n_trials=40, acc_missing=0, box_missing=0, incorrect=0, seed=3)
+    for subject in acc:
+        for run in acc[subject]:
+            assert acc[subject][run]['rt_acc'].shape == (1, 40)
+            assert np.all(acc[subject][run]['rt_acc'] > 0)
+            assert not np.any(box[subject][run]['presstime'] == box_null_value)
@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+from Functions.Features import Features
+from Functions.Synthetic import make_cohort
+from Functions.TrialStore import TrialStore, get_full_rt
+
+
+levels = ['single_run_features', 'single_run_features_by_type', 'subject_features', 'subject_features_by_type',
+          'overall_features', 'overall_features_by_type', 'subject_hetero_homo_ratio', 'overall_hetero_homo_ratio']
+
+def _assert_same(a, b, rtol:float):
+    if isinstance(a, dict):
+        assert list(a) == list(b)
+        for key in a:
+            _assert_same(a[key], b[key], rtol)
+    elif isinstance(a, str):
+        assert a == b
+    else:
+        np.testing.assert_allclose(a, b, rtol=rtol, atol=1e-9, equal_nan=True)
+
+def _assert_same_records(a:np.ndarray, b:np.ndarray):
+    # Field by field, the missing RTs are NaN
+    assert a.dtype == b.dtype
+    for field in a.dtype.names:
+        np.testing.assert_array_equal(a[field], b[field])
+
+def _assert_same_store(store:TrialStore, reference:TrialStore):
+    assert store.runs == reference.runs and store.subjects == reference.subjects and store.kind == reference.kind
+    _assert_same_records(store.trials, reference.trials)
+    _assert_same_records(store.full, reference.full)
+    np.testing.assert_array_equal(store.run_offsets, reference.run_offsets)
+    np.testing.assert_array_equal(store.full_offsets, reference.full_offsets)
+    np.testing.assert_array_equal(store.subject_run_offsets, reference.subject_run_offsets)
+
+def _full_rt(vb_index:np.ndarray, mv_index:np.ndarray, t:np.ndarray) -> np.ndarray:
+    # Full RTs from a loop over the trials, as before the gather, with NaN instead of -1
+    t = np.ravel(t)
+    return np.array([t[abs(round(mv - vb))] if vb != -1 and mv != -1 else np.nan for vb, mv in zip(np.ravel(vb_index), np.ravel(mv_index))], dtype=float)
+
+def test_full_rt(tmp_path):
+    rng = np.random.default_rng(5)
+    t = np.arange(5000) / 1000
+    vb_index = rng.integers(0, 2000, 300).astype(float)
+    mv_index = vb_index + rng.integers(100, 800, 300) + rng.choice([0, 0.5, 0.25], 300)
+    vb_index[rng.random(300) < 0.1] = -1
+    mv_index[rng.random(300) < 0.1] = -1
+    expected = _full_rt(vb_index, mv_index, t)
+    np.testing.assert_array_equal(get_full_rt(vb_index[None, :], mv_index[None, :], t[None, :]), expected)
+
+    # A memory-mapped t is only read at the onsets
+    np.save(tmp_path / 't.npy', t[None, :])
+    mapped = np.load(tmp_path / 't.npy', mmap_mode='r')
+    np.testing.assert_array_equal(get_full_rt(vb_index, mv_index, mapped), expected)
+    assert np.shares_memory(np.ravel(mapped), mapped)
+
+def test_features_full_rt():
+    acc, box = make_cohort(3, n_runs=2, n_trials=50, acc_missing=0.2, box_missing=0.2, seed=6)
+    for dataset, accelerometer in ((acc, True), (box, False)):
+        runs = [(subject, run) for subject in dataset for run in dataset[subject]]
+        if accelerometer:
+            expected = {key: _full_rt(dataset[key[0]][key[1]]['vb_index'], dataset[key[0]][key[1]]['mv_index'], dataset[key[0]][key[1]]['t']) for key in runs}
+        else:
+            expected = {key: np.where(np.ravel(dataset[key[0]][key[1]]['all_rt_box']) == -1, np.nan, np.ravel(dataset[key[0]][key[1]]['all_rt_box'])) for key in runs}
+        assert any(np.isnan(rt).any() for rt in expected.values())
+
+        # NaN for the missing trials at every level, end to end
+        features = Features(dataset, accelerometer=accelerometer)
+        for subject, run in runs:
+            np.testing.assert_array_equal(features.single_run_features_by_type[subject][run]['RT'], expected[(subject, run)])
+        for subject in dataset:
+            np.testing.assert_array_equal(features.subject_features_by_type[subject]['RT'], np.concatenate([expected[(subject, run)] for run in dataset[subject]]))
+        np.testing.assert_array_equal(features.overall_features_by_type['RT'], np.concatenate([expected[key] for key in runs]))
+
+def test_views():
+    acc, _ = make_cohort(3, n_trials=40, seed=0)
+    store = TrialStore.from_dataset(acc)
+    assert list(store) == list(acc) and 'X00001' in store and len(store) == 3
+    for subject in acc:
+        for run, data in store[subject].items():
+            np.testing.assert_allclose(data['rt_acc'], np.ravel(acc[subject][run]['rt_acc']), rtol=1e-6)
+            np.testing.assert_array_equal(data['test_type'], np.ravel(acc[subject][run]['test_type']))
+    with pytest.raises(KeyError):
+        store['X99999']
+
+def test_splice():
+    acc, box = make_cohort(4, n_runs=3, n_trials=30, seed=1)
+    store = TrialStore.from_dataset({subject: dict(acc[subject]) for subject in ['X00000', 'X00001']})
+    expected = {subject: dict(acc[subject]) for subject in ['X00000', 'X00001']}
+
+    # Replaced in place, after the runs of its subject, and a new subject at the end
+    store.set_run('X00000', '2', acc['X00003']['1'])
+    expected['X00000']['2'] = acc['X00003']['1']
+    store.set_run('X00000', '4', acc['X00003']['2'])
+    expected['X00000']['4'] = acc['X00003']['2']
+    store.set_run('X00002', '1', acc['X00002']['1'])
+    expected['X00002'] = {'1': acc['X00002']['1']}
+    # Removing the last run of a subject removes the subject
+    store.remove_run('X00000', '1')
+    del expected['X00000']['1']
+    for run in ['1', '2', '3']:
+        store.remove_run('X00001', run)
+    del expected['X00001']
+    _assert_same_store(store, TrialStore.from_dataset(expected))
+
+    with pytest.raises(ValueError):
+        store.set_run('X00000', '5', box['X00000']['1'])
+
+def test_append_in_place():
+    acc, _ = make_cohort(5, n_runs=2, n_trials=30, seed=4)
+    store = TrialStore.from_dataset({'X00000': acc['X00000']})
+    store.set_run('X00001', '1', acc['X00001']['1'])
+    buffer = store._trial_buffer
+    views = [store.run('X00001', '1')['rt_acc'], store.full['rt']]
+    before = [view.copy() for view in views]
+
+    # Runs appended after all the others go to the spare room of the buffer
+    store.set_run('X00001', '2', acc['X00001']['2'])
+    assert store._trial_buffer is buffer
+    # Any other splice copies the records, the views given out before never change
+    store.set_run('X00000', '3', acc['X00002']['1'])
+    store.remove_run('X00001', '2')
+    store.set_run('X00001', '2', acc['X00003']['2'])
+    for view, values in zip(views, before):
+        np.testing.assert_array_equal(view, values)
+    _assert_same_store(store, TrialStore.from_dataset({'X00000': {**acc['X00000'], '3': acc['X00002']['1']},
+                                                       'X00001': {'1': acc['X00001']['1'], '2': acc['X00003']['2']}}))
+
+def test_save_load(tmp_path):
+    acc, box = make_cohort(3, n_trials=30, seed=2)
+    for dataset in (acc, box):
+        store = TrialStore.from_dataset(dataset)
+        store.save(tmp_path / 'store.npz')
+        _assert_same_store(TrialStore.load(tmp_path / 'store.npz'), store)
+
+@pytest.mark.parametrize('only_physiological', [False, True])
+def test_features_parity(tmp_path, only_physiological):
+    acc, box = make_cohort(4, n_trials=40, seed=3)
+    for dataset, accelerometer in ((acc, True), (box, False)):
+        TrialStore.from_dataset(dataset).save(tmp_path / 'store.npz')
+        features = Features(dataset, only_physiological, accelerometer=accelerometer)
+        stored = Features(TrialStore.load(tmp_path / 'store.npz'), only_physiological, accelerometer=accelerometer)
+        features.calculate_all_features()
+        stored.calculate_all_features()
+        for level in levels:
+            # The store keeps the RTs as float32
+            _assert_same(getattr(stored, level), getattr(features, level), rtol=1e-5)